@@ -1,6 +1,48 @@
-from datetime import datetime, timedelta
-from collections import UserDict
+import time
+
+STARTED = time.perf_counter()  # when the imports started, for the timings of one-shot commands
+
+from datetime import date, datetime, timedelta
+from collections import Counter, OrderedDict, UserDict
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from calendar import day_name, isleap, monthrange
+from itertools import accumulate, chain, groupby, islice
+import argparse
+import gc
+import heapq
+import importlib.util
+import json
+import math
+import mmap
+import os
 import pickle
+import re
+import struct
+import sys
+import threading
+import types
+import weakref
+import zlib
+
+# csv, sqlite3, concurrent.futures and numpy are imported by the functions using
+# them, so that commands which do not need them start faster
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def birthday_in_year(month, day, year):
+    # 29 February birthdays are celebrated on 28 February in non-leap years
+    if month == 2 and day == 29 and not isleap(year):
+        return date(year, 2, 28)
+    return date(year, month, day)
 
 
 class NumberError(Exception):
@@ -12,103 +54,208 @@ class NameError(Exception):
 
 
 class Field:
+    __slots__ = ("value",)
+    interned = False  # values repeated across contacts, like addresses, share one string
+
     def __init__(self, value):
-        self.value = value
+        self.value = sys.intern(value) if self.interned else value
 
     def __str__(self):
         return str(self.value)
 
+    def __reduce__(self):
+        return stored_field, (type(self), self.value)
+
+    def __setstate__(self, state):
+        # Fields pickled before __slots__ were used carry their __dict__
+        value = state["value"]
+        self.value = sys.intern(value) if self.interned else value
+
+
+class Missing:
+    # Shared placeholder for a field that has no value yet, pickled by reference
+    __slots__ = ("text", "global_name")
+
+    def __init__(self, text, global_name):
+        self.text = text
+        self.global_name = global_name
+
+    def __str__(self):
+        return self.text
+
+    def __bool__(self):
+        return False
+
+    def __reduce__(self):
+        return self.global_name
+
+
+NO_PHONE = Missing("not yet initieted", "NO_PHONE")
+NO_ADDRESS = Missing("Not yet added", "NO_ADDRESS")
+NO_EMAIL = Missing("No email added", "NO_EMAIL")
+LEGACY_PLACEHOLDERS = {missing.text: missing for missing in (NO_PHONE, NO_ADDRESS, NO_EMAIL)}
+
+
+class NoNotes(dict):
+    # Shared empty notes of every contact without notes, pickled by reference.
+    # It cannot be changed: a contact gets its own dict with its first note.
+    __slots__ = ()
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError("NO_NOTES is shared by every contact without notes and cannot be changed.")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _frozen
+
+    def __reduce__(self):
+        return "NO_NOTES"
+
+
+NO_NOTES = NoNotes()
+
 
 class Name(Field):
+    __slots__ = ()
+
     def __init__(self, value):
         try:
-            if value.isalpha():
+            if self.is_valid(value):
                 super().__init__(value)
             else:
                 raise NameError("Name must contain only alphabetic characters.\n")
         except ValueError as e:
             raise e
 
+    @staticmethod
+    def is_valid(value):
+        return value.isalpha()
+
 
 class Phone(Field):
+    __slots__ = ()
+    PATTERN = re.compile(r"\d{10}")
+
     def __init__(self, value):
-        if len(value) == 10 and value.isdigit():
+        if self.is_valid(value):
             super().__init__(value)
         else:
             raise NumberError("Number must be of 10 digits.\n")
 
+    @classmethod
+    def is_valid(cls, value):
+        return cls.PATTERN.fullmatch(value) is not None
+
 
 class Birthday(Field):
+    __slots__ = ()
+    PATTERN = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
     def __init__(self, value):
+        self.value = self.parse(value)
+
+    @classmethod
+    def parse(cls, value):
+        match = cls.PATTERN.fullmatch(value)
         try:
-            self.value = datetime.strptime(value, "%d.%m.%Y").date()
+            if match is None:
+                raise ValueError
+            day, month, year = map(int, match.groups())
+            return date(year, month, day)
         except ValueError:
             raise ValueError("Birthday must be in DD.MM.YYYY format.\n")
 
 
 class Address(Field):
+    __slots__ = ()
+    interned = True
+
     def __init__(self, value):
         super().__init__(value)
 
 
 class Email(Field):
+    __slots__ = ()
+    PATTERN = re.compile(r"[^@]*@[^@]*\.")  # an @ sign and at least one '.' after it
+
     def __init__(self, email):
-        contains_at = False
-        contains_dot = False
-        for char in email:
-            if char == "@":
-                contains_at = True
-        afterAt = email.split("@")
-        if len(afterAt) > 1 and "." in afterAt[1]:
-            contains_dot = True
-
-        if contains_at and contains_dot:
+        if self.is_valid(email):
             super().__init__(email)
         else:
             raise ValueError(
                 "Email is not correct. It must include the @ sign and at least one '.' after it.\n"
             )
 
+    @classmethod
+    def is_valid(cls, value):
+        return cls.PATTERN.match(value) is not None
+
+
+def stored_field(cls, value):
+    field = cls.__new__(cls)
+    field.value = sys.intern(value) if cls.interned else value
+    return field
+
 
 class Record:
+    __slots__ = ("name", "phone", "birthday", "address", "email", "notes", "book", "__weakref__")
+    STORED = ("name", "phone", "birthday", "address", "email", "notes")
+
     def __init__(self, name):
         self.name = Name(name)
-        self.phone = "not yet initieted"
+        self.phone = NO_PHONE
         self.birthday = None  # New field for birthday
-        self.address = "Not yet added"  # New field for address
-        self.email = "No email added"
-        self.notes = {}
+        self.address = NO_ADDRESS  # New field for address
+        self.email = NO_EMAIL
+        self.notes = NO_NOTES
+        self.book = None  # AddressBook holding the record, told about every field change
+
+    def _set_field(self, field, value):
+        old_value = getattr(self, field)
+        setattr(self, field, value)
+        if self.book is not None:
+            self.book.field_changed(self, field, old_value, value)
 
     def add_phone(self, phone):
-        self.phone = Phone(phone)
+        self._set_field("phone", Phone(phone))
 
     def add_address(self, address: str):
-        self.address = Address(address)
+        self._set_field("address", Address(address))
         return f"Address added for {str(self.name).title()}\n"
 
     def add_email(self, email: str):
-        self.email = Email(email)
+        self._set_field("email", Email(email))
         return f"Email added for {str(self.name).title()}\n"
 
     def add_birthday(self, birthday):
-        self.birthday = Birthday(birthday)
+        self._set_field("birthday", Birthday(birthday))
         return f"Birthday added for {str(self.name).title()}\n"
 
+    def _set_note(self, tag, note):
+        tag = sys.intern(tag)
+        old_note = self.notes.get(tag)
+        if self.notes is NO_NOTES:
+            self.notes = {}
+        if note is None:
+            self.notes.pop(tag, None)
+        else:
+            self.notes[tag] = note
+        if self.book is not None:
+            self.book.note_changed(self, tag, old_note, note)
+
     def add_note(self, tag="General", note="None"):
         if tag not in self.notes:
-            self.notes[tag] = note
+            self._set_note(tag, note)
             return f"Note added for {str(self.name).title()} with tag '{tag}'\n"
         return f"Note with tag '{tag}' already exists. Try another tag\n"
 
     def edit_note(self, tag, new_note):
         if tag in self.notes:
-            self.notes[tag] = new_note
+            self._set_note(tag, new_note)
             return f"Note edited successfully for {str(self.name).title()} with tag '{tag}'\n"
         return f"Note with tag '{tag}' was not found for {str(self.name).title()}\n"
 
     def delete_note(self, tag):
         if tag in self.notes:
-            self.notes.pop(tag, None)
+            self._set_note(tag, None)
             return f"All notes with tag '{tag}' deleted successfully for {str(self.name).title()}\n"
         return f"No notes found with tag '{tag}' for {str(self.name).title()}\n"
 
@@ -119,78 +266,926 @@ class Record:
         notes_str = "\n".join([f"- {tag}: {note}" for tag, note in self.notes.items()])
         return f"Contact name: {str(self.name.value).title()}, Phone: {self.phone}{birthday_str}\nAddress: {self.address}\nEmail: {self.email}\nNotes:\n{notes_str}\n"
 
+    @classmethod
+    def restore(cls, name, phone=None, email=None, address=None, birthday=None, notes=None):
+        # Rebuilds a record from stored values, which were validated when first added
+        record = cls.__new__(cls)
+        record.name = stored_field(Name, name)
+        record.phone = NO_PHONE if phone is None else stored_field(Phone, phone)
+        record.email = NO_EMAIL if email is None else stored_field(Email, email)
+        record.address = NO_ADDRESS if address is None else stored_field(Address, address)
+        record.birthday = None if birthday is None else stored_field(Birthday, birthday)
+        record.notes = {sys.intern(tag): note for tag, note in notes.items()} if notes else NO_NOTES
+        record.book = None
+        return record
+
+    def __getstate__(self):
+        # The book re-attaches its records when it is loaded
+        return tuple(getattr(self, slot) for slot in self.STORED)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # records pickled before __slots__ were used
+            state = [
+                LEGACY_PLACEHOLDERS.get(value, value) if isinstance(value, str) else value
+                for value in (state.get(slot) for slot in self.STORED)
+            ]
+            state[-1] = {sys.intern(tag): note for tag, note in state[-1].items()}
+        for slot, value in zip(self.STORED, state):
+            setattr(self, slot, value)
+        if not self.notes:
+            self.notes = NO_NOTES
+        self.book = None
+
+
+RENDER_CACHE_SIZE = 10_000  # contacts whose rendered text is kept
+
+
+def digit_range(numbers, digits):
+    # The 10-digit numbers of the sorted array numbers that start with digits
+    scale = 10 ** (10 - len(digits))
+    low = int(digits or 0) * scale  # no digits is the whole array
+    return numbers[bisect_left(numbers, low) : bisect_left(numbers, low + scale)]
+
 
 class AddressBook(UserDict):
+    INDEXED_FIELDS = ("phone", "email", "address", "birthday")
+
+    def __init__(self, *args, **kwargs):
+        # field -> normalized value -> names, used by search-by instead of scanning every record
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+        # token -> {(name, tag): occurrences} over all notes, plus the sorted tokens for partial words
+        self.note_index = {}
+        self.note_tokens = []
+        # (month, day, name) in calendar order, for upcoming birthday ranges. A change
+        # inserts its entry in place; add_records appends its entries and the list is
+        # sorted once on the next lookup
+        self.birthday_calendar = []
+        self.calendar_sorted = True
+        # Every name in alphabetical order, for name prefix and fuzzy search; sorted again lazily like the calendar
+        self.name_keys = []
+        self.names_sorted = True
+        # Every distinct phone as a number, and with its digits reversed, for phone prefix and suffix search
+        self.phone_numbers = array("Q")
+        self.reversed_phones = array("Q")
+        self.phones_sorted = True
+        self.journal = None  # Journal receiving every change, attached when the book is opened
+        self.generation = 0  # counts the changes, so results about the whole book know when they are stale
+        self.render_cache = OrderedDict()  # name -> {fields: rendered text}, least recently used first
+        self.seq = 0  # sequence number of the last ChangeEvent, saved with the book
+        self.subscribers = []  # callables receiving every ChangeEvent
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, name, record):
+        before = self.data.get(name)
+        record.book = self
+        self.data[name] = record
+        self._emit("put", name, None, before, record)
+
+    def __delitem__(self, name):
+        record = self.data.pop(name)
+        record.book = None
+        self._emit("delete", name, None, record, None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("journal", None)
+        state.pop("render_cache", None)
+        state.pop("subscribers", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.journal = None
+        self.generation = 0
+        self.render_cache = OrderedDict()
+        self.subscribers = []
+        self.__dict__.setdefault("seq", 0)  # books saved before change events
+        for record in self.data.values():
+            record.book = self
+        if not {"indexes", "note_index", "birthday_calendar", "calendar_sorted", "name_keys", "phone_numbers"} <= state.keys():
+            self.rebuild_indexes()  # books saved before the indexes existed
+
+    @staticmethod
+    def index_key(field, value):
+        if not isinstance(value, Field):
+            return None  # placeholders like "Not yet added" are not searchable values
+        if field in ("phone", "birthday"):
+            return value.value
+        text = str(value.value)
+        lowered = text.lower()
+        return text if lowered == text else lowered  # the value itself when already lowercase
+
+    def _index_record(self, name, record):
+        for field in self.INDEXED_FIELDS:
+            value = getattr(record, field)
+            if value:  # missing values are falsy and never indexed
+                self._index_value(field, name, value)
+        for tag, note in record.notes.items():
+            self._index_note(name, tag, note)
+
+    def _index_records(self, pairs):
+        # Indexes the (name, record) pairs of new contacts in bulk: every index is
+        # extended for the whole batch, and the sorted ones are sorted once on
+        # their next lookup instead of taking each entry in place
+        if not pairs:
+            return
+        self.name_keys.extend(name for name, _ in pairs)
+        self.names_sorted = False
+        phones = []  # phones held by no contact before
+        for field in self.INDEXED_FIELDS:
+            index = self.indexes[field]
+            lowered = field not in ("phone", "birthday")  # the keys index_key makes, inline
+            for name, record in pairs:
+                value = getattr(record, field)
+                if not isinstance(value, Field):  # missing values and placeholders
+                    continue
+                key = value.value
+                if lowered:
+                    text = key.lower()
+                    if text != key:
+                        key = text
+                names = index.get(key)
+                if names is None:
+                    index[key] = name
+                    if field == "phone":
+                        phones.append(key)
+                elif isinstance(names, str):
+                    index[key] = {names: None, name: None}
+                else:
+                    names[name] = None
+        phones = [phone for phone in phones if len(phone) == 10 and phone.isascii() and phone.isdigit()]
+        if phones:
+            self.phone_numbers.extend(map(int, phones))
+            self.reversed_phones.extend(int(phone[::-1]) for phone in phones)
+            self.phones_sorted = False
+        calendar = [
+            (record.birthday.value.month, record.birthday.value.day, name) for name, record in pairs if record.birthday
+        ]
+        if calendar:
+            self.birthday_calendar.extend(calendar)
+            self.calendar_sorted = False
+        self._index_notes((name, tag, note) for name, record in pairs for tag, note in record.notes.items())
+
+    def _index_name(self, name):
+        # A single name goes in place; bulk adds append and leave the sort to the next lookup
+        if self.names_sorted:
+            insort(self.name_keys, name)
+        else:
+            self.name_keys.append(name)
+
+    def _unindex_name(self, name):
+        if not self.names_sorted:
+            self.name_keys.remove(name)
+            return
+        names = self.name_keys
+        position = bisect_left(names, name)
+        if names[position : position + 1] == [name]:
+            del names[position]
+
+    def _unindex_record(self, name, record):
+        for field in self.INDEXED_FIELDS:
+            self._unindex_value(field, name, getattr(record, field))
+        for tag, note in record.notes.items():
+            self._unindex_note(name, tag, note)
+
+    def _index_value(self, field, name, value):
+        key = self.index_key(field, value)
+        if key is not None:
+            # A value held by one contact maps straight to its name, a shared one to a dict of names
+            index = self.indexes[field]
+            names = index.get(key)
+            if names is None:
+                index[key] = name
+                if field == "phone":
+                    self._index_phone(key)
+            elif isinstance(names, str):
+                index[key] = {names: None, name: None}
+            else:
+                names[name] = None
+            if field == "birthday":
+                entry = (key.month, key.day, name)
+                if self.calendar_sorted:
+                    insort(self.birthday_calendar, entry)
+                else:
+                    self.birthday_calendar.append(entry)
+
+    def _unindex_value(self, field, name, value):
+        key = self.index_key(field, value)
+        index = self.indexes[field]
+        names = index.get(key)
+        if names is not None:
+            if names == name:
+                del index[key]
+                if field == "phone":
+                    self._unindex_phone(key)
+            elif isinstance(names, dict):
+                names.pop(name, None)
+                if len(names) == 1:
+                    index[key] = next(iter(names))
+            if field == "birthday":
+                entry = (key.month, key.day, name)
+                calendar = self._calendar()
+                position = bisect_left(calendar, entry)
+                if calendar[position : position + 1] == [entry]:
+                    del calendar[position]
+
+    def _index_phone(self, phone):
+        # A single phone goes in place; bulk adds append and leave the sort to the next lookup
+        if len(phone) == 10 and phone.isascii() and phone.isdigit():
+            if self.phones_sorted:
+                insort(self.phone_numbers, int(phone))
+                insort(self.reversed_phones, int(phone[::-1]))
+            else:
+                self.phone_numbers.append(int(phone))
+                self.reversed_phones.append(int(phone[::-1]))
+
+    def _unindex_phone(self, phone):
+        if len(phone) == 10 and phone.isascii() and phone.isdigit():
+            for numbers, number in zip((self.phone_numbers, self.reversed_phones), (int(phone), int(phone[::-1]))):
+                if not self.phones_sorted:
+                    numbers.remove(number)
+                    continue
+                position = bisect_left(numbers, number)
+                if position < len(numbers) and numbers[position] == number:
+                    del numbers[position]
+
+    def _phone_arrays(self):
+        if not self.phones_sorted:
+            self.phone_numbers = array("Q", sorted(self.phone_numbers))
+            self.reversed_phones = array("Q", sorted(self.reversed_phones))
+            self.phones_sorted = True
+        return self.phone_numbers, self.reversed_phones
+
+    def _emit(self, kind, name, key=None, before=None, after=None):
+        # Every change of the book ends here: the indexes, the caches, the journal
+        # and the subscribers are all updated from the same event
+        self.seq += 1
+        event = ChangeEvent(self.seq, kind, name, key, before, after)
+        self._apply(event)
+        self.generation += 1
+        self.render_cache.pop(name, None)
+        if self.journal is not None:
+            self.journal.append(event.entry())
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+    def _apply(self, event):
+        # Brings the indexes up to date with one change
+        name, before, after = event.name, event.before, event.after
+        if event.kind == "put":
+            if before is None:
+                self._index_name(name)
+            else:
+                self._unindex_record(name, before)
+            self._index_record(name, after)
+        elif event.kind == "delete":
+            self._unindex_record(name, before)
+            self._unindex_name(name)
+        elif event.kind == "field":
+            if event.key in self.indexes:
+                self._unindex_value(event.key, name, before)
+                self._index_value(event.key, name, after)
+        else:
+            if before is not None:
+                self._unindex_note(name, event.key, before)
+            if after is not None:
+                self._index_note(name, event.key, after)
+
+    def _apply_batch(self, events):
+        # Brings the indexes up to date with the put events of add_records: new
+        # contacts are indexed together, replaced ones one by one in their order
+        added = []
+        for event in events:
+            if event.before is None:
+                added.append((event.name, event.after))
+            else:
+                self._index_records(added)
+                added = []
+                self._apply(event)
+        self._index_records(added)
+
+    def subscribe(self, subscriber):
+        # subscriber is called with every ChangeEvent once the book holds the change
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    def field_changed(self, record, field, old_value, new_value):
+        self._emit("field", record.name.value, field, old_value, new_value)
+
+    def _index_note(self, name, tag, note):
+        key = (name, tag)  # one tuple shared by the postings of every word of the note
+        for token, count in Counter(tokenize(note)).items():
+            postings = self.note_index.get(token)
+            if postings is None:
+                postings = self.note_index[token] = {}
+                insort(self.note_tokens, token)
+            postings[key] = count
+
+    def _index_notes(self, notes):
+        # Indexes (name, tag, note) triples in bulk; the new words are sorted into note_tokens once
+        note_index = self.note_index
+        new_tokens = []
+        for name, tag, note in notes:
+            key = (name, tag)  # new to every posting list, so counting starts at 0
+            for token in tokenize(note):
+                postings = note_index.get(token)
+                if postings is None:
+                    note_index[token] = {key: 1}
+                    new_tokens.append(token)
+                else:
+                    postings[key] = postings.get(key, 0) + 1
+        if new_tokens:
+            self.note_tokens.extend(new_tokens)
+            self.note_tokens.sort()
+
+    def _unindex_note(self, name, tag, note):
+        for token in set(tokenize(note)):
+            postings = self.note_index.get(token)
+            if postings is None:
+                continue
+            postings.pop((name, tag), None)
+            if not postings:
+                del self.note_index[token]
+                del self.note_tokens[bisect_left(self.note_tokens, token)]
+
+    def note_changed(self, record, tag, old_note, new_note):
+        self._emit("note", record.name.value, tag, old_note, new_note)
+
+    def rebuild_indexes(self):
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+        self.note_index = {}
+        self.note_tokens = []
+        self.birthday_calendar = []
+        self.calendar_sorted = True
+        self.name_keys = []
+        self.names_sorted = True
+        self.phone_numbers = array("Q")
+        self.reversed_phones = array("Q")
+        self.phones_sorted = True
+        self._index_records(list(self.data.items()))
+
+    def find_by(self, field, value):
+        names = self.indexes[field].get(self.index_key(field, value), ())
+        if isinstance(names, str):
+            names = (names,)
+        return [self.data[name] for name in names]
+
+    def tokens_with_prefix(self, prefix):
+        position = bisect_left(self.note_tokens, prefix)
+        while (
+            position < len(self.note_tokens)
+            and self.note_tokens[position].startswith(prefix)
+        ):
+            yield self.note_tokens[position]
+            position += 1
+
+    def _names(self):
+        if not self.names_sorted:
+            self.name_keys.sort()
+            self.names_sorted = True
+        return self.name_keys
+
+    def sort_indexes(self):
+        # Sorts now the indexes bulk adds left to their next lookup, so that
+        # lookups running in several threads only read them
+        self._names()
+        self._calendar()
+        self._phone_arrays()
+
+    def names_with_prefix(self, prefix):
+        names = self._names()
+        position = bisect_left(names, prefix)
+        while position < len(names) and names[position].startswith(prefix):
+            yield names[position]
+            position += 1
+
+    def birthday_ordinals(self):
+        # Date ordinals of every birthday in the book, one per contact
+        return array(
+            "i",
+            (
+                birthday.toordinal()
+                for birthday, names in self.indexes["birthday"].items()
+                for _ in range(1 if isinstance(names, str) else len(names))
+            ),
+        )
+
+    def phones_with_prefix(self, digits):
+        for number in digit_range(self._phone_arrays()[0], digits):
+            yield f"{number:010d}"
+
+    def phones_with_suffix(self, digits):
+        for number in digit_range(self._phone_arrays()[1], digits[::-1]):
+            yield f"{number:010d}"[::-1]
+
+    def names_within_distance(self, query, max_distance):
+        # Returns (distance, name) for every name at most max_distance edits away from query.
+        # The sorted names are walked like a trie: names sharing a prefix reuse its rows of
+        # the edit distance table, and a prefix already too far from query skips all its names.
+        names = self._names()
+        rows = [list(range(len(query) + 1))]
+        found = []
+        previous = ""
+        position = 0
+        while position < len(names):
+            name = names[position]
+            shared = 0
+            while shared < min(len(name), len(previous), len(rows) - 1) and name[shared] == previous[shared]:
+                shared += 1
+            del rows[shared + 1 :]
+            previous = name
+            for letter in name[shared:]:
+                above = rows[-1]
+                row = [above[0] + 1]
+                for column, query_letter in enumerate(query, 1):
+                    row.append(min(row[-1] + 1, above[column] + 1, above[column - 1] + (query_letter != letter)))
+                rows.append(row)
+                if min(row) > max_distance:
+                    position = bisect_left(names, name[: len(rows) - 1] + chr(sys.maxunicode))
+                    break
+            else:
+                if rows[-1][-1] <= max_distance:
+                    found.append((rows[-1][-1], name))
+                position += 1
+        found.sort()
+        return found
+
+    def search_notes(self, keywords, match_all=True):
+        # Every keyword matches whole or partial words; notes are ranked by
+        # how many keywords they match, then by how often those words occur.
+        keywords = list(dict.fromkeys(tokenize(" ".join(keywords))))
+        matched = Counter()
+        occurrences = Counter()
+        for keyword in keywords:
+            hits = Counter()
+            for token in self.tokens_with_prefix(keyword):
+                hits.update(self.note_index[token])
+            matched.update(hits.keys())
+            occurrences.update(hits)
+        found = [
+            key for key in matched if not match_all or matched[key] == len(keywords)
+        ]
+        found.sort(key=lambda key: (-matched[key], -occurrences[key]))
+        return [(name, tag, self.data[name].notes[tag]) for name, tag in found]
+
+    def search_notes_substring(self, text):
+        return SCAN_ENGINE.scan(self, "notes", re.escape(text))
+
+    def search_notes_regex(self, pattern):
+        return SCAN_ENGINE.scan(self, "notes", pattern)
+
+    def find_by_regex(self, field, pattern):
+        column = {"email": 1, "address": 2}[field]
+        rows = SCAN_ENGINE.scan(self, "fields", pattern, columns=(column,))
+        return [self[name] for name, _, _ in rows]
+
+    def commit(self):
+        # Called once a command has been applied
+        if self.journal is not None:
+            self.journal.commit()
+            if self.journal.needs_compaction():
+                self.save()
+
+    def save(self):
+        if self.journal is not None:
+            save_snapshot(self, self.journal.snapshot)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+    def load_records(self, records):
+        # Puts contacts read from storage in the book. Loading them is not a change:
+        # no event is numbered, journaled or passed to the subscribers.
+        pairs = []
+        for record in records:
+            record.book = self
+            self.data[record.name.value] = record
+            pairs.append((record.name.value, record))
+        self._index_records(pairs)
+        self.generation += 1
+        self.render_cache.clear()
+
+    def add_records(self, records):
+        # Adds new contacts in bulk: the indexes are built once for the batch, and
+        # the journal gets one entry for the whole batch
+        events = []
+        data = self.data
+        for record in records:
+            name = record.name.value
+            before = data.get(name)
+            record.book = self
+            data[name] = record
+            self.seq += 1
+            events.append(ChangeEvent(self.seq, "put", name, None, before, record))
+        self._apply_batch(events)
+        self._emitted(events)
+
+    def _emitted(self, events):
+        # Passes on a batch of changes already applied to the book
+        if not events:
+            return
+        self.generation += 1
+        self.render_cache.clear()
+        if self.journal is not None:
+            self.journal.append((events[0].seq, "add", [record_row(event.after) for event in events]))
+        for subscriber in self.subscribers:
+            for event in events:
+                subscriber(event)
+
+    def render(self, record, fields=None):
+        # Text of record with the given fields (None for the full contact), kept until the record changes
+        name = record.name.value
+        texts = self.render_cache.get(name)
+        if texts is None:
+            texts = self.render_cache[name] = {}
+            if len(self.render_cache) > RENDER_CACHE_SIZE:
+                self.render_cache.popitem(last=False)
+        else:
+            try:
+                self.render_cache.move_to_end(name)
+            except KeyError:  # just dropped by a render in another thread
+                pass
+        text = texts.get(fields)
+        if text is None:
+            text = texts[fields] = str(record) if fields is None else contact_line(record, fields)
+        return text
+
     def add_record(self, name, phone):
         record = Record(name)
         record.add_phone(phone)
-        self.data[record.name.value] = record
-
-    def get_birthdays_in_days(self, days_ahead):
-        today = datetime.now().date()
-        future_date = today + timedelta(days=days_ahead)
-        birthdays = {}
-        for name, record in self.data.items():
-            if record.birthday:
-                birthday_date = record.birthday.value.replace(year=today.year)
-                days_until_birthday = (birthday_date - today).days
-                if days_until_birthday == days_ahead:
-                    birthdays[name] = birthday_date
-        return birthdays
+        self[record.name.value] = record
+
+    def _calendar(self):
+        if not self.calendar_sorted:
+            self.birthday_calendar.sort()
+            self.calendar_sorted = True
+        return self.birthday_calendar
+
+    def _birthdays_between(self, start, end):
+        # start and end fall in the same year; both are included
+        calendar = self._calendar()
+        low = bisect_left(calendar, (start.month, start.day))
+        end_key = (end.month, end.day + 1)
+        if end_key == (2, 29) and not isleap(end.year):
+            end_key = (2, 30)  # 29 February birthdays move to the 28th this year
+        high = bisect_left(calendar, end_key)
+        for month, day, name in calendar[low:high]:
+            yield birthday_in_year(month, day, start.year), name
+
+    def get_birthdays_in_days(self, days_ahead, today=None):
+        # Yields (date, names) for every day with birthdays from today to days_ahead days from now
+        today = today or datetime.now().date()
+        last_day = today + timedelta(days=min(days_ahead, (date.max - today).days))
+        for year in range(today.year, last_day.year + 1):
+            start = max(today, date(year, 1, 1))
+            end = min(last_day, date(year, 12, 31))
+            for birthday_date, entries in groupby(
+                self._birthdays_between(start, end), key=lambda entry: entry[0]
+            ):
+                yield birthday_date, [name for _, name in entries]
 
     def delete_contact(self, name):
-        del self.data[name]
+        del self[name]
         return f"Contact '{name.title()}' deleted successfully.\n"
 
 
-################################# EXCEPTIONS HANDLERS #################################
+################################# COMMAND REGISTRY #################################
 
 
-def input_error(func):
-    def inner(args, kwargs):
-        try:
-            return func(args, kwargs)
-        except ValueError as e:
-            return e
-        except Exception:
-            return "Give me name and phone please.\n"
+class Command:
+    def __init__(
+        self,
+        name,
+        handler,
+        min_args,
+        max_args,
+        usage,
+        description,
+        syntax,
+        aliases,
+        name_argument,
+        mutates,
+        cacheable,
+        contacts,
+        cache_key,
+    ):
+        self.name = name
+        self.handler = handler
+        self.min_args = min_args
+        self.max_args = max_args  # None for commands taking free text
+        self.usage = usage  # shown when the number of arguments is wrong
+        self.description = description
+        self.syntax = syntax
+        self.names = (name, *aliases)
+        self.name_argument = name_argument  # position of the contact name, completed with Tab
+        self.mutates = mutates  # True for commands changing the book
+        self.cacheable = cacheable  # True for queries whose output only depends on the book and the day
+        # Function returning the contacts named by the arguments, when the command uses
+        # no others: run from the command line, it then only reads those contacts
+        if contacts is None and name_argument is not None:
+            contacts = lambda args: args[name_argument : name_argument + 1]
+        self.contacts = contacts
+        # Function returning the arguments as the query cache keys them: spellings
+        # of the same query, such as names in other case, give the same key
+        self.cache_key = cache_key or tuple
 
-    return inner
 
+COMMANDS = {}  # command name or alias -> Command
 
-def indexOutOfRange(func):
-    def inner(args, kwargs):
-        try:
-            return func(args, kwargs)
-        except IndexError as e:
-            return "index out of bounds, maybe the value does not exist.\n"
-        except Exception as ee:
-            return ee
 
-    return inner
+def command(
+    name,
+    min_args=0,
+    max_args=None,
+    usage="",
+    description="",
+    syntax="",
+    aliases=(),
+    name_argument=None,
+    mutates=False,
+    cacheable=False,
+    contacts=None,
+    cache_key=None,
+):
+    def register(func):
+        entry = Command(
+            name,
+            func,
+            min_args,
+            max_args,
+            usage,
+            description,
+            syntax or name,
+            aliases,
+            name_argument,
+            mutates,
+            cacheable,
+            contacts,
+            cache_key,
+        )
+        for key in entry.names:
+            COMMANDS[key] = entry
+        return func
+
+    return register
 
 
-def general_error(func):
-    def inner(args, kwargs):
-        try:
-            return func(args, kwargs)
-        except Exception as e:
-            return e
+def help_text():
+    lines = []
+    for entry in dict.fromkeys(COMMANDS.values()):
+        lines.append(f"            ** {entry.description:<42} >>> {entry.syntax}")
+    return (
+        "\n            \nTo continue, please choose one of the following options:\n\n"
+        + "\n".join(lines)
+        + "\n            "
+    )
 
-    return inner
 
+class LatencyHistogram:
+    # Counts of latencies in logarithmic buckets, each 2 ** (1 / BUCKETS_PER_DOUBLING)
+    # times wider than the previous one, starting at one microsecond
+    BUCKETS_PER_DOUBLING = 4
 
-def valid_name(func):
-    def inner(args, kwargs):
-        try:
-            return func(args, kwargs)
-        except KeyError:
-            return "The name does not exist.\n"
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
 
-    return inner
+    def add(self, seconds):
+        microseconds = seconds * 1_000_000
+        bucket = int(math.log2(microseconds) * self.BUCKETS_PER_DOUBLING) + 1 if microseconds > 1 else 0
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
 
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of the calls, in seconds
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min(2 ** (bucket / self.BUCKETS_PER_DOUBLING) / 1_000_000, self.max)
+        return 0.0
 
-################################# END OF EXCEPTIONS HANDLERS #################################
+    def summary(self):
+        return {
+            "calls": self.count,
+            "total_s": self.total,
+            "p50_s": self.percentile(0.50),
+            "p95_s": self.percentile(0.95),
+            "p99_s": self.percentile(0.99),
+            "max_s": self.max,
+        }
+
+
+class Stats:
+    # Call counts, latencies and errors of every command, and time spent saving and loading
+    def __init__(self):
+        self.commands = {}  # command -> LatencyHistogram
+        self.errors = {}  # command -> Counter of exception type names
+        self.storage = {}  # storage function -> LatencyHistogram
+        self.lock = threading.Lock()  # server.py runs reads in several threads
+
+    def reset(self):
+        self.commands.clear()
+        self.errors.clear()
+        self.storage.clear()
+
+    def record(self, command, seconds, error=None):
+        with self.lock:
+            histogram = self.commands.get(command)
+            if histogram is None:
+                histogram = self.commands[command] = LatencyHistogram()
+            histogram.add(seconds)
+            if error is not None:
+                self.errors.setdefault(command, Counter())[error] += 1
+
+    def record_storage(self, operation, seconds):
+        with self.lock:
+            self.storage.setdefault(operation, LatencyHistogram()).add(seconds)
+
+    def to_dict(self):
+        return {
+            "commands": {
+                command: {**histogram.summary(), "errors": dict(self.errors.get(command, {}))}
+                for command, histogram in self.commands.items()
+            },
+            "storage": {operation: histogram.summary() for operation, histogram in self.storage.items()},
+        }
+
+    def report(self):
+        if not self.commands and not self.storage:
+            return "No commands have been run yet.\n"
+        lines = [f"{'Command':<16}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  errors"]
+        for name, group in (("commands", self.commands), ("storage", self.storage)):
+            if name == "storage" and group:
+                lines.append("")
+                lines.append("Storage")
+            for command, histogram in sorted(group.items()):
+                summary = histogram.summary()
+                errors = ", ".join(
+                    f"{error} x{count}" for error, count in self.errors.get(command, {}).items()
+                ) if name == "commands" else ""
+                lines.append(
+                    f"{command:<16}{summary['calls']:>8}"
+                    + "".join(f"{summary[key] * 1000:>10.3f}" for key in ("p50_s", "p95_s", "p99_s", "max_s"))
+                    + f"  {errors}"
+                )
+        return "\n".join(line.rstrip() for line in lines) + "\n"
+
+
+STATS = Stats()
+
+
+def timed(operation):
+    # Adds the duration of every call of the decorated function to STATS.storage
+    def decorator(func):
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STATS.record_storage(operation, time.perf_counter() - start)
+
+        return inner
+
+    return decorator
+
+
+QUERY_CACHE_SIZE = 1024  # outputs kept by the query cache
+
+
+class QueryCache:
+    # Outputs of cacheable commands, least recently used first. Any change of the
+    # book moves its generation on and empties the cache.
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()  # server.py runs reads in several threads
+        self.entries = OrderedDict()
+        self.book = None  # weak reference to the book of the entries
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check(self, book):
+        if self.book is None or self.book() is not book or self.generation != book.generation:
+            self.entries.clear()
+            self.book = weakref.ref(book)
+            self.generation = book.generation
+
+    def get(self, book, key):
+        with self.lock:
+            self._check(book)
+            output = self.entries.get(key)
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return output
+
+    def put(self, book, key, output):
+        with self.lock:
+            self._check(book)
+            self.entries[key] = output
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def reset(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "size": self.size,
+        }
+
+    def report(self):
+        summary = self.to_dict()
+        return (
+            f"Query cache: {summary['hits']} hits, {summary['misses']} misses "
+            f"({summary['hit_rate']:.0%}), {summary['entries']} of {summary['size']} entries\n"
+        )
+
+
+QUERY_CACHE = QueryCache()
+
+
+def dispatch(book, command, args):
+    # Runs one command and returns its status ("ok" or "error") and output.
+    # This is the single place where the errors of every handler are turned into
+    # messages, and where every call is timed for the stats command.
+    entry = COMMANDS.get(command)
+    if entry is None:
+        return "error", "Invalid command."
+    if len(args) < entry.min_args or (entry.max_args is not None and len(args) > entry.max_args):
+        STATS.record(entry.name, 0.0, "UsageError")
+        return "error", entry.usage
+    start = time.perf_counter()
+    try:
+        if not entry.cacheable:
+            output = entry.handler(args, book)
+        else:
+            # Aliases give the same key as the command; the day is part of it for birthday queries
+            key = (entry.name, entry.cache_key(args), date.today())
+            output = QUERY_CACHE.get(book, key)
+            if output is None:
+                output = entry.handler(args, book)
+                QUERY_CACHE.put(book, key, output)
+    except Exception as e:
+        STATS.record(entry.name, time.perf_counter() - start, type(e).__name__)
+        return "error", error_message(e)
+    if isinstance(output, str):
+        STATS.record(entry.name, time.perf_counter() - start)
+        return "ok", output
+    return "ok", streamed_output(entry.name, output, time.perf_counter() - start)
+
+
+def error_message(e):
+    if isinstance(e, KeyError):
+        return "The name does not exist.\n"
+    if isinstance(e, IndexError):
+        return "index out of bounds, maybe the value does not exist.\n"
+    return str(e)
+
+
+def streamed_output(command, pieces, elapsed):
+    # Output of commands such as all, produced while it is read: the time spent
+    # producing it is recorded once it is read to the end or closed, and an error
+    # raised on the way ends it with the message dispatch would have returned
+    error = None
+    pieces = iter(pieces)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                piece = next(pieces)
+            except StopIteration:
+                return
+            except Exception as e:
+                error = type(e).__name__
+                piece = error_message(e)
+                pieces = iter(())
+            finally:
+                elapsed += time.perf_counter() - start
+            yield piece
+    finally:
+        STATS.record(command, elapsed, error)
+
+
+################################# END OF COMMAND REGISTRY #################################
 
 
 def parse_input(user_input):
@@ -199,439 +1194,2988 @@ def parse_input(user_input):
     return cmd, *args
 
 
-@general_error
-@input_error
+def contact_name(name):
+    # Contacts are stored under their lowercased name
+    return Name(name.strip().lower()).value
+
+
+@command(
+    "hello",
+    description="Show this menu",
+    syntax="hello",
+)
+def showHelp(args, book):
+    return help_text()
+
+
+@command(
+    "add",
+    2,
+    2,
+    usage="Give me name and phone please.\n",
+    description="Add a new contact",
+    syntax="add [name] [phone-number]",
+    mutates=True,
+    contacts=lambda args: args[:1],
+)
 def add_contact(args, book):
     name = args[0].strip().lower()
     phone = args[1].strip()
     if name in book:
-        return f"\nUsername {name.title()} already exists"
-    else:
-        try:
-            name = Name(name).value
-            phone = Phone(phone).value
-            book.add_record(name, phone)
-            return f"Contact '{name.title()}' added successfully."
-        except (NameError, NumberError) as e:
-            return str(e)
+        raise ValueError(f"\nUsername {name.title()} already exists")
+    name = Name(name).value
+    phone = Phone(phone).value
+    book.add_record(name, phone)
+    return f"Contact '{name.title()}' added successfully."
+
+
+NAME_MATCHES = 50  # most contacts shown by a name prefix or fuzzy search
+
 
+RENDER_FIELDS = {
+    "name": lambda record: f"Contact: {str(record.name).title()}",
+    "phone": lambda record: f"Phone: {record.phone}",
+    "birthday": lambda record: f"Birthday: {record.birthday.value:%d.%m.%Y}" if record.birthday else "Birthday: N/A",
+    "address": lambda record: f"Address: {record.address}",
+    "email": lambda record: f"Email: {record.email}",
+    "notes": lambda record: "Notes: " + ("; ".join(f"{tag}: {note}" for tag, note in record.notes.items()) or "-"),
+}
+CONTACT_FIELDS = ("name", "phone", "birthday", "address", "email")
 
-@general_error
-@general_error
+
+def contact_line(record, fields=CONTACT_FIELDS):
+    return ", ".join(RENDER_FIELDS[field](record) for field in fields) + "\n"
+
+
+def search_by_key(criterion, *value):
+    # Every search but the regular expressions ignores case
+    criterion = criterion.strip().lower()
+    value = " ".join(value)
+    return criterion, value if criterion.endswith("-regex") else value.lower()
+
+
+@command(
+    "search-by",
+    2,
+    usage="Please provide the search option [name] or [name-prefix] or [name-fuzzy] or [email] or [email-regex] or [phone] or [phone-prefix] or [phone-suffix] or [address] or [address-regex] or [birthday] and [value].\n",
+    description="Search for an existing contact",
+    syntax="search-by [name] or [name-prefix] or [name-fuzzy] or [email] or [email-regex] or [phone] or [phone-prefix] or [phone-suffix] or [address] or [address-regex] or [birthday] and [value]",
+    cacheable=True,
+    cache_key=lambda args: search_by_key(*args),
+)
 def searchBy(args, book):
     criterion, *search_value = args
     search_value = " ".join(search_value)
-    criterion = args[0].strip().lower()
-    result = ""
-    if criterion in ["name", "phone", "birthday", "address", "email"]:
-        for name, record in book.items():
-            if criterion == "phone":
-                try:
-                    search_value = Phone(search_value).value
-                    if record.phone.value == search_value:
-                        birthday_str = (
-                            f"{record.birthday.value:%d.%m.%Y}"
-                            if record.birthday
-                            else "N/A"
-                        )
-                        result += f"Contact: {name.title()}, Phone: {record.phone}, Birthday: {birthday_str}, Address: {record.address}, Email: {record.email}\n"
-                except NumberError as e:
-                    return str(e)
-            elif criterion == "name":
-                if not search_value.isalpha():
-                    return "The name must be entered with characters only.\n"
-                elif (
-                    search_value.isalpha() and record.name.value == search_value.lower()
-                ):
-                    birthday_str = (
-                        f"{record.birthday.value:%d.%m.%Y}"
-                        if record.birthday
-                        else "N/A"
-                    )
-                    result += f"Contact: {name.title()}, Phone: {record.phone}, Birthday: {birthday_str}, Address: {record.address}, Email: {record.email}\n"
-
-            elif criterion == "birthday":
-                try:
-                    search_value_date = datetime.strptime(
-                        search_value, "%d.%m.%Y"
-                    ).date()
-                    if record.birthday and record.birthday.value == search_value_date:
-                        birthday_str = (
-                            f"{record.birthday.value:%d.%m.%Y}"
-                            if record.birthday
-                            else "N/A"
-                        )
-                        result += f"Contact: {name.title()}, Phone: {record.phone}, Birthday: {birthday_str}, Address: {record.address}, Email: {record.email}\n"
-                except ValueError as e:
-                    return str(e)
-            elif (
-                criterion == "address"
-                and str(record.address).lower() == search_value.strip().lower()
-            ):
-                birthday_str = (
-                    f"{record.birthday.value:%d.%m.%Y}" if record.birthday else "N/A"
-                )
-                result += f"Contact: {name.title()}, Phone: {record.phone}, Birthday: {birthday_str}, Address: {record.address}, Email: {record.email}\n"
-            elif criterion == "email":
-                try:
-                    search_value = Email(search_value).value
-                    if (
-                        str(record.email) == str(search_value).lower()
-                    ):  # str(record.email).lower() == search_value.lower()
-                        birthday_str = (
-                            f"{record.birthday.value:%d.%m.%Y}"
-                            if record.birthday
-                            else "N/A"
-                        )
-                        result += f"Contact: {name.title()}, Phone: {record.phone}, Birthday: {birthday_str}, Address: {record.address}, Email: {record.email}\n"
-                except ValueError as e:
-                    return str(e)
-        if result:
-            return result
+    criterion = criterion.strip().lower()
+    # The search value is validated once, then answered from the book's indexes
+    if criterion == "name":
+        if not search_value.isalpha():
+            raise ValueError("The name must be entered with characters only.\n")
+        record = book.get(search_value.lower())
+        records = [record] if record else []
+    elif criterion == "name-prefix":
+        if not search_value.isalpha():
+            raise ValueError("The name must be entered with characters only.\n")
+        records = [book[name] for name in islice(book.names_with_prefix(search_value.lower()), NAME_MATCHES)]
+    elif criterion == "name-fuzzy":
+        if not search_value.isalpha():
+            raise ValueError("The name must be entered with characters only.\n")
+        query = search_value.lower()
+        # One typo allowed in short names, two in longer ones
+        found = book.names_within_distance(query, 1 if len(query) <= 5 else 2)
+        records = [book[name] for _, name in found[:NAME_MATCHES]]
+    elif criterion in ("email-regex", "address-regex"):
+        records = book.find_by_regex(criterion.split("-")[0], search_value)
+    elif criterion == "phone":
+        records = book.find_by("phone", Phone(search_value))
+    elif criterion in ("phone-prefix", "phone-suffix"):
+        if not (search_value.isascii() and search_value.isdigit() and len(search_value) <= 10):
+            raise ValueError("Please provide up to 10 digits of the phone number.\n")
+        if criterion == "phone-prefix":
+            phones = book.phones_with_prefix(search_value)
         else:
-            return "No records found for the given criteria.\n"
+            phones = book.phones_with_suffix(search_value)
+        records = list(islice((record for phone in phones for record in book.find_by("phone", Phone(phone))), NAME_MATCHES))
+    elif criterion == "birthday":
+        records = book.find_by("birthday", Birthday(search_value))
+    elif criterion == "address":
+        records = book.find_by("address", Address(search_value.strip()))
+    elif criterion == "email":
+        records = book.find_by("email", Email(search_value))
     else:
-        return "Please provide a valid format: search-by [name] or [email] or [phone] or [address] or [birthday] and [value].\n"
+        raise ValueError(
+            "Please provide a valid format: search-by [name] or [name-prefix] or [name-fuzzy] or [email] or [email-regex] or [phone] or [phone-prefix] or [phone-suffix] or [address] or [address-regex] or [birthday] and [value].\n"
+        )
+    if records:
+        return "".join(book.render(record, CONTACT_FIELDS) for record in records)
+    else:
+        return "No records found for the given criteria.\n"
 
 
-@general_error
-@valid_name
+@command(
+    "edit-by",
+    3,
+    usage="Please type the edit-by, option from [phone] or [birthday] or [email] or [address], followed by [name] and [new value].\n",
+    description="Edit an existing contact",
+    syntax="edit-by [phone] or [birthday] or [email] or [address], followed by [name] and [new value]",
+    name_argument=1,
+    mutates=True,
+)
 def editBy(args, book):
     criterion, name, *new_value = args
     new_value = " ".join(new_value)
-    name = name.strip().lower()
-
-    try:
-        name = Name(name).value
-        if name in book:
-            if criterion == "phone":
-                book[name].phone = Phone(new_value)
-                return f"Phone updated for {name.title()}\n"
-            elif criterion == "birthday":
-                book[name].birthday = Birthday(new_value)
-                return f"Birthday updated for {name.title()}\n"
-            elif criterion == "address":
-                book[name].address = Address(new_value)
-                return f"Address updated for {name.title()}\n"
-            elif criterion == "email":
-                book[name].email = Email(new_value)
-                return f"Email updated for {name.title()}\n"
-            else:
-                return f"Field '{criterion}' cannot be changed.\n"
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    record = book[contact_name(name)]
+    if criterion == "phone":
+        record.add_phone(new_value)
+    elif criterion == "birthday":
+        record.add_birthday(new_value)
+    elif criterion == "address":
+        record.add_address(new_value)
+    elif criterion == "email":
+        record.add_email(new_value)
+    else:
+        raise ValueError(f"Field '{criterion}' cannot be changed.\n")
+    return f"{criterion.title()} updated for {record.name.value.title()}\n"
 
 
-@general_error
-@valid_name
+@command(
+    "add-birthday",
+    2,
+    2,
+    usage="Please provide a contact name and a birthday in format DD.MM.YYYY \n",
+    description="Add birthday for a contact",
+    syntax="add-birthday [name] [DD.MM.YYYY]",
+    name_argument=0,
+    mutates=True,
+)
 def addBirthday(args, book):
-    name = args[0].strip().lower()
-    birthDate = args[1].strip()
-    try:
-        name = Name(name).value
-        if name in book:
-            return book[name].add_birthday(birthDate)
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    name, birthDate = args
+    return book[contact_name(name)].add_birthday(birthDate.strip())
 
 
-@general_error
-@valid_name
+@command(
+    "add-address",
+    2,
+    usage="Please provide the contact name and address.\n",
+    description="Add address to a contact",
+    syntax="add-address [name] [address]",
+    name_argument=0,
+    mutates=True,
+)
 def addAddress(args, book):
-    name = args[0].strip().lower()
     address = " ".join(args[1:]).strip()
-    try:
-        name = Name(name).value
-        if name in book:
-            return book[name].add_address(address)
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    return book[contact_name(args[0])].add_address(address)
 
 
-@general_error
-@valid_name
+@command(
+    "add-email",
+    2,
+    2,
+    usage="Please provide the contact name and email address.\n",
+    description="Add email to a contact",
+    syntax="add-email [name] [email]",
+    name_argument=0,
+    mutates=True,
+)
 def addEmail(args, book):
     name, email = args
-    name = name.strip().lower()
-    email = email.strip().lower()
-    try:
-        name = Name(name).value
-        if name in book:
-            return book[name].add_email(email)
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    return book[contact_name(name)].add_email(email.strip().lower())
 
 
-@general_error
-@valid_name
+@command(
+    "add-note",
+    3,
+    usage="Please provide the contact name, a keyword for tag and the note as text.\n",
+    description="Add note to a contact",
+    syntax="add-note [name] [tag: one keyword] [note: text]",
+    name_argument=0,
+    mutates=True,
+)
 def addNote(args, book):
     name, tag, *note = args
-    note = " ".join(note)
-    try:
-        name = Name(name).value
-        if name in book:
-            return book[name].add_note(tag, note)
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    return book[contact_name(name)].add_note(tag, " ".join(note))
 
 
-@general_error
-@valid_name
+@command(
+    "edit-note",
+    3,
+    usage="Please provide the contact name, the tag and the note as text.\n",
+    description="Edit Note",
+    syntax="edit-note [name] [tag] [new note]",
+    name_argument=0,
+    mutates=True,
+)
 def editNote(args, book):
     name, tag, *newNote = args
-    newNote = " ".join(newNote)
-    try:
-        name = Name(name).value
-        if name in book:
-            return book[name].edit_note(tag, newNote)
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    return book[contact_name(name)].edit_note(tag, " ".join(newNote))
+
 
+NOTE_SEARCH_MODES = ("--all", "--any", "--substring", "--regex")
 
-@general_error
+
+def search_note_key(args):
+    # Keywords ignore case, patterns do not
+    mode = "--all"
+    if args and args[0] in NOTE_SEARCH_MODES:
+        mode, *args = args
+    keywords = " ".join(args)
+    return mode, keywords if mode == "--regex" else keywords.lower()
+
+
+@command(
+    "search-note",
+    1,
+    usage="Please provide the keyword for your search.\n",
+    description="Search notes from all contacts",
+    syntax="search-note [keyword(s)] *Add --any to match any keyword, --substring for plain text or --regex for a pattern",
+    cacheable=True,
+    cache_key=search_note_key,
+)
 def searchNote(args, book):
-    keywords = args
-    keywords = " ".join(keywords)
+    # search-note [--all | --any | --substring | --regex] keywords
+    mode = "--all"
+    if args and args[0] in NOTE_SEARCH_MODES:
+        mode, *args = args
+    keywords = " ".join(args)
+    if not keywords.strip():
+        raise ValueError("Please provide the keyword for your search.\n")
+    if mode == "--regex":
+        found_notes = book.search_notes_regex(keywords)
+    elif mode == "--substring" or not tokenize(keywords):
+        found_notes = book.search_notes_substring(keywords)
+    else:
+        found_notes = book.search_notes(args, match_all=mode == "--all")
     result = ""
-    found_notes = {}
-    for name, record in book.items():
-        for tag, note in record.notes.items():
-            if keywords.lower() in note.lower():
-                result += (
-                    f"{str(record.name).title()} has tag: {tag} with note: {note}\n"
-                )
+    for name, tag, note in found_notes:
+        result += f"{name.title()} has tag: {tag} with note: {note}\n"
     if result:
         return result
     else:
         return "The keyword you are searching for does not exist.\n"
 
 
-@general_error
-@valid_name
+@command(
+    "delete-note",
+    2,
+    2,
+    usage="Please provide the contact name and tag for the note to delete.\n",
+    description="Delete note from a contact",
+    syntax="delete-note [name] [tag]",
+    name_argument=0,
+    mutates=True,
+)
 def deleteNote(args, book):
     name, tag = args
+    return book[contact_name(name)].delete_note(tag)
+
+
+ALL_USAGE = "Please type all, optionally with --page [N] --size [K], --sort [field] and --fields [field,field,...].\n"
+SORT_FIELDS = ("name", "phone", "birthday", "address", "email")
+
+
+@command(
+    "all",
+    0,
+    8,
+    usage=ALL_USAGE,
+    description="Display all contacts from the phonebook",
+    syntax="all *Add --page [N] --size [K], --sort [field] or --fields [field,field,...]",
+)
+def showAll(args, book):
+    if len(args) % 2:
+        raise ValueError(ALL_USAGE)
+    options = dict(zip(args[::2], args[1::2]))
+    if not options.keys() <= {"--page", "--size", "--sort", "--fields"}:
+        raise ValueError(ALL_USAGE)
     try:
-        name = Name(name).value
-        if name in book:
-            return book[name].delete_note(tag)
+        page = int(options.get("--page", 1 if "--size" in options else 0))
+        size = int(options.get("--size", 20))
+    except ValueError:
+        raise ValueError("The page and its size must be numbers.\n")
+    if page < 0 or size < 1:
+        raise ValueError("The page and its size must be positive numbers.\n")
+    sort = options.get("--sort", "").lower() or None
+    if sort is not None and sort not in SORT_FIELDS:
+        raise ValueError(f"Contacts can be sorted by {', '.join(SORT_FIELDS)}.\n")
+    fields = None
+    if "--fields" in options:
+        fields = tuple(field.strip().lower() for field in options["--fields"].split(",") if field.strip())
+        if not fields or not set(fields) <= RENDER_FIELDS.keys():
+            raise ValueError(f"The fields to show can be {', '.join(RENDER_FIELDS)}.\n")
+    return list_contacts(book, page, size, sort, fields)
+
+
+def sort_key(field):
+    def key(record):
+        value = getattr(record, field)
+        if not value:
+            return (1, "")  # contacts without the field come last
+        value = value.value
+        return (0, value.lower() if isinstance(value, str) else value)
+
+    return key
+
+
+def list_contacts(book, page=0, size=20, sort=None, fields=None):
+    # Yields the listing piece by piece; page 0 lists every contact
+    if sort == "name":
+        records = (book[name] for name in book.names_with_prefix(""))
+    elif sort is not None:
+        if page:
+            records = heapq.nsmallest(page * size, book.values(), key=sort_key(sort))
         else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+            records = sorted(book.values(), key=sort_key(sort))
+    else:
+        records = book.values()
+    if page:
+        records = islice(records, (page - 1) * size, page * size)
+    yield "\n\n"
+    for record in records:
+        yield book.render(record, fields) + ("\n" if fields is None else "")
+    if page:
+        pages = max(1, -(-len(book) // size))
+        yield f"Page {page} of {pages}, {len(book)} contacts\n"
+    yield "\n"
 
 
-@valid_name
-@indexOutOfRange
+def output_text(result):
+    # Commands such as all return their output in pieces
+    return result if isinstance(result, str) else "".join(result)
+
+
+@command(
+    "show-birthday",
+    1,
+    1,
+    usage="Please provide the contact name to retrieve the birthday.\n",
+    description="Show birthday for a contact",
+    syntax="show-birthday [name]",
+    name_argument=0,
+    cacheable=True,
+    cache_key=lambda args: (args[0].strip().lower(),),
+)
 def showBirthday(args, book):
-    name = args[0].strip().lower()
-    try:
-        name = Name(name).value
-        if name in book and book[name].birthday:
-            return f"{name.title()}'s birthday is on {book[name].birthday.value.strftime('%d.%m.%Y')}\n"
-        else:
-            raise KeyError
-    except NameError as e:
-        return str(e)
+    name = contact_name(args[0])
+    record = book[name]
+    if not record.birthday:
+        raise ValueError(f"No birthday saved for {name.title()}.\n")
+    return f"{name.title()}'s birthday is on {record.birthday.value.strftime('%d.%m.%Y')}\n"
 
 
 def showBirthdaysInDays(book, days_ahead):
-    birthdays = book.get_birthdays_in_days(days_ahead)
     result = ""
-    if birthdays:
-        result += f"\nBirthdays {days_ahead} days from now:\n"
-        # Group contacts by birthday
-        grouped_birthdays = {}
-        for name, birthday_date in birthdays.items():
-            day_month = birthday_date.strftime("%d.%m")
-            weekday = birthday_date.strftime("%A")
-            key = (weekday, day_month)
-            if key not in grouped_birthdays:
-                grouped_birthdays[key] = [name]
-            else:
-                grouped_birthdays[key].append(name)
-
-        # Format output
-        for (weekday, day_month), contacts in grouped_birthdays.items():
-            result += f"\n[{day_month}] - {weekday} : "
-            result += ", ".join(contacts).title()
-            result += "\n"
-    else:
-        result += f"No birthdays {days_ahead} days from today.\n"
+    for birthday_date, names in book.get_birthdays_in_days(days_ahead):
+        if not result:
+            result += f"\nBirthdays in the next {days_ahead} days:\n"
+        result += f"\n[{birthday_date:%d.%m}] - {birthday_date:%A} : "
+        result += ", ".join(names).title()
+        result += "\n"
+    if not result:
+        result += f"No birthdays in the next {days_ahead} days.\n"
     return result
 
 
-def deleteContact(args, book):
-    name = args[0].strip().lower()
-    try:
-        # Validate name input for alphabetic characters
-        name = Name(name).value
-        if name in book:
-            return book.delete_contact(name)
-    except (NameError, KeyError) as e:
-        return str(e)
+@command(
+    "birthdays",
+    1,
+    1,
+    usage="Please specify the number of days ahead.\n",
+    description="Show birthdays in specified no days",
+    syntax="birthdays [number]",
+    cacheable=True,
+)
+def showBirthdays(args, book):
+    if not args[0].isdigit():  # Check if input contains digits only
+        raise ValueError("Please enter a valid number of days.\n")
+    return showBirthdaysInDays(book, int(args[0]))
 
 
-############ SAVE FILE AS A DATABASE
+AGE_BUCKET = 10  # years per age group of birthday-stats
+BUSIEST_WEEKS = 5
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
 
-def save_to_pickle(data, filename="data.pkl"):
-    with open(filename, "wb") as f:
-        pickle.dump(data, f)
+def upcoming_birthday(month, day, today):
+    for year in (today.year, today.year + 1):
+        birthday = birthday_in_year(month, day, year)
+        if birthday >= today:
+            return birthday
 
 
-def load_from_pickle(filename="data.pkl"):
-    try:
-        with open(filename, "rb") as f:
-            return pickle.load(f)
-    except FileNotFoundError:
-        return AddressBook()  # Return an empty dictionary if the file doesn't exist
+def birthday_counts_python(ordinals, today):
+    # Month of birth, weekday of the next birthday, age today and days until the
+    # next birthday of every contact, counted one contact at a time
+    months, weekdays, ages, days_ahead = Counter(), Counter(), Counter(), Counter()
+    for ordinal in ordinals:
+        if not ordinal:
+            continue
+        born = date.fromordinal(ordinal)
+        upcoming = upcoming_birthday(born.month, born.day, today)
+        months[born.month] += 1
+        weekdays[upcoming.weekday()] += 1
+        ages[max(0, upcoming.year - born.year - (upcoming > today))] += 1
+        days_ahead[(upcoming - today).days] += 1
+    return months, weekdays, ages, days_ahead
 
 
-###########
+def numpy_installed():
+    return importlib.util.find_spec("numpy") is not None
 
 
-def main():
-    book = load_from_pickle()
-    print(
-        "\n\t\t#######################################\n\n\t\tWelcome to your Personal Assistant app!\n\n\t\t#######################################\n\n\t\tType Hello to start!\n\n"
-    )
-    while True:
-        user_input = input("Enter a command: ")
-        if not user_input:
-            print('Please type Hello to see the menu options or "exit" to close.\n')
-            continue
-        command, *args = parse_input(user_input)
+def birthdays_in_year_numpy(months, days, year):
+    import numpy
 
-        if command in ["close", "exit"]:
-            print(
-                "\n\n\t****** Thank you for using the Personal Assistant! ******\n\t\t\tSee you next time!\n\n"
-            )
-            save_to_pickle(book)
-            break
-        elif command == "hello":
-            print(
-                """
-            \nTo continue, please choose one of the following options:\n
-            ** Add a new contact                          >>> add [name] [phone-number]  
-            ** Add address to a contact                   >>> add-address [name] [address]
-            ** Add email to a contact                     >>> add-email [name] [email]
-            ** Add note to a contact                      >>> add-note [name] [tag: one keyword] [note: text]
-            ** Edit Note                                  >>> edit-note [name] [tag] [new note]
-            ** Search notes from all contacts             >>> search-note [keyword]
-            ** Delete note from a contact                 >>> delete-note [name] [tag]
-            ** Edit an existing contact                   >>> edit-by [phone] or [birthday] or [email] or [address], followed by [name] and [new value]
-            ** Search for an existing contact             >>> search-by [name] or [email] or [phone] or [address] or [birthday] and [value]
-            ** Display all contacts from the phonebook    >>> all
-            ** Add birthday for a contact                 >>> add-birthday [name] [DD.MM.YYYY]
-            ** Show birthday for a contact                >>> show-birthday [name]
-            ** Show birthdays in specified no days        >>> birthdays [number] *Number should be in the range 1-30
-            ** Delete a contact from the address book     >>> delete [name]          
-            ** Exit the application                       >>> close or exit
-            """
-            )
-        elif command == "add":
-            print(add_contact(args, book))
-        elif command == "edit-by":
-            if len(args) < 3:
-                print(
-                    "Please type the edit-by, option from [phone] or [birthday] or [email] or [address], followed by [name] and [new value].\n"
-                )
-            else:
-                print(editBy(args, book))
-        elif command == "edit-note":
-            if len(args) < 3:
-                print(
-                    "Please provide the contact name, the tag and the note as text.\n"
-                )
-            else:
-                print(editNote(args, book))
-        elif command == "search-note":
-            if len(args) < 1:
-                print("Please provide the keyword for your search.\n")
-            else:
-                print(searchNote(args, book))
-        elif command == "delete-note":
-            if len(args) == 2:
-                print(deleteNote(args, book))
-            else:
-                print(
-                    "Please provide the contact name and tag for the note to delete.\n"
-                )
-        elif command == "add-birthday":
-            if len(args) == 2:
-                print(addBirthday(args, book))
-            else:
-                print(
-                    "Please provide a contact name and a birthday in format DD.MM.YYYY \n"
-                )
-        elif command == "add-address":
-            if len(args) < 2:
-                print("Please provide the contact name and address.\n")
+    if not isleap(year):
+        days = numpy.where((months == 2) & (days == 29), 28, days)
+    first_days = (numpy.datetime64(year - 1970, "Y").astype("datetime64[M]") + (months - 1)).astype("datetime64[D]")
+    return first_days + (days - 1)
+
+
+def birthday_counts_numpy(ordinals, today):
+    # The same counts as birthday_counts_python, computed on whole arrays
+    import numpy
+
+    ordinals = numpy.frombuffer(ordinals, dtype=numpy.int32)
+    born = (ordinals[ordinals > 0].astype(numpy.int64) - UNIX_EPOCH_ORDINAL).astype("datetime64[D]")
+    born_years = born.astype("datetime64[Y]").astype(numpy.int64) + 1970
+    born_months = born.astype("datetime64[M]")
+    months = born_months.astype(numpy.int64) % 12 + 1
+    days = (born - born_months).astype(numpy.int64) + 1
+    today_day = numpy.datetime64(today, "D")
+    upcoming = birthdays_in_year_numpy(months, days, today.year)
+    upcoming = numpy.where(upcoming < today_day, birthdays_in_year_numpy(months, days, today.year + 1), upcoming)
+    days_ahead = (upcoming - today_day).astype(numpy.int64)
+    weekdays = (upcoming.astype(numpy.int64) + 3) % 7  # 1 January 1970 was a Thursday
+    upcoming_years = upcoming.astype("datetime64[Y]").astype(numpy.int64) + 1970
+    ages = numpy.maximum(0, upcoming_years - born_years - (days_ahead > 0))
+
+    def counts(values):
+        found = numpy.bincount(values)
+        return Counter({value: int(count) for value, count in enumerate(found) if count})
+
+    return counts(months), counts(weekdays), counts(ages), counts(days_ahead)
+
+
+def birthday_stats(book, today=None, use_numpy=None):
+    # Birthday counts per month, per weekday of the coming year, per age group and
+    # for the busiest of the next 52 weeks. NumPy is used when it is installed.
+    today = today or datetime.now().date()
+    if use_numpy is None:
+        use_numpy = numpy_installed()
+    ordinals = book.birthday_ordinals()
+    if use_numpy:
+        months, weekdays, ages, days_ahead = birthday_counts_numpy(ordinals, today)
+    else:
+        months, weekdays, ages, days_ahead = birthday_counts_python(ordinals, today)
+    age_groups = Counter()
+    for age, count in ages.items():
+        age_groups[age // AGE_BUCKET * AGE_BUCKET] += count
+    weeks = Counter()
+    for days, count in days_ahead.items():
+        if days < 52 * 7:
+            weeks[days // 7] += count
+    busiest = sorted(weeks.items(), key=lambda week: (-week[1], week[0]))[:BUSIEST_WEEKS]
+    return {
+        "contacts": sum(months.values()),
+        "by_month": {month: months[month] for month in range(1, 13)},
+        "by_weekday": {day_name[weekday]: weekdays[weekday] for weekday in range(7)},
+        "by_age": {f"{age}-{age + AGE_BUCKET - 1}": age_groups[age] for age in sorted(age_groups)},
+        "busiest_weeks": [
+            (today + timedelta(days=7 * week), today + timedelta(days=7 * week + 6), count)
+            for week, count in busiest
+        ],
+    }
+
+
+@command(
+    "birthday-stats",
+    0,
+    0,
+    usage="Please type birthday-stats without arguments.\n",
+    description="Show birthday statistics",
+    syntax="birthday-stats",
+    cacheable=True,
+)
+def showBirthdayStats(args, book):
+    stats = birthday_stats(book)
+    if not stats["contacts"]:
+        return "No contact has a birthday yet.\n"
+    lines = [f"\nBirthdays of {stats['contacts']} contacts\n", "Born in each month:"]
+    lines += [f"  {date(2000, month, 1):%B}: {count}" for month, count in stats["by_month"].items()]
+    lines.append("\nBirthdays on each weekday in the coming year:")
+    lines += [f"  {weekday}: {count}" for weekday, count in stats["by_weekday"].items()]
+    lines.append("\nAges:")
+    lines += [f"  {ages}: {count}" for ages, count in stats["by_age"].items()]
+    lines.append("\nBusiest weeks ahead:")
+    lines += [f"  {start:%d.%m} - {end:%d.%m}: {count}" for start, end, count in stats["busiest_weeks"]]
+    return "\n".join(lines) + "\n"
+
+
+@command(
+    "delete",
+    1,
+    1,
+    usage="Please provide the contact name you want to discard.\n",
+    description="Delete a contact from the address book",
+    syntax="delete [name]",
+    name_argument=0,
+    mutates=True,
+)
+def deleteContact(args, book):
+    # Validate name input for alphabetic characters
+    return book.delete_contact(contact_name(args[0]))
+
+
+############ DUPLICATES
+
+
+def duplicate_key(field, value):
+    # Normalized value, equal for two spellings of the same email or address;
+    # phones and birthdays are validated into one form when they are added
+    if field == "email":
+        return value.value.strip().lower()
+    if field == "address":
+        return " ".join(tokenize(value.value))
+    return value.value
+
+
+def duplicate_keys(record):
+    # Keys that make two contacts the same person
+    if record.phone:
+        yield "phone", duplicate_key("phone", record.phone)
+    if record.email:
+        yield "email", duplicate_key("email", record.email)
+    if record.address and record.birthday:
+        yield "address and birthday", (duplicate_key("address", record.address), record.birthday.value)
+
+
+def find_duplicates(book):
+    # Groups of contacts sharing a phone, an email or an address and a birthday,
+    # directly or through other contacts of the group. One pass over the book: the
+    # first contact seen with a key owns it, later ones are joined to it in a
+    # union-find with path halving, so the whole search is linear in the book size.
+    parents = {}
+    owners = {}
+    reasons = {}
+
+    def root(name):
+        while parents[name] != name:
+            parents[name] = name = parents[parents[name]]
+        return name
+
+    for record in book.values():
+        name = record.name.value
+        parents[name] = name
+        for kind, key in duplicate_keys(record):
+            owner = owners.setdefault((kind, key), name)
+            if owner != name:
+                first, second = root(owner), root(name)
+                if first != second:
+                    parents[second] = first
+                    reasons.setdefault(first, set()).update(reasons.pop(second, ()))
+                reasons.setdefault(first, set()).add(kind)
+    groups = {}
+    for name in parents:
+        top = root(name)
+        if top in reasons:
+            groups.setdefault(top, []).append(name)
+    return sorted((sorted(names), sorted(reasons[top])) for top, names in groups.items())
+
+
+@command(
+    "find-duplicates",
+    0,
+    0,
+    usage="Please type find-duplicates without arguments.\n",
+    description="Find contacts that may be the same person",
+    syntax="find-duplicates",
+    cacheable=True,
+)
+def findDuplicates(args, book):
+    groups = find_duplicates(book)
+    if not groups:
+        return "No duplicate contacts found.\n"
+    lines = [f"\nPossible duplicates: {len(groups)} groups\n"]
+    for names, reasons in groups:
+        lines.append(f"Same {', '.join(reasons)}: merge {' '.join(names)}")
+        lines += [f"  {book.render(book[name], CONTACT_FIELDS)}".rstrip() for name in names]
+        lines.append("")
+    return "\n".join(lines)
+
+
+MERGED_FIELDS = ("phone", "email", "address", "birthday")
+
+
+def merge_contacts(book, name, others):
+    # Copies into contact name the fields it lacks and the notes of the others, then
+    # deletes them. Returns the differing values that were not kept.
+    record = book[name]
+    merged = [book[other] for other in others]
+    dropped = []
+    for other in merged:
+        for field in MERGED_FIELDS:
+            value = getattr(other, field)
+            if not value:
+                continue
+            current = getattr(record, field)
+            if not current:
+                record._set_field(field, value)
+            elif duplicate_key(field, current) != duplicate_key(field, value):
+                text = f"{value.value:%d.%m.%Y}" if field == "birthday" else value.value
+                dropped.append(f"{field} {text} of {other.name.value.title()}")
+        for tag, note in other.notes.items():
+            current = record.notes.get(tag)
+            if current is None:
+                record.add_note(tag, note)
+            elif note not in current:
+                record.edit_note(tag, f"{current}; {note}")
+    for other in others:
+        del book[other]
+    return dropped
+
+
+@command(
+    "merge",
+    2,
+    usage="Please provide the contact to keep followed by the contacts to merge into it.\n",
+    description="Merge duplicate contacts into one",
+    syntax="merge [name] [duplicate names]",
+    name_argument=0,
+    mutates=True,
+    contacts=lambda args: args,
+)
+def mergeContacts(args, book):
+    name, *others = [contact_name(arg) for arg in args]
+    others = list(dict.fromkeys(other for other in others if other != name))
+    if not others:
+        raise ValueError("Please provide at least one other contact to merge.\n")
+    for other in (name, *others):
+        if other not in book:
+            raise KeyError(other)
+    dropped = merge_contacts(book, name, others)
+    message = f"{', '.join(other.title() for other in others)} merged into {name.title()}.\n"
+    if dropped:
+        message += "Not kept, as the contact already has another value: " + "; ".join(dropped) + ".\n"
+    return message
+
+
+############ QUERY LANGUAGE
+
+QUERY_FIELDS = {"name": Name, "phone": Phone, "email": Email, "address": Address, "birthday": Birthday, "note": None}
+QUERY_USAGE = (
+    "Please provide one or more conditions [field]:[pattern] with field from name, phone, email, address, "
+    "birthday or note, and optionally limit:[N]. * matches any text and ? one character.\n"
+)
+# Names read from a range access path to count it; larger ranges get a guessed size
+QUERY_PEEK = 1000
+# Share of the book expected to match a larger range, as the book keeps no
+# statistics about its values; exact lookups count their matches instead
+NAME_LETTER_SELECTIVITY = 1 / 26
+PHONE_DIGIT_SELECTIVITY = 1 / 10
+PREDICATE_COST = {"name": 0, "phone": 0, "birthday": 0, "email": 1, "address": 1, "note": 2}
+
+
+def is_glob(text):
+    return "*" in text or "?" in text
+
+
+def glob_regex(pattern, any_char="."):
+    # * matches any text and ? one character, ignoring case; any_char limits what they match
+    parts = (f"{any_char}*" if char == "*" else any_char if char == "?" else re.escape(char) for char in pattern)
+    return re.compile("".join(parts), re.IGNORECASE)
+
+
+def field_test(field, pattern):
+    regex = glob_regex(pattern)
+    return lambda record: bool(getattr(record, field)) and regex.fullmatch(getattr(record, field).value) is not None
+
+
+def range_path(description, names, estimate):
+    # Reads the first names of the range: when there are few, their number is the estimate
+    first = list(islice(names, QUERY_PEEK))
+    estimate = len(first) if len(first) < QUERY_PEEK else max(estimate, QUERY_PEEK)
+    return estimate, description, chain(first, names)
+
+
+def exact_path(book, field, value):
+    records = book.find_by(field, stored_field(QUERY_FIELDS[field], value))
+    return len(records), f"{field} index", (record.name.value for record in records)
+
+
+def name_predicate(book, pattern):
+    pattern = pattern.lower()
+    letters = pattern.replace("*", "").replace("?", "")
+    if not pattern or letters and not letters.isalpha():  # name:* has no letters and matches every name
+        raise ValueError("The name must be entered with characters only.\n")
+    if not is_glob(pattern):
+        names = [pattern] if pattern in book else []
+        return field_test("name", pattern), (len(names), "name", iter(names))
+    prefix = re.match(r"[^*?]*", pattern).group()
+    path = None
+    if prefix:
+        estimate = len(book) * NAME_LETTER_SELECTIVITY ** len(prefix)
+        path = range_path("name prefix", book.names_with_prefix(prefix), estimate)
+    return field_test("name", pattern), path
+
+
+def phone_predicate(book, pattern):
+    digits = pattern.replace("*", "").replace("?", "")
+    if digits and not (digits.isascii() and digits.isdigit()) or len(digits) > 10:
+        raise ValueError("A phone pattern can only hold up to 10 digits, * and ?.\n")
+    path = None
+    if not is_glob(pattern):
+        path = exact_path(book, "phone", Phone(pattern).value)
+    elif digits and (pattern == digits + "*" or pattern == "*" + digits):  # phone:* has no range to read
+        phones = book.phones_with_prefix(digits) if pattern.endswith("*") else book.phones_with_suffix(digits)
+        names = (record.name.value for phone in phones for record in book.find_by("phone", Phone(phone)))
+        estimate = len(book) * PHONE_DIGIT_SELECTIVITY ** len(digits)
+        path = range_path("phone prefix" if pattern.endswith("*") else "phone suffix", names, estimate)
+    return field_test("phone", pattern), path
+
+
+def text_predicate(field):
+    def predicate(book, pattern):
+        path = None if is_glob(pattern) else exact_path(book, field, pattern)
+        return field_test(field, pattern), path
+
+    return predicate
+
+
+def birthday_predicate(book, pattern):
+    # DD.MM.YYYY, where shorter patterns leave out the day first: 03.* is any day of
+    # March, *.1990 any day of 1990 and 1990 the same
+    parts = pattern.split(".")
+    if len(parts) > 3 or not all(re.fullmatch(r"[\d*?]+", part) for part in parts):
+        raise ValueError("A birthday pattern is DD.MM.YYYY, MM.YYYY or YYYY, with * and ?.\n")
+    day, month, year = ["*"] * (3 - len(parts)) + [part if is_glob(part) else part.zfill(2) for part in parts]
+    regex = glob_regex(f"{day}.{month}.{year}", "[^.]")
+
+    def test(record):
+        return bool(record.birthday) and regex.fullmatch(f"{record.birthday.value:%d.%m.%Y}") is not None
+
+    path = None
+    try:
+        if not is_glob(month):
+            if not is_glob(day) and not is_glob(year):
+                path = exact_path(book, "birthday", Birthday(f"{day}.{month}.{year}").value)
             else:
-                print(addAddress(args, book))
-        elif command == "add-email":
-            if len(args) == 2:
-                print(addEmail(args, book))
+                # 2000 is a leap year, so its calendar holds 29 February
+                first, last = (int(day),) * 2 if not is_glob(day) else (1, monthrange(2000, int(month))[1])
+                days = book._birthdays_between(date(2000, int(month), first), date(2000, int(month), last))
+                estimate = len(book) * (last - first + 1) / 366
+                path = range_path("birthday calendar", (name for _, name in days), estimate)
+    except ValueError:
+        raise ValueError(f"{pattern} is not a valid birthday pattern.\n")
+    return test, path
+
+
+def note_predicate(book, pattern):
+    # Every word matches the beginning of a word of the same note, or the whole word with * and ?
+    words = []
+    for word in pattern.lower().split():
+        words += [word] if is_glob(word) else tokenize(word)
+    matchers = [glob_regex(word).fullmatch if is_glob(word) else (lambda token, word=word: token.startswith(word)) for word in words]
+
+    def test(record):
+        for note in record.notes.values():
+            tokens = tokenize(note)
+            if all(any(match(token) for token in tokens) for match in matchers):
+                return True
+        return False
+
+    keywords = [word for word in words if not is_glob(word)]
+    path = None
+    if keywords:
+        notes = book.search_notes(keywords)
+        path = (len(notes), "note index", (name for name, _, _ in notes))
+    return test, path
+
+
+QUERY_PREDICATES = {
+    "name": name_predicate,
+    "phone": phone_predicate,
+    "email": text_predicate("email"),
+    "address": text_predicate("address"),
+    "birthday": birthday_predicate,
+    "note": note_predicate,
+}
+
+
+def parse_query(args):
+    # Returns the (field, pattern) conditions and the limit of a find query. Words
+    # without a field continue the pattern before them, as in address:12 main st.
+    conditions = []
+    limit = NAME_MATCHES
+    for arg in args:
+        field, colon, pattern = arg.partition(":")
+        field = field.lower()
+        if colon and field == "limit":
+            if not pattern.isdigit() or int(pattern) < 1:
+                raise ValueError("The limit must be a positive number.\n")
+            limit = int(pattern)
+        elif colon and field in QUERY_FIELDS:
+            conditions.append([field, pattern])
+        elif conditions:
+            conditions[-1][1] += " " + arg
+        else:
+            raise ValueError(QUERY_USAGE)
+    if not conditions or not all(pattern.strip() for _, pattern in conditions):
+        raise ValueError(QUERY_USAGE)
+    return [(field, pattern.strip()) for field, pattern in conditions], limit
+
+
+def plan_query(book, conditions):
+    # Picks the access path expected to return the fewest contacts (an index lookup
+    # or range, else one scan of the book) and the tests the contacts must pass,
+    # cheapest first. Returns (description, contacts, tests).
+    predicates = [(field, *QUERY_PREDICATES[field](book, pattern)) for field, pattern in conditions]
+    paths = [path for _, _, path in predicates if path is not None]
+    best = min(paths, key=lambda path: path[0], default=None)
+    tests = [test for _, test, _ in sorted(predicates, key=lambda predicate: PREDICATE_COST[predicate[0]])]
+    if best is None or best[0] >= len(book):
+        return "scan", book.values(), tests
+
+    def records(names):
+        seen = set()
+        for name in names:
+            if name not in seen:
+                seen.add(name)
+                record = book.get(name)
+                if record is not None:
+                    yield record
+
+    return f"{best[1]} (about {math.ceil(best[0])} contacts)", records(best[2]), tests
+
+
+def run_query(book, args):
+    # Returns the plan description, up to limit matching contacts and whether there are more
+    conditions, limit = parse_query(args)
+    description, records, tests = plan_query(book, conditions)
+    # Every test runs only while the previous ones passed, and the search stops
+    # as soon as one contact more than the limit is found
+    found = list(islice((record for record in records if all(test(record) for test in tests)), limit + 1))
+    return description, found[:limit], len(found) > limit
+
+
+@command(
+    "find",
+    1,
+    usage=QUERY_USAGE,
+    description="Find contacts matching several conditions",
+    syntax="find [field]:[pattern] ... limit:[N], e.g. find birthday:03.* email:*@gmail.com note:vegan",
+    cacheable=True,
+    cache_key=lambda args: tuple(arg.lower() for arg in args),  # every condition ignores case
+)
+def findContacts(args, book):
+    explain = args[0].lower() == "--explain"
+    description, records, more = run_query(book, args[explain:])
+    if explain:
+        return f"Plan: {description}, then every condition is checked on each contact.\n"
+    if not records:
+        return "No records found for the given criteria.\n"
+    fields = CONTACT_FIELDS + ("notes",) if any(arg.lower().startswith("note:") for arg in args) else CONTACT_FIELDS
+    output = "".join(book.render(record, fields) for record in records)
+    if more:
+        output += f"Only the first {len(records)} contacts are shown, add limit:[N] to see more.\n"
+    return output
+
+
+############ IMPORT AND EXPORT
+
+IMPORT_BATCH_SIZE = 1000
+CONTACT_COLUMNS = ["name", "phone", "email", "address", "birthday", "notes"]
+VCARD_BIRTHDAY = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})")
+
+
+@contextmanager
+def paused_gc():
+    # Bulk loads make no garbage, but the objects they create trigger collections
+    # that walk the whole book over and over, so these wait until the load is done
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def file_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    formats = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".vcf": "vcard", ".vcard": "vcard"}
+    if extension not in formats:
+        raise ValueError("Supported files are .csv, .jsonl and .vcf.\n")
+    return formats[extension]
+
+
+def parse_note_lines(text):
+    # Notes are written one per line as "tag: note"
+    notes = {}
+    for line in text.splitlines():
+        tag, _, note = line.partition(":")
+        if tag.strip():
+            notes[tag.strip()] = note.strip()
+    return notes
+
+
+def read_csv_contacts(f):
+    import csv
+
+    reader = csv.reader(f)
+    header = next(reader, [])
+    for values in reader:
+        if values:  # blank lines
+            row = dict(zip(header, values))
+            notes = row.get("notes")
+            row["notes"] = parse_note_lines(notes) if notes else {}
+            yield row
+
+
+def read_jsonl_contacts(f):
+    for line in f:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield {"error": "Line is not valid JSON.", "line": line.rstrip("\n")}
+
+
+VCARD_ESCAPE = re.compile(r"\\(.)")
+VCARD_SEPARATOR = re.compile(r"(?<!\\);")
+
+
+def vcard_value(value):
+    if "\\" not in value:
+        return value
+    return VCARD_ESCAPE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def vcard_escape(value):
+    return (
+        value.replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;").replace("\n", "\\n")
+    )
+
+
+def unfolded_lines(f):
+    # vCard lines starting with a space or tab continue the previous line
+    previous = None
+    for line in f:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and previous is not None:
+            previous += line[1:]
+            continue
+        if previous is not None:
+            yield previous
+        previous = line
+    if previous is not None:
+        yield previous
+
+
+def read_vcard_contacts(f):
+    row = None
+    for line in unfolded_lines(f):
+        key, _, value = line.partition(":")
+        key = key.split(";")[0].upper()
+        if key == "BEGIN":
+            row = {"notes": {}}
+        elif key == "END" and row is not None:
+            yield row
+            row = None
+        elif row is None:
+            continue
+        elif key == "FN":
+            row["name"] = vcard_value(value)
+        elif key == "TEL" and "phone" not in row:
+            row["phone"] = value.replace(" ", "").replace("-", "")
+        elif key == "EMAIL" and "email" not in row:
+            row["email"] = vcard_value(value)
+        elif key == "ADR":
+            parts = [vcard_value(part) for part in VCARD_SEPARATOR.split(value)]
+            row["address"] = " ".join(part for part in parts if part)
+        elif key == "BDAY":
+            match = VCARD_BIRTHDAY.fullmatch(value)
+            row["birthday"] = "{2}.{1}.{0}".format(*match.groups()) if match else value
+        elif key == "NOTE":
+            row["notes"].update(parse_note_lines(vcard_value(value)))
+
+
+CONTACT_READERS = {"csv": read_csv_contacts, "jsonl": read_jsonl_contacts, "vcard": read_vcard_contacts}
+
+
+def validate_contact(row, birthdays=None):
+    # Returns the values to store for an imported row, or raises ValueError with the reason.
+    # birthdays maps birthday texts already parsed to their dates, shared by the rows of an import
+    if "error" in row:
+        raise ValueError(row["error"])
+    name = str(row.get("name") or "").strip().lower()
+    if not Name.is_valid(name):
+        raise ValueError("Name must contain only alphabetic characters.")
+    phone = str(row.get("phone") or "").strip()
+    if not Phone.is_valid(phone):
+        raise ValueError("Number must be of 10 digits.")
+    email = str(row.get("email") or "").strip().lower() or None
+    if email is not None and not Email.is_valid(email):
+        raise ValueError("Email is not correct.")
+    address = str(row.get("address") or "").strip() or None
+    birthday = str(row.get("birthday") or "").strip()
+    if not birthday:
+        birthday = None
+    elif birthdays is None:
+        birthday = Birthday.parse(birthday)
+    elif birthday in birthdays:
+        birthday = birthdays[birthday]
+    else:
+        birthday = birthdays[birthday] = Birthday.parse(birthday)
+    notes = row.get("notes") or {}
+    if not isinstance(notes, dict):
+        raise ValueError("Notes must map tags to notes.")
+    return name, phone, email, address, birthday, {str(tag): str(note) for tag, note in notes.items()} if notes else None
+
+
+def validate_batch(book, batch, birthdays=None):
+    # Splits a batch of (row number, row) into records to add and rejected rows
+    records = []
+    rejected = []
+    names = set()
+    for number, row in batch:
+        try:
+            name, phone, email, address, birthday, notes = validate_contact(row, birthdays)
+            if name in names or name in book:
+                raise ValueError(f"Contact {name.title()} already exists.")
+        except ValueError as e:
+            rejected.append({"row": number, "error": str(e).strip(), "data": row})
+            continue
+        names.add(name)
+        records.append(Record.restore(name, phone, email, address, birthday, notes))
+    return records, rejected
+
+
+def import_contacts(book, filename, rejects_filename=None, batch_size=IMPORT_BATCH_SIZE):
+    # Streams a CSV, JSONL or vCard file into the book and returns (imported, rejected).
+    # Rows that fail validation are written to rejects_filename as JSON lines.
+    reader = CONTACT_READERS[file_format(filename)]
+    rejects_filename = rejects_filename or filename + ".rejects.jsonl"
+    imported = rejected = 0
+    rejects = None
+    birthdays = {}
+    with open(filename, newline="", encoding="utf-8") as f, paused_gc():
+        rows = enumerate(reader(f), start=1)
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                records, bad_rows = validate_batch(book, batch, birthdays)
+                book.add_records(records)
+                imported += len(records)
+                if bad_rows:
+                    if rejects is None:
+                        rejects = open(rejects_filename, "w", encoding="utf-8")
+                    rejects.writelines(json.dumps(bad, default=str) + "\n" for bad in bad_rows)
+                    rejected += len(bad_rows)
+        finally:
+            if rejects is not None:
+                rejects.close()
+    return imported, rejected
+
+
+def contact_values(record):
+    return {
+        "name": record.name.value,
+        "phone": record.phone.value if record.phone else "",
+        "email": record.email.value if record.email else "",
+        "address": record.address.value if record.address else "",
+        "birthday": f"{record.birthday.value:%d.%m.%Y}" if record.birthday else "",
+        "notes": dict(record.notes),
+    }
+
+
+def write_csv_contacts(f, records):
+    import csv
+
+    writer = csv.DictWriter(f, CONTACT_COLUMNS)
+    writer.writeheader()
+    for record in records:
+        values = contact_values(record)
+        values["notes"] = "\n".join(f"{tag}: {note}" for tag, note in record.notes.items())
+        writer.writerow(values)
+
+
+def write_jsonl_contacts(f, records):
+    for record in records:
+        f.write(json.dumps(contact_values(record)) + "\n")
+
+
+def write_vcard_contacts(f, records):
+    for record in records:
+        values = contact_values(record)
+        f.write(f"BEGIN:VCARD\r\nVERSION:3.0\r\nFN:{vcard_escape(values['name'].title())}\r\n")
+        if values["phone"]:
+            f.write(f"TEL:{values['phone']}\r\n")
+        if values["email"]:
+            f.write(f"EMAIL:{vcard_escape(values['email'])}\r\n")
+        if values["address"]:
+            f.write(f"ADR:;;{vcard_escape(values['address'])};;;;\r\n")
+        if record.birthday:
+            f.write(f"BDAY:{record.birthday.value.isoformat()}\r\n")
+        for tag, note in record.notes.items():
+            f.write(f"NOTE:{vcard_escape(f'{tag}: {note}')}\r\n")
+        f.write("END:VCARD\r\n")
+
+
+CONTACT_WRITERS = {"csv": write_csv_contacts, "jsonl": write_jsonl_contacts, "vcard": write_vcard_contacts}
+
+
+def export_contacts(book, filename):
+    writer = CONTACT_WRITERS[file_format(filename)]
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer(f, book.values())
+    return len(book)
+
+
+@command(
+    "import",
+    1,
+    2,
+    usage="Please provide the file to import and optionally a file for the rejected rows.\n",
+    description="Import contacts from a file",
+    syntax="import [file.csv / file.jsonl / file.vcf] [rejects file]",
+    mutates=True,
+)
+def importContacts(args, book):
+    filename = args[0]
+    rejects_filename = args[1] if len(args) > 1 else filename + ".rejects.jsonl"
+    imported, rejected = import_contacts(book, filename, rejects_filename)
+    result = f"{imported} contacts imported from {filename}.\n"
+    if rejected:
+        result += f"{rejected} rows were rejected, see {rejects_filename}\n"
+    return result
+
+
+@command(
+    "export",
+    1,
+    1,
+    usage="Please provide the file to export the contacts to.\n",
+    description="Export all contacts to a file",
+    syntax="export [file.csv / file.jsonl / file.vcf]",
+)
+def exportContacts(args, book):
+    filename = args[0]
+    count = export_contacts(book, filename)
+    return f"{count} contacts exported to {filename}.\n"
+
+
+############ PARALLEL SCAN
+# Searches that no index can answer (regular expressions and substrings in notes,
+# emails and addresses) look at every note or record. On big books the records are
+# split in shards, each kept by its own worker process, and scanned in parallel.
+
+SCAN_PARALLEL_MIN = 200_000  # notes and records below which a scan runs in this process
+SCAN_WORKERS = os.cpu_count() or 1
+
+scan_shard = None  # the rows of the shard kept by a scan worker
+
+
+def keep_shard(rows):
+    global scan_shard
+    scan_shard = rows
+
+
+def update_rows(groups, changes, added_names):
+    # Puts the new rows of each changed contact in groups, None for a deleted one,
+    # and returns how many rows were added. Like the book, groups keeps every
+    # contact, without notes too, in its place, so a single shard is in book order:
+    # contacts in added_names, added or deleted and added again, go to the end, in
+    # the order of changes.
+    added = 0
+    for name, rows in changes.items():
+        if rows is None or name in added_names:
+            added -= len(groups.pop(name, ()))
+        if rows is not None:
+            added += len(rows) - len(groups.get(name, ()))
+            groups[name] = rows
+    return added
+
+
+def update_kept_shard(changes):
+    # The rows of several shards are sorted into book order after the scan
+    for dataset, rows in changes.items():
+        update_rows(scan_shard[dataset], rows, ())
+
+
+def scan_rows(groups, pattern, flags, columns):
+    # Rows where pattern matches one of the columns, from groups of name -> rows of the contact
+    regex = re.compile(pattern, flags)
+    return [row for rows in groups.values() for row in rows if any(regex.search(row[column]) for column in columns)]
+
+
+def scan_kept_shard(dataset, pattern, flags, columns):
+    return scan_rows(scan_shard[dataset], pattern, flags, columns)
+
+
+def contact_rows(record):
+    # "notes" rows are (name, tag, note), "fields" rows (name, email, address)
+    name = record.name.value
+    return {
+        "notes": [(name, tag, note) for tag, note in record.notes.items()],
+        "fields": [(name, record.email.value if record.email else "", record.address.value if record.address else "")],
+    }
+
+
+class ScanEngine:
+    # Shards of one book, split by name. The engine follows the changes of the book
+    # and, before the next scan, sends each worker the changed contacts of its shard;
+    # the shards are only built and shipped again for another book.
+    def __init__(self, workers=SCAN_WORKERS, parallel_min=SCAN_PARALLEL_MIN):
+        self.workers = workers
+        self.parallel_min = parallel_min
+        self.book = None  # weak reference to the book of the shards
+        self.shards = []  # dataset -> name -> rows, per shard, kept here for serial scans
+        self.executors = []  # one single-process executor per shard, empty for serial scans
+        self.rows = 0  # rows of the serial shards
+        self.order = {}  # name -> position in the book, to return rows in book order
+        self.next_position = 0
+        self.changed = set()  # names changed since the last scan
+        self.added = set()  # of them, names added to the end of the book
+        self.lock = threading.Lock()  # one scan at a time, as each one uses every worker
+
+    def _changed(self, event):
+        # Called by the book with every change; a replaced contact keeps its place, like in a dict
+        if event.kind == "delete":
+            self.order.pop(event.name, None)
+        elif event.kind == "put" and event.before is None:
+            self.order[event.name] = self.next_position
+            self.next_position += 1
+            self.added.add(event.name)
+        self.changed.add(event.name)
+
+    def _rebuild(self, book):
+        self.close()
+        shards = [{"notes": {}, "fields": {}} for _ in range(self.workers)]
+        rows = 0
+        for position, record in enumerate(book.values()):
+            name = record.name.value
+            self.order[name] = position
+            shard = shards[shard_of(name, self.workers)]
+            for dataset, contact in contact_rows(record).items():
+                shard[dataset][name] = contact
+                rows += len(contact)
+        self.next_position = len(self.order)
+        if self.workers > 1 and rows >= self.parallel_min:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.executors = [ProcessPoolExecutor(1, initializer=keep_shard, initargs=(shard,)) for shard in shards]
+        else:
+            self.shards = shards
+            self.rows = rows
+        self.book = weakref.ref(book)
+        book.subscribe(self._changed)
+
+    def _refresh(self, book):
+        if self.book is None or self.book() is not book:
+            self._rebuild(book)
+            return
+        if not self.changed:
+            return
+        changes = [{"notes": {}, "fields": {}} for _ in range(self.workers)]
+        added = self.added
+        for name in sorted(self.changed, key=lambda name: self.order.get(name, -1)):  # added ones in book order
+            record = book.data.get(name)
+            contact = contact_rows(record) if record is not None else {"notes": None, "fields": None}
+            shard = changes[shard_of(name, self.workers)]
+            for dataset, rows in contact.items():
+                shard[dataset][name] = rows
+        self.changed = set()
+        self.added = set()
+        if self.executors:
+            # Each worker runs its update before the scans submitted after it
+            for executor, change in zip(self.executors, changes):
+                executor.submit(update_kept_shard, change)
+            return
+        for shard, change in zip(self.shards, changes):
+            for dataset, rows in change.items():
+                self.rows += update_rows(shard[dataset], rows, added)
+        if self.workers > 1 and self.rows >= self.parallel_min:
+            self._rebuild(book)  # grown big enough for the workers
+
+    def scan(self, book, dataset, pattern, flags=re.IGNORECASE, columns=(2,)):
+        # Returns the matching rows in book order
+        re.compile(pattern, flags)  # an invalid pattern fails here, not in the workers
+        with self.lock:
+            self._refresh(book)
+            if self.executors:
+                futures = [
+                    executor.submit(scan_kept_shard, dataset, pattern, flags, columns) for executor in self.executors
+                ]
+                found = [row for future in futures for row in future.result()]
             else:
-                print("Please provide the contact name and email address.\n")
-        elif command == "add-note":
-            if len(args) < 3:
-                print(
-                    "Please provide the contact name, a keyword for tag and the note as text.\n"
+                found = [row for shard in self.shards for row in scan_rows(shard[dataset], pattern, flags, columns)]
+            if len(self.executors or self.shards) > 1:
+                found.sort(key=lambda row: self.order[row[0]])  # stable, so the notes of a contact keep their order
+            return found
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+        book = self.book() if self.book is not None else None
+        if book is not None and self._changed in book.subscribers:
+            book.unsubscribe(self._changed)
+        self.executors = []
+        self.shards = []
+        self.rows = 0
+        self.order = {}
+        self.changed = set()
+        self.added = set()
+        self.book = None
+
+
+SCAN_ENGINE = ScanEngine()
+
+
+############ SAVE FILE AS A DATABASE
+
+
+# When the journal is synced to disk: "always" after every change, "batch" once per
+# commit (each command, or each batch of writes in server.py), or "never", leaving
+# it to the system. Chosen with --fsync.
+JOURNAL_FSYNC_POLICIES = ("always", "batch", "never")
+JOURNAL_FSYNC = "batch"
+MODULE_NAME = "Final_Project"  # module the pickled classes are saved under, even when this file runs as a script
+
+
+class BookUnpickler(pickle.Unpickler):
+    # Reads books and journals written before the classes were saved under
+    # MODULE_NAME, when running this file as a script saved them under __main__
+    def find_class(self, module, name):
+        if module == "__main__":
+            module = __name__
+        return super().find_class(module, name)
+
+
+def load_pickle(f):
+    return BookUnpickler(f).load()
+
+
+def torn_tail(f, start):
+    # True when an entry starting at start that failed to load can only be the
+    # last write cut short by a crash: reading it ran into the end of the file,
+    # or everything from start on is zeros
+    if not f.read(1):
+        return True
+    f.seek(start)
+    return not f.read().strip(b"\0")
+
+
+# The journal is folded into a new snapshot once it outgrows this share of the
+# snapshot: a save costs the size of the book, so it is paid once for a number of
+# changes that grows with the book, and the replay on start stays shorter than
+# loading the snapshot. Small books wait for COMPACT_MIN_BYTES of journal.
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 1 << 20
+
+
+def record_values(record):
+    # Plain values of a record, much faster to pickle than the record itself
+    return (
+        record.phone.value if record.phone else None,
+        record.email.value if record.email else None,
+        record.address.value if record.address else None,
+        record.birthday.value.toordinal() if record.birthday else 0,
+        record.notes or None,
+    )
+
+
+def record_row(record):
+    return (record.name.value, *record_values(record))
+
+
+def values_record(name, phone, email, address, birthday, notes):
+    # The record of the name and the record_values saved for it
+    return Record.restore(name, phone, email, address, date.fromordinal(birthday) if birthday else None, notes)
+
+
+def snapshot_size(filename):
+    # Bytes of the snapshot file, or of every file of a .shards directory
+    try:
+        if os.path.isdir(filename):
+            return sum(entry.stat().st_size for entry in os.scandir(filename) if entry.is_file())
+        return os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+
+
+class Journal:
+    # Write-ahead log of the changes made since the last snapshot of the book.
+    # Entries are (seq, "put", name, record), (seq, "delete", name),
+    # (seq, "field", name, field, value), (seq, "note", name, tag, note or None) and
+    # (seq, "add", rows) for a batch of contacts added by add_records, one record_row
+    # each numbered from seq. Journals written before entries held their seq are
+    # read as well.
+    def __init__(self, snapshot, fsync=JOURNAL_FSYNC, compact_ratio=COMPACT_RATIO):
+        self.snapshot = snapshot
+        self.filename = snapshot + ".journal"
+        if fsync not in JOURNAL_FSYNC_POLICIES:
+            raise ValueError(f"The journal fsync policy must be one of {', '.join(JOURNAL_FSYNC_POLICIES)}.")
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio  # None when something else saves the snapshot
+        self.snapshot_size = snapshot_size(snapshot)
+        self.snapshot_seq = 0  # seq of the book as loaded from the snapshot, set by attach_journal
+        self.entries = 0
+        self.unsynced = False
+        self.file = open(self.filename, "ab")
+
+    def append(self, entry):
+        self.extend([entry])
+
+    def extend(self, entries):
+        self.file.writelines(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL) for entry in entries)
+        self.file.flush()
+        self.entries += len(entries)
+        self.unsynced = True
+        if self.fsync == "always":
+            self.sync()
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+
+    def commit(self):
+        # Called once the current command has been applied
+        if self.fsync == "batch":
+            self.sync()
+
+    def needs_compaction(self):
+        if self.compact_ratio is None:
+            return False
+        return self.file.tell() >= max(COMPACT_MIN_BYTES, self.compact_ratio * self.snapshot_size)
+
+    def drop_before(self, offset, entries):
+        # Removes the first entries, written before offset, once a snapshot holding them is saved
+        self.file.flush()
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+        with open(self.filename + ".tmp", "wb") as f:
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.filename + ".tmp", self.filename)
+        self.file.close()
+        self.file = open(self.filename, "ab")
+        self.entries -= entries
+        self.snapshot_size = snapshot_size(self.snapshot)
+
+    def truncate(self):
+        self.file.truncate(0)
+        self.sync()
+        self.entries = 0
+        self.snapshot_size = snapshot_size(self.snapshot)
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    @staticmethod
+    def replay(filename, book):
+        # Applies the journal to book and returns how many entries were applied.
+        # A torn entry left by a crash at the end of the file ends the replay and
+        # is cut off; any other error is raised and the file is left as it is.
+        entries = 0
+        try:
+            f = open(filename, "r+b")
+        except FileNotFoundError:
+            return entries
+        with f, paused_gc():
+            valid_size = 0
+            while True:
+                try:
+                    entry = load_pickle(f)
+                except (EOFError, pickle.UnpicklingError):
+                    if not torn_tail(f, valid_size):
+                        raise
+                    break
+                Journal.apply(book, entry)
+                entries += 1
+                valid_size = f.tell()
+            if f.seek(0, os.SEEK_END) != valid_size:
+                f.truncate(valid_size)
+        return entries
+
+    @staticmethod
+    def apply(book, entry):
+        # Entries up to the seq of the book are already in its snapshot: a crash
+        # after the snapshot is swapped in but before the journal is cut leaves them
+        seq = None
+        if isinstance(entry[0], int):
+            seq, *entry = entry
+        # The changes get back the seq they were made with, which the consumers of
+        # change events rely on; old entries are numbered one after the other.
+        if entry[0] == "add":
+            rows = entry[1]
+            if seq is not None:
+                skipped = max(book.seq - seq + 1, 0)
+                rows = rows[skipped:]
+                book.seq = seq + skipped - 1
+            if rows:
+                book.add_records([values_record(*row) for row in rows])
+            return
+        if seq is not None:
+            if seq <= book.seq:
+                return
+            book.seq = seq - 1
+        action, name, *values = entry
+        if action == "put":
+            book[name] = values[0]
+        elif name not in book.data:
+            book.seq += 1  # a one-shot book may not hold the contact; the change keeps its seq
+            return
+        elif action == "delete":
+            del book[name]
+        elif action == "field":
+            book.data[name]._set_field(*values)
+        elif action == "note":
+            book.data[name]._set_note(*values)
+
+
+@timed("save_to_pickle")
+def save_to_pickle(data, filename="data.pkl"):
+    # The snapshot is written next to the old one and swapped in, so a crash
+    # never leaves a half-written file; the journal is then folded into it.
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        pickle.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+    if os.path.exists(filename + ".index"):
+        save_name_index(data, filename)  # kept up to date once one-shot commands use it
+    journal = getattr(data, "journal", None)
+    if journal is not None and journal.snapshot == filename:
+        journal.truncate()
+
+
+@timed("load_from_pickle")
+def load_from_pickle(filename="data.pkl", fsync=JOURNAL_FSYNC):
+    try:
+        with open(filename, "rb") as f:
+            book = load_pickle(f)
+    except FileNotFoundError:
+        book = AddressBook()  # Start an empty book if the file doesn't exist
+    return attach_journal(book, filename, fsync)
+
+
+def attach_journal(book, filename, fsync=JOURNAL_FSYNC):
+    # Applies the changes made since the snapshot filename was written, then logs the new ones
+    snapshot_seq = book.seq
+    replayed = Journal.replay(filename + ".journal", book)
+    book.journal = Journal(filename, fsync)
+    book.journal.entries = replayed
+    book.journal.snapshot_seq = snapshot_seq
+    return book
+
+
+############ CHANGE EVENTS
+
+
+class ChangeEvent:
+    # One change of the book, numbered by seq. kind is "put" (a contact added or
+    # replaced), "delete", "field" (key is the field) or "note" (key is the tag);
+    # before and after hold the record, field value or note before and after the
+    # change, None when there was none.
+    __slots__ = ("seq", "kind", "name", "key", "before", "after")
+
+    def __init__(self, seq, kind, name, key=None, before=None, after=None):
+        self.seq = seq
+        self.kind = kind
+        self.name = name
+        self.key = key
+        self.before = before
+        self.after = after
+
+    def entry(self):
+        # The journal entry replaying the change
+        if self.kind == "put":
+            return (self.seq, "put", self.name, self.after)
+        if self.kind == "delete":
+            return (self.seq, "delete", self.name)
+        return (self.seq, self.kind, self.name, self.key, self.after)
+
+    def to_dict(self):
+        event = {"seq": self.seq, "type": self.kind, "name": self.name}
+        if self.kind == "field":
+            event["field"] = self.key
+        elif self.kind == "note":
+            event["tag"] = self.key
+        event["before"] = event_value(self.before)
+        event["after"] = event_value(self.after)
+        return event
+
+
+def event_value(value):
+    # JSON value of what a ChangeEvent holds, in the form used by export
+    if isinstance(value, Record):
+        return contact_values(value)
+    if isinstance(value, Birthday):
+        return f"{value.value:%d.%m.%Y}"
+    if isinstance(value, Field):
+        return value.value
+    if isinstance(value, Missing):
+        return None
+    return value
+
+
+class EventSink:
+    # Subscriber appending every change of the book to a JSON lines file, one
+    # event per line, flushed at once so the file can be followed with tail -f.
+    # An existing file is continued: seq never goes back.
+    def __init__(self, filename):
+        self.filename = filename
+        self.last_seq = 0
+        try:
+            with open(filename, "rb") as f:
+                f.seek(max(0, os.path.getsize(filename) - 65536))
+                lines = f.read().splitlines()
+            if lines:
+                self.last_seq = json.loads(lines[-1])["seq"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        self.file = open(filename, "a", encoding="utf-8")
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event.to_dict(), ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def attach_event_sink(book, filename):
+    sink = EventSink(filename)
+    book.seq = max(book.seq, sink.last_seq)
+    return book.subscribe(sink)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS records (
+    name TEXT PRIMARY KEY,
+    phone TEXT,
+    email TEXT,
+    email_key TEXT,
+    address TEXT,
+    address_key TEXT,
+    birthday TEXT,
+    birthday_md INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_phone ON records (phone);
+CREATE INDEX IF NOT EXISTS records_email ON records (email_key);
+CREATE INDEX IF NOT EXISTS records_address ON records (address_key);
+CREATE INDEX IF NOT EXISTS records_birthday ON records (birthday);
+CREATE INDEX IF NOT EXISTS records_birthday_md ON records (birthday_md, name);
+CREATE TABLE IF NOT EXISTS notes (
+    name TEXT,
+    tag TEXT,
+    note TEXT,
+    PRIMARY KEY (name, tag)
+);
+"""
+RECORD_COLUMNS = "name, phone, email, address, birthday"
+SQLITE_MAX_VARIABLES = 999  # parameters of one statement in older SQLite builds
+SQLITE_KEY_COLUMNS = {"phone": "phone", "email": "email_key", "address": "address_key", "birthday": "birthday"}
+
+
+def sqlite_record_row(record):
+    name = record.name.value
+    phone, email, address, birthday = (
+        getattr(record, field).value if isinstance(getattr(record, field), Field) else None
+        for field in ("phone", "email", "address", "birthday")
+    )
+    return (
+        name,
+        phone,
+        email,
+        AddressBook.index_key("email", record.email),
+        address,
+        AddressBook.index_key("address", record.address),
+        birthday.isoformat() if birthday else None,
+        birthday.month * 100 + birthday.day if birthday else None,
+    )
+
+
+class SQLiteRecords(MutableMapping):
+    # The records of a SQLiteAddressBook, read from the database on first access.
+    # Loaded records are shared while something still uses them.
+    def __init__(self, book):
+        self.book = book
+        self.loaded = weakref.WeakValueDictionary()
+
+    def _record(self, row):
+        name, phone, email, address, birthday = row
+        record = self.loaded.get(name)
+        if record is None:
+            notes = dict(
+                self.book.connection.execute(
+                    "SELECT tag, note FROM notes WHERE name = ? ORDER BY rowid", (name,)
                 )
+            )
+            birthday = date.fromisoformat(birthday) if birthday else None
+            record = Record.restore(name, phone, email, address, birthday, notes)
+            record.book = self.book
+            self.loaded[name] = record
+        return record
+
+    def __getitem__(self, name):
+        record = self.loaded.get(name)
+        if record is not None:
+            return record
+        row = self.book.connection.execute(
+            f"SELECT {RECORD_COLUMNS} FROM records WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return self._record(row)
+
+    def __setitem__(self, name, record):
+        self.loaded[name] = record
+
+    def __delitem__(self, name):
+        self.loaded.pop(name, None)
+
+    def __contains__(self, name):
+        return (
+            self.book.connection.execute(
+                "SELECT 1 FROM records WHERE name = ?", (name,)
+            ).fetchone()
+            is not None
+        )
+
+    def __iter__(self):
+        for (name,) in self.book.connection.execute(
+            "SELECT name FROM records ORDER BY rowid"
+        ):
+            yield name
+
+    def __len__(self):
+        return self.book.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def select(self, where="", parameters=()):
+        rows = self.book.connection.execute(
+            f"SELECT {RECORD_COLUMNS} FROM records {where}", parameters
+        ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def items(self):
+        for row in self.book.connection.execute(
+            f"SELECT {RECORD_COLUMNS} FROM records ORDER BY rowid"
+        ):
+            record = self._record(row)
+            yield record.name.value, record
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+
+class SQLiteAddressBook(AddressBook):
+    # AddressBook kept in a SQLite database: records are loaded when used and
+    # search-by, birthdays and search-note run as SQL queries.
+    def __init__(self, filename):
+        self.filename = filename
+        import sqlite3
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)  # server.py reads in other threads
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.connection.create_function("py_lower", 1, str.lower, deterministic=True)
+        self.journal = None
+        self.generation = 0
+        self.render_cache = OrderedDict()
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        self.seq = row[0] if row else 0
+        self.subscribers = []
+        self.data = SQLiteRecords(self)
+
+    def _apply(self, event):
+        # The database is the index: every change is written to it
+        name = event.name
+        if event.kind == "put":
+            record = event.after
+            self.connection.execute("DELETE FROM notes WHERE name = ?", (name,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                sqlite_record_row(record),
+            )
+            self.connection.executemany(
+                "INSERT INTO notes VALUES (?, ?, ?)",
+                ((name, tag, note) for tag, note in record.notes.items()),
+            )
+        elif event.kind == "delete":
+            self.connection.execute("DELETE FROM records WHERE name = ?", (name,))
+            self.connection.execute("DELETE FROM notes WHERE name = ?", (name,))
+        elif event.kind == "field":
+            self.connection.execute(
+                "UPDATE records SET phone = ?, email = ?, email_key = ?, address = ?, "
+                "address_key = ?, birthday = ?, birthday_md = ? WHERE name = ?",
+                sqlite_record_row(self.data[name])[1:] + (name,),
+            )
+        elif event.after is None:
+            self.connection.execute(
+                "DELETE FROM notes WHERE name = ? AND tag = ?", (name, event.key)
+            )
+        elif event.before is None:
+            self.connection.execute("INSERT INTO notes VALUES (?, ?, ?)", (name, event.key, event.after))
+        else:
+            self.connection.execute(
+                "UPDATE notes SET note = ? WHERE name = ? AND tag = ?", (event.after, name, event.key)
+            )
+
+    def add_records(self, records):
+        # Contacts already in the book are replaced, as in AddressBook. The rows are
+        # written first under a savepoint, so a failed write leaves the database,
+        # the loaded records and seq as they were.
+        records = list(records)
+        names = list(dict.fromkeys(record.name.value for record in records))
+        current = {}
+        for start in range(0, len(names), SQLITE_MAX_VARIABLES):
+            chunk = names[start : start + SQLITE_MAX_VARIABLES]
+            for record in self.data.select(f"WHERE name IN ({', '.join('?' * len(chunk))})", chunk):
+                current[record.name.value] = record
+        latest = {record.name.value: record for record in records}
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")  # or releasing the savepoint would commit
+        self.connection.execute("SAVEPOINT add_records")
+        try:
+            self.connection.executemany("DELETE FROM notes WHERE name = ?", ((name,) for name in current))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sqlite_record_row(record) for record in latest.values()),
+            )
+            self.connection.executemany(
+                "INSERT INTO notes VALUES (?, ?, ?)",
+                (
+                    (name, tag, note)
+                    for name, record in latest.items()
+                    for tag, note in record.notes.items()
+                ),
+            )
+        except BaseException:
+            self.connection.execute("ROLLBACK TO add_records")
+            raise
+        finally:
+            self.connection.execute("RELEASE add_records")
+        events = []
+        for record in records:
+            name = record.name.value
+            record.book = self
+            self.data[name] = record
+            self.seq += 1
+            events.append(ChangeEvent(self.seq, "put", name, None, current.get(name), record))
+            current[name] = record
+        self._emitted(events)
+
+    def __getstate__(self):
+        raise TypeError("A SQLite address book is saved in its database, not pickled.")
+
+    def items(self):
+        return self.data.items()
+
+    def values(self):
+        return self.data.values()
+
+    def rebuild_indexes(self):
+        pass  # the database maintains its own indexes
+
+    def find_by(self, field, value):
+        key = self.index_key(field, value)
+        if field == "birthday":
+            key = key.isoformat()
+        return self.data.select(
+            f"WHERE {SQLITE_KEY_COLUMNS[field]} = ? ORDER BY rowid", (key,)
+        )
+
+    def _birthdays_between(self, start, end):
+        end_key = end.month * 100 + end.day
+        if end_key == 228 and not isleap(end.year):
+            end_key = 229  # 29 February birthdays move to the 28th this year
+        for birthday_md, name in self.connection.execute(
+            "SELECT birthday_md, name FROM records WHERE birthday_md BETWEEN ? AND ? "
+            "ORDER BY birthday_md, name",
+            (start.month * 100 + start.day, end_key),
+        ):
+            yield birthday_in_year(birthday_md // 100, birthday_md % 100, start.year), name
+
+    def _names(self):
+        return [name for (name,) in self.connection.execute("SELECT name FROM records ORDER BY name")]
+
+    def sort_indexes(self):
+        pass  # the database keeps its own indexes
+
+    def birthday_ordinals(self):
+        return array(
+            "i",
+            (
+                date.fromisoformat(birthday).toordinal()
+                for (birthday,) in self.connection.execute("SELECT birthday FROM records WHERE birthday IS NOT NULL")
+            ),
+        )
+
+    def phones_with_prefix(self, digits):
+        for (phone,) in self.connection.execute(
+            "SELECT DISTINCT phone FROM records WHERE phone >= ? AND phone < ? ORDER BY phone",
+            (digits, digits + ":"),  # ":" follows "9"
+        ):
+            yield phone
+
+    def phones_with_suffix(self, digits):
+        for (phone,) in self.connection.execute(
+            "SELECT DISTINCT phone FROM records WHERE phone LIKE ? ORDER BY phone",
+            ("%" + digits,),  # digits hold no wildcard
+        ):
+            yield phone
+
+    def names_with_prefix(self, prefix):
+        for (name,) in self.connection.execute(
+            "SELECT name FROM records WHERE name >= ? AND name < ? ORDER BY name",
+            (prefix, prefix + chr(sys.maxunicode)),
+        ):
+            yield name
+
+    def search_notes(self, keywords, match_all=True):
+        keywords = list(dict.fromkeys(tokenize(" ".join(keywords))))
+        operator = " AND " if match_all else " OR "
+        rows = self.connection.execute(
+            "SELECT name, tag, note FROM notes WHERE "
+            + operator.join("instr(py_lower(note), ?)" for _ in keywords)
+            + " ORDER BY rowid",
+            keywords,
+        )
+        found = []
+        for name, tag, note in rows:
+            tokens = tokenize(note)
+            counts = [
+                sum(token.startswith(keyword) for token in tokens) for keyword in keywords
+            ]
+            matched = sum(1 for count in counts if count)
+            if matched == len(keywords) or (matched and not match_all):
+                found.append((-matched, -sum(counts), name, tag, note))
+        found.sort(key=lambda entry: entry[:2])
+        return [(name, tag, note) for _, _, name, tag, note in found]
+
+    def search_notes_substring(self, text):
+        text = text.lower()
+        return [
+            (name, tag, note)
+            for name, tag, note in self.connection.execute(
+                "SELECT name, tag, note FROM notes ORDER BY rowid"
+            )
+            if text in note.lower()
+        ]
+
+    def commit(self):
+        # seq is written in the same transaction as the changes it numbers
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('seq', ?)", (self.seq,))
+        self.connection.commit()
+
+    def save(self):
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def migrate_to_sqlite(pickle_filename="data.pkl", sqlite_filename="data.db"):
+    book = load_from_pickle(pickle_filename)
+    book.close()
+    database = SQLiteAddressBook(sqlite_filename)
+    with database.connection:
+        for name, record in book.items():
+            database[name] = record
+    database.seq = book.seq  # a copy, not new changes
+    database.close()
+    return len(book)
+
+
+############ COLUMNAR SNAPSHOT
+# A read-optimized snapshot (.col) that is opened with mmap instead of being unpickled.
+# Records are stored sorted by name, one column per field; strings are an array of
+# offsets into UTF-8 data and birthdays are date ordinals (0 for none). The *.order
+# columns list the records having a value sorted by it, for binary search.
+
+COLUMNAR_MAGIC = b"PACOL002"
+COLUMNAR_STRINGS = ("name", "phone", "email", "address", "tag", "note")
+COLUMNAR_TYPES = {
+    **{f"{column}.offsets": "Q" for column in COLUMNAR_STRINGS},
+    **{f"{column}.data": "B" for column in COLUMNAR_STRINGS},
+    "birthday": "i",
+    "notes": "Q",  # index of the first tag and note of every record
+    "phone.order": "I",
+    "email.order": "I",
+    "address.order": "I",
+    "birthday.order": "I",
+    "calendar.order": "I",  # by month and day of the birthday, then by name
+}
+COLUMNAR_HEADER = struct.Struct(f"<8sQQ{2 * len(COLUMNAR_TYPES)}Q")  # magic, contacts, seq, then every column
+COLUMNAR_HEADER_V1 = (b"PACOL001", struct.Struct(f"<8sQ{2 * len(COLUMNAR_TYPES)}Q"))  # written before seq was kept
+
+
+def string_column(values):
+    encoded = [value.encode() for value in values]
+    offsets = array("Q", [0])
+    offsets.extend(accumulate(map(len, encoded)))
+    return offsets, b"".join(encoded)
+
+
+def column_order(keys):
+    return array("I", sorted((index for index, key in enumerate(keys) if key), key=keys.__getitem__))
+
+
+@timed("save_columnar")
+def save_columnar(book, filename="data.col"):
+    records = sorted(book.values(), key=lambda record: record.name.value)
+    strings = {
+        "name": [record.name.value for record in records],
+        "phone": [record.phone.value if record.phone else "" for record in records],
+        "email": [record.email.value if record.email else "" for record in records],
+        "address": [record.address.value if record.address else "" for record in records],
+        "tag": [tag for record in records for tag in record.notes],
+        "note": [note for record in records for note in record.notes.values()],
+    }
+    birthdays = array("i", (record.birthday.value.toordinal() if record.birthday else 0 for record in records))
+    dates = {index: date.fromordinal(ordinal) for index, ordinal in enumerate(birthdays) if ordinal}
+    columns = {
+        "birthday": birthdays,
+        "notes": array("Q", [0]) + array("Q", accumulate(len(record.notes) for record in records)),
+        "phone.order": column_order(strings["phone"]),
+        "email.order": column_order([email.lower() for email in strings["email"]]),
+        "address.order": column_order([address.lower() for address in strings["address"]]),
+        "birthday.order": column_order(birthdays),
+        "calendar.order": array("I", sorted(dates, key=lambda index: (dates[index].month, dates[index].day))),
+    }
+    for column, values in strings.items():
+        columns[f"{column}.offsets"], columns[f"{column}.data"] = string_column(values)
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(bytes(COLUMNAR_HEADER.size))
+        positions = []
+        for section in COLUMNAR_TYPES:
+            f.write(bytes(-f.tell() % 8))  # every column starts 8-byte aligned
+            data = memoryview(columns[section])
+            positions += [f.tell(), data.nbytes]
+            f.write(data)
+        f.seek(0)
+        f.write(COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, len(records), book.seq, *positions))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+    journal = getattr(book, "journal", None)
+    if journal is not None and journal.snapshot == filename:
+        journal.truncate()
+
+
+class MappedStrings:
+    # A string column of a columnar snapshot, decoded on access
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        return str(self.data[self.offsets[index] : self.offsets[index + 1]], "utf-8")
+
+
+class MappedCalendar:
+    # The (month, day, name) birthday calendar of a columnar snapshot, read from calendar.order
+    def __init__(self, book):
+        self.order = book.columns["calendar.order"]
+        self.birthdays = book.columns["birthday"]
+        self.names = book.names
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        record = self.order[index]
+        birthday = date.fromordinal(self.birthdays[record])
+        return birthday.month, birthday.day, self.names[record]
+
+
+class ColumnarRecords(Mapping):
+    # The records of a ColumnarAddressBook, built from the mapped columns on first access.
+    # Loaded records are shared while something still uses them.
+    def __init__(self, book):
+        self.book = book
+        self.loaded = weakref.WeakValueDictionary()
+
+    def position(self, name):
+        names = self.book.names
+        position = bisect_left(names, name)
+        if position < len(names) and names[position] == name:
+            return position
+        return None
+
+    def record_at(self, position):
+        book = self.book
+        name = book.names[position]
+        record = self.loaded.get(name)
+        if record is None:
+            first, last = book.columns["notes"][position : position + 2]
+            notes = {book.tags[index]: book.notes[index] for index in range(first, last)}
+            ordinal = book.columns["birthday"][position]
+            record = Record.restore(
+                name,
+                book.phones[position] or None,
+                book.emails[position] or None,
+                book.addresses[position] or None,
+                date.fromordinal(ordinal) if ordinal else None,
+                notes,
+            )
+            record.book = book
+            self.loaded[name] = record
+        return record
+
+    def __getitem__(self, name):
+        record = self.loaded.get(name)
+        if record is not None:
+            return record
+        position = self.position(name)
+        if position is None:
+            raise KeyError(name)
+        return self.record_at(position)
+
+    def __contains__(self, name):
+        return self.position(name) is not None
+
+    def __iter__(self):
+        for position in range(len(self.book.names)):
+            yield self.book.names[position]
+
+    def __len__(self):
+        return len(self.book.names)
+
+
+class ColumnarAddressBook(AddressBook):
+    # AddressBook opened from a columnar snapshot: opening it takes the same time for any
+    # size, and search-by, birthdays, name search and all read the mapped columns.
+    # The first change loads every record and turns it into a plain AddressBook.
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:8] == COLUMNAR_HEADER_V1[0]:
+            magic, count, *positions = COLUMNAR_HEADER_V1[1].unpack_from(mapped)
+            seq = 0
+        else:
+            magic, count, seq, *positions = COLUMNAR_HEADER.unpack_from(mapped)
+            if magic != COLUMNAR_MAGIC:
+                raise ValueError(f"{filename} is not a columnar snapshot.")
+        view = memoryview(mapped)
+        self.columns = {
+            section: view[offset : offset + length].cast(typecode)
+            for (section, typecode), offset, length in zip(
+                COLUMNAR_TYPES.items(), positions[::2], positions[1::2]
+            )
+        }
+        self.names, self.phones, self.emails, self.addresses, self.tags, self.notes = (
+            MappedStrings(self.columns[f"{column}.offsets"], self.columns[f"{column}.data"])
+            for column in COLUMNAR_STRINGS
+        )
+        self.note_index = None  # built by the first search-note
+        self.note_tokens = None
+        self.note_index_lock = threading.Lock()
+        self.journal = None
+        self.generation = 0
+        self.render_cache = OrderedDict()
+        self.seq = seq
+        self.subscribers = []
+        self.data = ColumnarRecords(self)
+
+    def __getstate__(self):
+        raise TypeError("A columnar address book is saved with save_columnar, not pickled.")
+
+    def _materialize(self):
+        records = {record.name.value: record for record in self.values()}
+        journal, generation, seq, subscribers = self.journal, self.generation, self.seq, self.subscribers
+        self.__dict__.clear()  # releases the mapped file
+        self.__class__ = AddressBook
+        AddressBook.__init__(self)
+        self.data = records
+        self.rebuild_indexes()
+        self.journal, self.generation, self.seq, self.subscribers = journal, generation, seq, subscribers
+
+    def __setitem__(self, name, record):
+        self._materialize()
+        self[name] = record
+
+    def __delitem__(self, name):
+        self._materialize()
+        del self[name]
+
+    def add_records(self, records):
+        self._materialize()
+        self.add_records(records)
+
+    def field_changed(self, record, field, old_value, new_value):
+        # The book is built with the old value, then the change goes through AddressBook
+        setattr(record, field, old_value)
+        self._materialize()
+        setattr(record, field, new_value)
+        self.field_changed(record, field, old_value, new_value)
+
+    def note_changed(self, record, tag, old_note, new_note):
+        new_notes = dict(record.notes)
+        record.notes.pop(tag, None)
+        if old_note is not None:
+            record.notes[tag] = old_note
+        self._materialize()
+        record.notes.clear()
+        record.notes.update(new_notes)
+        self.note_changed(record, tag, old_note, new_note)
+
+    def items(self):
+        for position in range(len(self.names)):
+            record = self.data.record_at(position)
+            yield record.name.value, record
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+    def find_by(self, field, value):
+        key = self.index_key(field, value)
+        if field == "birthday":
+            key = key.toordinal()
+            column = self.columns["birthday"].__getitem__
+        elif field == "phone":
+            column = self.phones.__getitem__
+        else:
+            strings = self.emails if field == "email" else self.addresses
+            column = lambda position: strings[position].lower()
+        order = self.columns[f"{field}.order"]
+        low = bisect_left(order, key, key=column)
+        high = bisect_right(order, key, low, key=column)
+        return [self.data.record_at(position) for position in order[low:high]]
+
+    def _names(self):
+        return self.names
+
+    def birthday_ordinals(self):
+        return self.columns["birthday"]  # 0 for contacts without a birthday
+
+    def phones_with_prefix(self, digits):
+        order = self.columns["phone.order"]
+        position = bisect_left(order, digits, key=self.phones.__getitem__)
+        previous = None
+        for position in range(position, len(order)):
+            phone = self.phones[order[position]]
+            if not phone.startswith(digits):
+                break
+            if phone != previous:
+                yield phone
+            previous = phone
+
+    def phones_with_suffix(self, digits):
+        # The snapshot has no reversed phone column: the phones are scanned in order
+        previous = None
+        for record in self.columns["phone.order"]:
+            phone = self.phones[record]
+            if phone.endswith(digits) and phone != previous:
+                yield phone
+            previous = phone
+
+    def _calendar(self):
+        return MappedCalendar(self)
+
+    def sort_indexes(self):
+        pass  # the snapshot's columns are sorted when written
+
+    def _mapped_notes(self):
+        # (name, tag, note) of every note, in name order
+        offsets = self.columns["notes"]
+        for position in range(len(self.names)):
+            first, last = offsets[position : position + 2]
+            if first != last:
+                name = self.names[position]
+                for index in range(first, last):
+                    yield name, self.tags[index], self.notes[index]
+
+    def search_notes(self, keywords, match_all=True):
+        with self.note_index_lock:  # another thread may be building it
+            if self.note_index is None:  # the snapshot holds no note index
+                self.note_index = {}
+                self.note_tokens = []
+                self._index_notes(self._mapped_notes())
+        return super().search_notes(keywords, match_all)
+
+    def search_notes_substring(self, text):
+        text = text.lower()
+        return [(name, tag, note) for name, tag, note in self._mapped_notes() if text in note.lower()]
+
+    def save(self):
+        pass  # nothing changed since the snapshot was written, or the book would be an AddressBook now
+
+
+def migrate_to_columnar(pickle_filename="data.pkl", columnar_filename="data.col"):
+    book = load_from_pickle(pickle_filename)
+    book.close()
+    save_columnar(book, columnar_filename)
+    return len(book)
+
+
+@timed("load_columnar")
+def load_columnar(filename="data.col", fsync=JOURNAL_FSYNC):
+    try:
+        book = ColumnarAddressBook(filename)
+    except FileNotFoundError:
+        book = AddressBook()
+    return attach_journal(book, filename, fsync)
+
+
+############ SHARDED STORAGE
+# A book saved as a directory (.shards) of pickle files, one per group of names.
+# Every change marks the shard of its contact as dirty and a save rewrites only
+# the dirty shards, so saving a few edits costs the same for any size of book.
+
+SHARD_COUNT = 256
+SHARD_LOAD_THREADS = 8
+
+
+def shard_of(name, shard_count):
+    return zlib.crc32(name.encode()) % shard_count
+
+
+def shard_filename(directory, shard):
+    return os.path.join(directory, f"shard-{shard:04d}.pkl")
+
+
+class ShardedAddressBook(AddressBook):
+    def __init__(self, directory, shard_count=SHARD_COUNT):
+        self.directory = directory
+        self.shard_count = shard_count
+        self.shard_names = [set() for _ in range(shard_count)]
+        self.dirty = set()  # shards changed since the last save
+        super().__init__()
+
+    def __getstate__(self):
+        raise TypeError("A sharded address book is saved with save_shards, not pickled.")
+
+    def _index_name(self, name):
+        super()._index_name(name)
+        self.shard_names[shard_of(name, self.shard_count)].add(name)
+
+    def _index_records(self, pairs):
+        super()._index_records(pairs)
+        for name, _ in pairs:
+            self.shard_names[shard_of(name, self.shard_count)].add(name)
+
+    def _unindex_name(self, name):
+        super()._unindex_name(name)
+        self.shard_names[shard_of(name, self.shard_count)].discard(name)
+
+    def rebuild_indexes(self):
+        self.shard_names = [set() for _ in range(self.shard_count)]
+        super().rebuild_indexes()
+
+    def _apply(self, event):
+        super()._apply(event)
+        self.dirty.add(shard_of(event.name, self.shard_count))
+
+    def _apply_batch(self, events):
+        super()._apply_batch(events)
+        self.dirty.update(shard_of(event.name, self.shard_count) for event in events)
+
+
+def read_shard(filename):
+    try:
+        with open(filename, "rb") as f:
+            return load_pickle(f)
+    except FileNotFoundError:
+        return []
+
+
+@timed("save_shards")
+def save_shards(book, directory):
+    # Each dirty shard is written next to the old one and swapped in; the journal
+    # is only truncated once every shard is saved, so a crash loses nothing
+    os.makedirs(directory, exist_ok=True)
+    for shard in sorted(book.dirty):
+        filename = shard_filename(directory, shard)
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump([book.data[name] for name in book.shard_names[shard]], f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+    manifest = os.path.join(directory, "manifest.json")
+    with open(manifest + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"shards": book.shard_count, "seq": book.seq}, f)  # seq of the changes the shards hold
+    os.replace(manifest + ".tmp", manifest)
+    book.dirty.clear()
+    if book.journal is not None and book.journal.snapshot == directory:
+        book.journal.truncate()
+
+
+@timed("load_shards")
+def load_shards(directory="data.shards", fsync=JOURNAL_FSYNC, threads=SHARD_LOAD_THREADS):
+    manifest = read_manifest(directory) or {"shards": SHARD_COUNT}  # a new book
+    book = ShardedAddressBook(directory, manifest["shards"])
+    book.seq = manifest.get("seq", 0)
+    filenames = [shard_filename(directory, shard) for shard in range(book.shard_count)]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(threads) as executor:
+        for records in executor.map(read_shard, filenames):
+            book.load_records(records)
+    return attach_journal(book, directory, fsync)
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def migrate_to_shards(pickle_filename="data.pkl", directory="data.shards", shard_count=SHARD_COUNT):
+    book = load_from_pickle(pickle_filename)
+    book.close()
+    sharded = ShardedAddressBook(directory, shard_count)
+    sharded.load_records(book.values())
+    sharded.seq = book.seq
+    sharded.dirty = set(range(shard_count))
+    save_shards(sharded, directory)
+    return len(book)
+
+
+############ NAME INDEX
+# One-shot commands read only the contacts they name. A pickled book keeps for
+# this a name index next to it (data.pkl.index): the sorted names, and the
+# values of every record pickled on their own, so a record is found by a binary
+# search over the memory-mapped file. A sharded book reads the shards of the names instead.
+
+NAME_INDEX_MAGIC = b"PANAMES2"
+LAZY_STORAGE = (".db", ".sqlite", ".sqlite3", ".col")  # read only the contacts a command uses
+NAME_INDEX_HEADER = struct.Struct("<8sQQQQ")  # magic, snapshot size, snapshot mtime_ns, contacts, snapshot seq
+
+
+def snapshot_version(filename):
+    info = os.stat(filename)
+    return info.st_size, info.st_mtime_ns
+
+
+def save_name_index(book, filename, seq=None):
+    # seq is that of the snapshot, when the book also holds the changes of its journal
+    names = sorted(book.data)
+    records = [pickle.dumps(record_values(book.data[name]), pickle.HIGHEST_PROTOCOL) for name in names]
+    name_offsets, name_data = string_column(names)
+    record_offsets = array("Q", [0])
+    record_offsets.extend(accumulate(map(len, records)))
+    with open(filename + ".index.tmp", "wb") as f:
+        f.write(
+            NAME_INDEX_HEADER.pack(
+                NAME_INDEX_MAGIC, *snapshot_version(filename), len(names), book.seq if seq is None else seq
+            )
+        )
+        f.write(name_offsets)
+        f.write(record_offsets)
+        f.write(name_data)
+        f.writelines(records)
+    os.replace(filename + ".index.tmp", filename + ".index")
+
+
+def read_name_index(filename, names):
+    # Returns the seq of the snapshot filename and {name: record} for the names found
+    # in its index, or None when there is no index or the snapshot changed since
+    try:
+        f = open(filename + ".index", "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        header = f.read(NAME_INDEX_HEADER.size)
+        if len(header) < NAME_INDEX_HEADER.size:
+            return None
+        magic, size, mtime_ns, count, seq = NAME_INDEX_HEADER.unpack(header)
+        try:
+            if magic != NAME_INDEX_MAGIC or (size, mtime_ns) != snapshot_version(filename):
+                return None
+        except FileNotFoundError:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            name_offsets = NAME_INDEX_HEADER.size
+            record_offsets = name_offsets + 8 * (count + 1)
+            name_data = record_offsets + 8 * (count + 1)
+            record_data = name_data + struct.unpack_from("<Q", mapped, record_offsets - 8)[0]
+
+            def offsets(table, position):
+                return struct.unpack_from("<2Q", mapped, table + 8 * position)
+
+            def name_at(position):
+                first, last = offsets(name_offsets, position)
+                return str(mapped[name_data + first : name_data + last], "utf-8")
+
+            found = {}
+            for name in names:
+                position = bisect_left(range(count), name, key=name_at)
+                if position < count and name_at(position) == name:
+                    first, last = offsets(record_offsets, position)
+                    found[name] = values_record(name, *pickle.loads(mapped[record_data + first : record_data + last]))
+    return seq, found
+
+
+class PartialAddressBook(AddressBook):
+    # The contacts a one-shot command names, with the journal of the whole book:
+    # changes are appended to the journal, and folded into the snapshot the next
+    # time the whole book is loaded, so save() leaves the snapshot as it is.
+    def commit(self):
+        if self.journal is not None:
+            self.journal.commit()
+
+    def save(self):
+        pass
+
+
+def open_partial_book(filename, names, fsync=JOURNAL_FSYNC):
+    # Returns a PartialAddressBook holding the given contacts, or None when the
+    # storage has no way to read them alone (a missing or outdated name index is
+    # then rebuilt by the caller with the whole book)
+    if filename.endswith(".shards"):
+        manifest = read_manifest(filename)
+        if manifest is None:
+            return None
+        shards = {shard_of(name, manifest["shards"]) for name in names}
+        records = [record for shard in shards for record in read_shard(shard_filename(filename, shard))]
+        records = [record for record in records if record.name.value in names]
+        seq = manifest.get("seq", 0)
+    elif filename.endswith(LAZY_STORAGE):
+        return None
+    else:
+        index = read_name_index(filename, names)
+        if index is None:
+            return None
+        seq, found = index
+        records = list(found.values())
+    book = PartialAddressBook()
+    book.load_records(records)
+    book.seq = seq  # the journal replay then numbers its changes from there, like the whole book
+    return attach_journal(book, filename, fsync)
+
+
+############ AUTOSAVE
+# Saves a changed book in the background. The command loop holds Autosave.lock
+# while it runs a command; between commands the worker thread takes it and forks
+# a child process, which writes the snapshot from its copy-on-write image of the
+# book while new commands run. The journal entries the snapshot holds are then
+# dropped, the later ones are kept.
+
+AUTOSAVE_INTERVAL = 60  # seconds after which a changed book is saved
+AUTOSAVE_EVERY = 1000  # changes after which the book is saved at once
+AUTOSAVE_POLL = 0.5  # seconds between two checks of the worker
+
+
+class Autosave:
+    def __init__(self, book, interval=AUTOSAVE_INTERVAL, every=AUTOSAVE_EVERY):
+        self.book = book
+        self.interval = interval
+        self.every = every
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.saved_generation = book.generation
+        self.last_save = time.monotonic()
+        self.child = None  # (pid, journal offset, journal entries, generation, shards) of the running save
+        self.saves = 0
+        self.failures = 0
+
+    def start(self):
+        if self.interval <= 0 or self.book.journal is None:
+            return self  # disabled, or a book saved by its database
+        self.book.journal.compact_ratio = None  # the worker saves instead of commit()
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopping.wait(AUTOSAVE_POLL):
+            with self.lock:
+                self.poll()
+
+    def poll(self):
+        if self.child is not None:
+            self._reap(block=False)
+        elif self._due():
+            self._save()
+
+    def _due(self):
+        changes = self.book.generation - self.saved_generation
+        return changes >= self.every or (changes > 0 and time.monotonic() - self.last_save >= self.interval)
+
+    def _save(self):
+        book = self.book
+        journal = book.journal
+        generation = book.generation
+        shards = getattr(book, "dirty", None)  # a sharded book only writes its dirty shards
+        if shards is not None:
+            book.dirty = set()
+        if not hasattr(os, "fork"):
+            # Without fork the snapshot is written by this thread, holding the lock
+            if shards is not None:
+                book.dirty = shards
+            save_snapshot(book, journal.snapshot)
+            self.saved_generation = generation
+            self.last_save = time.monotonic()
+            self.saves += 1
+            return
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                book.journal = None  # the journal is only changed by the parent
+                if shards is not None:
+                    book.dirty = shards
+                save_snapshot(book, journal.snapshot)
+                status = 0
+            finally:
+                os._exit(status)
+        self.child = (pid, journal.file.tell(), journal.entries, generation, shards)
+
+    def _reap(self, block):
+        pid, offset, entries, generation, shards = self.child
+        done, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        if not done:
+            return
+        self.child = None
+        self.last_save = time.monotonic()
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.book.journal.drop_before(offset, entries)
+            self.saved_generation = generation
+            self.saves += 1
+        else:
+            self.failures += 1  # the journal still has every change; tried again after interval
+            if shards is not None:
+                self.book.dirty |= shards
+
+    def stop(self):
+        # Waits for a running save; the caller saves what changed since
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            with self.lock:
+                if self.child is not None:
+                    self._reap(block=True)
+            self.book.journal.compact_ratio = COMPACT_RATIO
+
+
+def save_snapshot(book, filename):
+    if filename.endswith(".col"):
+        save_columnar(book, filename)
+    elif filename.endswith(".shards"):
+        save_shards(book, filename)
+    else:
+        save_to_pickle(book, filename)
+
+
+def open_book(filename, fsync=JOURNAL_FSYNC):
+    # fsync is the policy of the journal; a SQLite database syncs on its own
+    if filename.endswith((".db", ".sqlite", ".sqlite3")):
+        return SQLiteAddressBook(filename)
+    if filename.endswith(".col"):
+        return load_columnar(filename, fsync)
+    if filename.endswith(".shards"):
+        return load_shards(filename, fsync)
+    return load_from_pickle(filename, fsync)
+
+
+###########
+
+
+@command(
+    "stats",
+    0,
+    2,
+    usage="Please type stats, stats export [file.json] or stats reset.\n",
+    description="Show how long commands take",
+    syntax="stats *Add export [file.json] to save them or reset to start over",
+)
+def showStats(args, book):
+    if not args:
+        return STATS.report() + "\n" + QUERY_CACHE.report()
+    if args[0] == "export" and len(args) == 2:
+        with open(args[1], "w", encoding="utf-8") as f:
+            json.dump({**STATS.to_dict(), "query_cache": QUERY_CACHE.to_dict()}, f, indent=2)
+        return f"Statistics exported to {args[1]}\n"
+    if args[0] == "reset" and len(args) == 1:
+        STATS.reset()
+        QUERY_CACHE.reset()
+        return "Statistics reset.\n"
+    raise ValueError("Please type stats, stats export [file.json] or stats reset.\n")
+
+
+@command(
+    "profile",
+    1,
+    usage="Please provide the command to profile, followed by its arguments.\n",
+    description="Profile one command",
+    syntax="profile [command] [arguments]",
+)
+def profileCommand(args, book):
+    import cProfile
+    import io
+    import pstats
+
+    command, *command_args = args
+    def run():
+        # Output produced while it is read, as by all, is read inside the profiler
+        status, result = dispatch(book, command.lower(), command_args)
+        return status, output_text(result)
+
+    profiler = cProfile.Profile()
+    status, result = profiler.runcall(run)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(20)
+    if status == "error":
+        raise ValueError(f"{result}\n{report.getvalue()}")
+    return f"{result}\n{report.getvalue()}"
+
+
+@command(
+    "exit",
+    aliases=("close",),
+    description="Exit the application",
+    syntax="close or exit",
+)
+def exitAssistant(args, book):
+    return "\n\n\t****** Thank you for using the Personal Assistant! ******\n\t\t\tSee you next time!\n\n"
+
+
+def is_exit(command):
+    return command in COMMANDS["exit"].names
+
+
+def run_script(book, lines, batch_size=1000, output=sys.stdout):
+    # Runs commands without the prompt and reports one JSON line per command.
+    # Output is written and the book committed once per batch of commands.
+    buffer = []
+    pending = 0
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        command, *args = parse_input(line)
+        if is_exit(command):
+            break
+        status, result = dispatch(book, command, args)
+        report = {"line": line_number, "command": command, "status": status, "output": output_text(result).strip()}
+        buffer.append(json.dumps(report) + "\n")
+        pending += 1
+        if pending >= batch_size:
+            book.commit()
+            output.write("".join(buffer))
+            buffer.clear()
+            pending = 0
+    book.commit()
+    output.write("".join(buffer))
+    output.flush()
+
+
+def run_one_shot(filename, command, args, events=None, output=sys.stdout, fsync=JOURNAL_FSYNC):
+    # Runs one command given on the command line and returns its status. A command
+    # naming its contacts only reads those; the timings are written to standard error.
+    started = time.perf_counter()
+    entry = COMMANDS.get(command)
+    book = None
+    if entry is not None and entry.contacts is not None and len(args) >= entry.min_args:
+        names = {name.strip().lower() for name in entry.contacts(args)}
+        book = open_partial_book(filename, names, fsync)
+        if book is None:
+            book = open_book(filename, fsync)
+            if not filename.endswith(LAZY_STORAGE + (".shards",)) and os.path.exists(filename):
+                save_name_index(book, filename, book.journal.snapshot_seq)  # the next commands read only their contacts
+    if book is None:
+        book = open_book(filename, fsync)
+    if events:
+        attach_event_sink(book, events)
+    loaded = time.perf_counter()
+    status, result = dispatch(book, command, args)
+    output.write(output_text(result).strip("\n") + "\n")
+    output.flush()
+    ran = time.perf_counter()
+    book.commit()
+    if isinstance(book, PartialAddressBook) and book.journal.needs_compaction():
+        book.close()
+        book = open_book(filename, fsync)  # the journal is folded into a new snapshot
+        book.save()
+    book.close()
+    contacts = f"{len(book)} contact{'s' * (len(book) != 1)}" if isinstance(book, PartialAddressBook) else "whole book"
+    print(
+        f"import {(started - STARTED) * 1000:.1f} ms, load {(loaded - started) * 1000:.1f} ms ({contacts}), "
+        f"command {(ran - loaded) * 1000:.1f} ms, save {(time.perf_counter() - ran) * 1000:.1f} ms",
+        file=sys.stderr,
+    )
+    return status
+
+
+def enable_completion(book):
+    # Tab completes command names, and contact names where a command expects one
+    try:
+        import readline
+    except ImportError:  # not available on every platform
+        return
+    matches = []
+
+    def complete(text, state):
+        if state == 0:
+            words = readline.get_line_buffer()[: readline.get_begidx()].split()
+            if not words:
+                matches[:] = [name + " " for name in COMMANDS if name.startswith(text.lower())]
             else:
-                print(addNote(args, book))
-        elif command == "show-birthday":
-            if len(args) == 1:
-                print(showBirthday(args, book))
-            else:
-                print("Please provide the contact name to retrieve the birthday.\n")
-        elif command == "birthdays":
-            if args:
-                days_input = args[0]
-                if days_input.isdigit():  # Check if input contains digits only
-                    days_ahead = int(days_input)
-                    if 1 <= days_ahead <= 30:  # Check if days_ahead is within range
-                        print(showBirthdaysInDays(book, days_ahead))
-                    else:
-                        print("Please enter a number of days between 1 and 30.\n")
+                entry = COMMANDS.get(words[0].lower())
+                if entry is not None and entry.name_argument == len(words) - 1:
+                    matches[:] = [
+                        name + " " for name in islice(book.names_with_prefix(text.lower()), NAME_MATCHES)
+                    ]
                 else:
-                    print("Please enter a valid number of days.\n")
-            else:
-                print("Please specify the number of days ahead.\n")
-        elif command == "search-by":
-            if len(args) >= 2:
-                print(searchBy(args, book))
-            else:
-                print(
-                    "Please provide the search option [name] or [email] or [phone] or [address] or [birthday] and [value].\n"
-                )
+                    matches[:] = []
+        return matches[state] if state < len(matches) else None
 
-        elif command == "all":
-            print("\n")
-            for name, record in book.items():
-                print(record)
-            print("\n")
-        elif command == "delete":
-            if args:
-                print(deleteContact(args, book))  # Command for deleting contact
-            else:
-                print("Please provide the contact name you want to discard.\n")
+    readline.set_completer(complete)
+    readline.set_completer_delims(" ")
+    readline.parse_and_bind("tab: complete")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Personal Assistant")
+    parser.add_argument(
+        "--data",
+        default="data.pkl",
+        help="where the book is stored: a pickle file, a columnar snapshot (.col), "
+        "a directory of shards (.shards) or a SQLite database (.db)",
+    )
+    parser.add_argument(
+        "--migrate",
+        nargs=2,
+        metavar=("PICKLE", "TARGET"),
+        help="copy a pickled book into a SQLite database (.db), a columnar snapshot (.col) "
+        "or a directory of shards (.shards) and exit",
+    )
+    parser.add_argument(
+        "--script",
+        metavar="FILE",
+        help="run the commands of FILE ('-' for standard input) without the prompt",
+    )
+    parser.add_argument(
+        "--autosave-interval",
+        type=float,
+        default=AUTOSAVE_INTERVAL,
+        help="seconds after which a changed book is saved in the background (0 to only save on exit)",
+    )
+    parser.add_argument(
+        "--autosave-every",
+        type=int,
+        default=AUTOSAVE_EVERY,
+        help="changes after which the book is saved in the background",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="commands run by --script between two saves of the book",
+    )
+    parser.add_argument(
+        "--events",
+        metavar="FILE",
+        help="append every change of the book to FILE as JSON lines",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=JOURNAL_FSYNC_POLICIES,
+        default=JOURNAL_FSYNC,
+        help="sync the journal to disk after every change, once per command (batch) or never",
+    )
+    parser.add_argument(
+        "command",
+        nargs=argparse.REMAINDER,
+        help="run this one command and exit, for example show-birthday anna",
+    )
+    options = parser.parse_args()
+    if options.migrate:
+        if options.migrate[1].endswith(".col"):
+            count = migrate_to_columnar(*options.migrate)
+        elif options.migrate[1].endswith(".shards"):
+            count = migrate_to_shards(*options.migrate)
         else:
-            print("Invalid command.")
+            count = migrate_to_sqlite(*options.migrate)
+        print(f"{count} contacts copied to {options.migrate[1]}")
+        return
+    if options.command:
+        command, *args = parse_input(" ".join(options.command))
+        if run_one_shot(options.data, command, args, options.events, fsync=options.fsync) == "error":
+            sys.exit(1)
+        return
+
+    book = open_book(options.data, options.fsync)
+    if options.events:
+        attach_event_sink(book, options.events)
+    if options.script:
+        if options.script == "-":
+            run_script(book, sys.stdin, options.batch_size)
+        else:
+            with open(options.script, encoding="utf-8") as f:
+                run_script(book, f, options.batch_size)
+        book.save()
+        book.close()
+        return
+
+    enable_completion(book)
+    autosave = Autosave(book, options.autosave_interval, options.autosave_every).start()
+    print(
+        "\n\t\t#######################################\n\n\t\tWelcome to your Personal Assistant app!\n\n\t\t#######################################\n\n\t\tType Hello to start!\n\n"
+    )
+    try:
+        while True:
+            user_input = input("Enter a command: ")
+            if not user_input.strip():
+                print('Please type Hello to see the menu options or "exit" to close.\n')
+                continue
+            command, *args = parse_input(user_input)
+            with autosave.lock:
+                status, result = dispatch(book, command, args)
+                if isinstance(result, str):
+                    print(result)
+                else:
+                    for piece in result:  # printed as it is produced
+                        sys.stdout.write(piece)
+                    print()
+                if is_exit(command):
+                    break
+                book.commit()
+    except (KeyboardInterrupt, EOFError):
+        print("\nGood bye!")
+    autosave.stop()
+    book.save()
+    book.close()
+
+
+def use_module_name(namespace):
+    # Run as a script, this file is the module __main__: its classes and functions
+    # are renamed to MODULE_NAME so that what it pickles can be read by any program
+    # importing Final_Project, like server.py
+    sys.modules.setdefault(MODULE_NAME, sys.modules["__main__"])
+    for value in namespace.values():
+        if isinstance(value, (type, types.FunctionType)) and value.__module__ == "__main__":
+            value.__module__ = MODULE_NAME
 
 
 if __name__ == "__main__":
+    use_module_name(globals())
     main()
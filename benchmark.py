@@ -0,0 +1,373 @@
+# Benchmarks for the Personal Assistant address book.
+#
+# Builds reproducible synthetic books and times the search, birthday and
+# storage operations of Final_Project, writing the results to JSON:
+#
+#     python benchmark.py --sizes 10000 100000 --output results.json
+#     python benchmark.py --sizes 10000 --compare results.json
+#     python benchmark.py --memory 1000000
+
+from datetime import date, datetime, timedelta
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+from Final_Project import (
+    AddressBook,
+    Record,
+    birthday_stats,
+    export_contacts,
+    find_duplicates,
+    findContacts,
+    import_contacts,
+    load_from_pickle,
+    numpy_installed,
+    save_to_pickle,
+    searchBy,
+    searchNote,
+    showBirthdaysInDays,
+)
+
+
+MEMORY_BUDGET = 820 * 2**20  # RAM the book and its indexes may take for MEMORY_BUDGET_CONTACTS contacts
+MEMORY_BUDGET_CONTACTS = 1_000_000
+# Records per second below which an import is reported by --compare, whatever the
+# baseline: about 85% of the rates reached on one core (see the README)
+IMPORT_RATE_FLOORS = {"import_csv": 28_000, "import_jsonl": 28_000, "import_vcf": 21_000}
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm St", "Lake Rd", "Hill St"]
+CITIES = ["Bucharest", "Cluj", "Iasi", "Timisoara", "Brasov", "Constanta", "Sibiu", "Oradea"]
+DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "mail.ro", "company.com"]
+TAGS = ["food", "hobby", "work", "family", "gift", "music", "sport", "travel"]
+WORDS = (
+    "likes vegan pizza pasta coffee tea chess football tennis guitar piano jazz rock books "
+    "movies hiking cycling running travel japan italy spain cats dogs garden cooking wine "
+    "birthday present meeting project deadline call email office remote conference"
+).split()
+
+
+def contact_name(index):
+    # Unique alphabetic names, as the book only accepts letters
+    name = ""
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        name = LETTERS[letter] + name
+    return "contact" + name
+
+
+def add_then_name_prefix(book, name):
+    book.add_record(name, "0123456789")
+    return list(book.names_with_prefix(name[:-1]))
+
+
+def add_then_phone_prefix(book, name):
+    phone = f"{zlib.crc32(name.encode()) % 10**10:010d}"
+    book.add_record(name, phone)
+    return list(book.phones_with_prefix(phone[:6]))
+
+
+def random_birthday(rnd, distribution):
+    if distribution == "clustered":
+        # Most birthdays in a few weeks of the year, like a class or a team
+        day_of_year = int(rnd.gauss(160, 20)) % 365
+    else:
+        day_of_year = rnd.randrange(365)
+    birthday = date(rnd.randint(1950, 2010), 1, 1) + timedelta(days=day_of_year)
+    if rnd.random() < 0.001:
+        birthday = date(rnd.choice([1992, 1996, 2000, 2004]), 2, 29)
+    return birthday
+
+
+def generate_book(size, seed=42, notes_per_contact=1.0, birthday_distribution="uniform"):
+    # Returns a book of size contacts that only depends on the arguments
+    rnd = random.Random(seed)
+    book = AddressBook()
+    records = []
+    for index in range(size):
+        name = contact_name(index)
+        notes = {}
+        for _ in range(min(len(TAGS), int(rnd.expovariate(1 / notes_per_contact)) if notes_per_contact else 0)):
+            notes[rnd.choice(TAGS)] = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 12)))
+        records.append(
+            Record.restore(
+                name,
+                phone=f"{rnd.randrange(10**9, 10**10)}",
+                email=f"{name}@{rnd.choice(DOMAINS)}" if rnd.random() < 0.7 else None,
+                address=f"{rnd.randint(1, 200)} {rnd.choice(STREETS)} {rnd.choice(CITIES)}" if rnd.random() < 0.6 else None,
+                birthday=random_birthday(rnd, birthday_distribution) if rnd.random() < 0.8 else None,
+                notes=notes,
+            )
+        )
+        if len(records) == 10000:
+            book.add_records(records)
+            records = []
+    book.add_records(records)
+    return book
+
+
+def budget_book(size, seed=42):
+    # The book of the memory budget: half the contacts have an email and a birthday,
+    # two thirds an address and a quarter a note
+    rnd = random.Random(seed)
+    book = AddressBook()
+    records = []
+    for index in range(size):
+        name = contact_name(index)
+        records.append(
+            Record.restore(
+                name,
+                phone=f"{rnd.randrange(10**9, 10**10)}",
+                email=f"{name}@{rnd.choice(DOMAINS)}" if rnd.random() < 0.5 else None,
+                address=f"{rnd.randint(1, 200)} {rnd.choice(STREETS)} {rnd.choice(CITIES)}" if rnd.random() < 2 / 3 else None,
+                birthday=random_birthday(rnd, "uniform") if rnd.random() < 0.5 else None,
+                notes={rnd.choice(TAGS): " ".join(rnd.sample(WORDS, 4))} if rnd.random() < 0.25 else None,
+            )
+        )
+        if len(records) == 10000:
+            book.add_records(records)
+            records = []
+    book.add_records(records)
+    return book
+
+
+def peak_rss():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes elsewhere
+
+
+def measure_memory(size, seed):
+    # Peak memory added to this process by a budget book of size contacts and all its
+    # indexes, against the budget scaled to size; run it in a fresh process
+    gc.collect()
+    before = peak_rss()
+    book = budget_book(size, seed)
+    list(book.get_birthdays_in_days(7))  # the sorted indexes are complete once looked up
+    list(book.names_with_prefix("zz"))
+    list(book.phones_with_prefix("9"))
+    used = peak_rss() - before
+    budget = MEMORY_BUDGET * size / MEMORY_BUDGET_CONTACTS
+    return {
+        "size": size,
+        "peak_rss_bytes": before + used,
+        "book_bytes": used,
+        "bytes_per_contact": used / size,
+        "budget_bytes": budget,
+        "within_budget": used <= budget,
+    }
+
+
+def sample_queries(book, rnd, count):
+    records = rnd.sample(list(book.values()), min(count, len(book)))
+    with_email = [record for record in records if record.email] or records
+    with_address = [record for record in records if record.address] or records
+    with_birthday = [record for record in records if record.birthday] or records
+    return {
+        "search_by_name": [["name", record.name.value] for record in records],
+        "search_by_phone": [["phone", record.phone.value] for record in records],
+        "search_by_email": [["email", str(record.email)] for record in with_email],
+        "search_by_address": [["address", *str(record.address).split()] for record in with_address],
+        "search_by_birthday": [
+            ["birthday", f"{record.birthday.value:%d.%m.%Y}"] for record in with_birthday if record.birthday
+        ] or [["birthday", "01.01.2000"]],
+    }
+
+
+def time_calls(function, arguments, repeat):
+    # Median and best time of one call, over repeat passes through all arguments
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for argument in arguments:
+            function(argument)
+        timings.append((time.perf_counter() - start) / len(arguments))
+    return statistics.median(timings), min(timings)
+
+
+def peak_memory(function, argument):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_size(size, seed, repeat, notes_per_contact, birthday_distribution, workdir):
+    start = time.perf_counter()
+    book = generate_book(size, seed, notes_per_contact, birthday_distribution)
+    build_time = time.perf_counter() - start
+    rnd = random.Random(seed + 1)
+    queries = sample_queries(book, rnd, 200)
+    today = date(2024, 1, 1)
+    edited = rnd.sample(list(book.values()), min(100, size))
+    added = (contact_name(index) for index in itertools.count(size))  # names not in the book yet
+    filename = os.path.join(workdir, f"book-{size}.pkl")
+    exports = {extension: os.path.join(workdir, f"book-{size}.{extension}") for extension in ("csv", "jsonl", "vcf")}
+    for export in exports.values():
+        export_contacts(book, export)
+
+    operations = {name: (lambda args: searchBy(args, book), values) for name, values in queries.items()}
+    operations.update(
+        {
+            "search_note_keyword": (lambda args: searchNote(args, book), [["pizza"], ["jazz"], ["cof"]]),
+            "search_note_all": (lambda args: searchNote(args, book), [["vegan", "pizza"], ["chess", "jazz"]]),
+            "search_note_any": (lambda args: searchNote(args, book), [["--any", "vegan", "jazz"]]),
+            "search_note_substring": (lambda args: searchNote(args, book), [["--substring", "an pi"]]),
+            "search_note_regex": (lambda args: searchNote(args, book), [["--regex", r"pizza\s+\w+\s+jazz"]]),
+            "get_birthdays_in_days": (lambda days: list(book.get_birthdays_in_days(days, today)), [7, 30, 365]),
+            "show_birthdays_in_days": (lambda days: showBirthdaysInDays(book, days), [7, 30]),
+            "edit_birthday_then_birthdays": (
+                lambda record: (record.add_birthday("15.06.1990"), list(book.get_birthdays_in_days(7, today))),
+                edited,
+            ),
+            "add_then_name_prefix": (lambda _: add_then_name_prefix(book, next(added)), [None] * 100),
+            "add_then_phone_prefix": (lambda _: add_then_phone_prefix(book, next(added)), [None] * 100),
+            "find_indexed": (lambda args: findContacts(args, book), [["birthday:03.*", "email:*@gmail.com", "note:vegan"]]),
+            "find_scan": (lambda args: findContacts(args, book), [["address:*main*", "note:*zza", "limit:1000"]]),
+            "find_duplicates": (lambda _: find_duplicates(book), [None]),
+            "birthday_stats_python": (lambda day: birthday_stats(book, day, use_numpy=False), [today]),
+            "save_to_pickle": (lambda path: save_to_pickle(book, path), [filename]),
+            "load_from_pickle": (lambda path: load_from_pickle(path).close(), [filename]),
+        }
+    )
+    operations.update(
+        {
+            f"import_{extension}": (lambda path: import_contacts(AddressBook(), path), [export])
+            for extension, export in exports.items()
+        }
+    )
+    if numpy_installed():
+        operations["birthday_stats_numpy"] = (lambda day: birthday_stats(book, day, use_numpy=True), [today])
+
+    results = [{"size": size, "operation": "generate_book", "median_s": build_time, "min_s": build_time}]
+    for operation, (function, arguments) in operations.items():
+        median, best = time_calls(function, arguments, repeat)
+        peak = peak_memory(function, arguments[0])
+        results.append(
+            {
+                "size": size,
+                "operation": operation,
+                "median_s": median,
+                "min_s": best,
+                "peak_memory_bytes": peak,
+            }
+        )
+        throughput = f" {size / median:>10.0f} records/s" if operation.startswith("import_") else ""
+        print(
+            f"{size:>9} {operation:<24} {median * 1000:>12.3f} ms {peak / 2**20:>10.2f} MB{throughput}", file=sys.stderr
+        )
+    return results
+
+
+def compare(results, baseline_filename, threshold):
+    # Returns the operations that got slower than threshold times the baseline,
+    # and the imports slower than their floor in IMPORT_RATE_FLOORS
+    with open(baseline_filename, encoding="utf-8") as f:
+        baseline = {(entry["size"], entry["operation"]): entry for entry in json.load(f)["results"]}
+    regressions = []
+    for entry in results:
+        floor = IMPORT_RATE_FLOORS.get(entry["operation"])
+        if floor and entry["size"] / entry["min_s"] < floor:
+            regressions.append(
+                {
+                    "size": entry["size"],
+                    "operation": entry["operation"],
+                    "floor_records_per_s": floor,
+                    "records_per_s": entry["size"] / entry["min_s"],
+                    "ratio": floor * entry["min_s"] / entry["size"],
+                }
+            )
+        previous = baseline.get((entry["size"], entry["operation"]))
+        if previous and previous["min_s"] > 0 and entry["min_s"] / previous["min_s"] > threshold:
+            regressions.append(
+                {
+                    "size": entry["size"],
+                    "operation": entry["operation"],
+                    "baseline_s": previous["min_s"],
+                    "current_s": entry["min_s"],
+                    "ratio": entry["min_s"] / previous["min_s"],
+                }
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Personal Assistant address book")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes per operation")
+    parser.add_argument("--notes-per-contact", type=float, default=1.0, help="average number of notes")
+    parser.add_argument("--birthdays", choices=["uniform", "clustered"], default="uniform")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument(
+        "--memory",
+        type=int,
+        metavar="SIZE",
+        help="only measure the memory of a book of SIZE contacts against the budget (1000000 for the README figure)",
+    )
+    options = parser.parse_args()
+    if options.memory:
+        memory = measure_memory(options.memory, options.seed)
+        with open(options.output, "w", encoding="utf-8") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "memory": memory}, f, indent=2)
+        print(
+            f"{memory['size']} contacts: {memory['book_bytes'] / 2**20:.0f} MB for the book and its indexes "
+            f"({memory['bytes_per_contact']:.0f} bytes per contact), {memory['peak_rss_bytes'] / 2**20:.0f} MB "
+            f"for the process; budget {memory['budget_bytes'] / 2**20:.0f} MB",
+            file=sys.stderr,
+        )
+        if not memory["within_budget"]:
+            sys.exit(1)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in options.sizes:
+            results += benchmark_size(
+                size, options.seed, options.repeat, options.notes_per_contact, options.birthdays, workdir
+            )
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": options.seed,
+        "notes_per_contact": options.notes_per_contact,
+        "birthdays": options.birthdays,
+        "results": results,
+    }
+    if options.compare:
+        report["regressions"] = compare(results, options.compare, options.threshold)
+    with open(options.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {options.output}", file=sys.stderr)
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            if "floor_records_per_s" in regression:
+                floor = regression["floor_records_per_s"]
+                slower = f"{regression['records_per_s']:.0f} records/s, under the floor of {floor}"
+            else:
+                slower = f"{regression['ratio']:.2f}x slower"
+            print(
+                f"Regression: {regression['operation']} at {regression['size']} contacts is {slower}", file=sys.stderr
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Load test for server.py.
+#
+# Opens many connections to a running server, sends a mix of searches and
+# changes with several requests in flight per connection, and reports the
+# requests per second and the latency percentiles:
+#
+#     python server.py --data loadtest.pkl &
+#     python loadtest.py --connections 50 --requests 20000 --write-ratio 0.1
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+from benchmark import contact_name
+
+
+async def populate(host, port, contacts):
+    # Adds the contacts the test searches for; existing ones are left as they are
+    reader, writer = await asyncio.open_connection(host, port)
+    for index in range(contacts):
+        request = {"command": "add", "args": [contact_name(index), f"{1_000_000_000 + index}"]}
+        writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    for _ in range(contacts):
+        await reader.readline()
+    writer.close()
+
+
+def make_request(rnd, request_id, contacts, write_ratio):
+    name = contact_name(rnd.randrange(contacts))
+    if rnd.random() < write_ratio:
+        args = [name, f"load{rnd.randrange(100)}", "written", "by", "the", "load", "test"]
+        return {"id": request_id, "command": "add-note", "args": args}, True
+    kind = rnd.choice(["name", "phone", "prefix", "birthdays"])
+    if kind == "name":
+        return {"id": request_id, "command": "search-by", "args": ["name", name]}, False
+    if kind == "phone":
+        phone = f"{1_000_000_000 + rnd.randrange(contacts)}"
+        return {"id": request_id, "command": "search-by", "args": ["phone", phone]}, False
+    if kind == "prefix":
+        return {"id": request_id, "command": "search-by", "args": ["name-prefix", name[:-1]]}, False
+    return {"id": request_id, "command": "birthdays", "args": ["7"]}, False
+
+
+async def run_connection(host, port, requests, pipeline, seed, contacts, write_ratio, latencies, errors):
+    rnd = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port, limit=2**24)
+    in_flight = asyncio.Semaphore(pipeline)
+    sent = {}
+
+    async def receive():
+        for _ in range(requests):
+            response = json.loads(await reader.readline())
+            started, is_write = sent.pop(response["id"])
+            latencies["write" if is_write else "read"].append(time.perf_counter() - started)
+            if response["status"] != "ok":
+                errors[response["output"]] = errors.get(response["output"], 0) + 1
+            in_flight.release()
+
+    receiver = asyncio.create_task(receive())
+    for request_id in range(requests):
+        await in_flight.acquire()
+        request, is_write = make_request(rnd, request_id, contacts, write_ratio)
+        sent[request_id] = (time.perf_counter(), is_write)
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+    await receiver
+    writer.close()
+
+
+def latency_summary(values):
+    if not values:
+        return {"requests": 0}
+    values = sorted(values)
+    return {
+        "requests": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": values[len(values) // 2] * 1000,
+        "p95_ms": values[int(len(values) * 0.95)] * 1000,
+        "p99_ms": values[int(len(values) * 0.99)] * 1000,
+    }
+
+
+async def load_test(options):
+    if options.contacts:
+        await populate(options.host, options.port, options.contacts)
+    latencies = {"read": [], "write": []}
+    errors = {}
+    per_connection = options.requests // options.connections
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_connection(
+                options.host,
+                options.port,
+                per_connection,
+                options.pipeline,
+                options.seed + connection,
+                options.contacts,
+                options.write_ratio,
+                latencies,
+                errors,
+            )
+            for connection in range(options.connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    total = per_connection * options.connections
+    return {
+        "connections": options.connections,
+        "pipeline": options.pipeline,
+        "write_ratio": options.write_ratio,
+        "requests": total,
+        "seconds": elapsed,
+        "requests_per_second": total / elapsed,
+        "read": latency_summary(latencies["read"]),
+        "write": latency_summary(latencies["write"]),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running Personal Assistant server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=20000, help="requests over all connections")
+    parser.add_argument("--pipeline", type=int, default=16, help="requests in flight per connection")
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--contacts", type=int, default=1000, help="contacts added before the test")
+    parser.add_argument("--seed", type=int, default=42)
+    options = parser.parse_args()
+
+    report = asyncio.run(load_test(options))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
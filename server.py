@@ -0,0 +1,261 @@
+# Network server for the Personal Assistant address book.
+#
+# Serves one book to many clients over TCP, one JSON object per line:
+#
+#     python server.py --data data.pkl --port 8765
+#     {"id": 1, "command": "search-by", "args": ["name", "anna"]}
+#     {"id": 1, "status": "ok", "output": "Contact: Anna, ..."}
+#
+# A request can also give the whole command as text: {"line": "add anna 0123456789"}.
+# Reads run in a pool of threads, so a slow one (all, a regex search) does not hold
+# up the other connections. Writes go through a single writer task that applies
+# them in order and commits the book once per batch, so concurrent writers share
+# one journal sync. A read/write lock keeps reads out while a batch is applied.
+
+import argparse
+import asyncio
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from Final_Project import (
+    COMMANDS,
+    JOURNAL_FSYNC,
+    JOURNAL_FSYNC_POLICIES,
+    attach_event_sink,
+    dispatch,
+    open_book,
+    output_text,
+    parse_input,
+)
+
+
+# Commands reading or writing files on the server, or stopping it, are not served
+LOCAL_COMMANDS = {"import", "export", "profile", "stats", "exit"}
+PIPELINE_DEPTH = 64  # requests read ahead from one connection
+WRITE_QUEUE_SIZE = 1024  # writes waiting for the writer task
+WRITE_BATCH_SIZE = 256  # most writes applied between two commits
+READ_THREADS = 4  # reads running at the same time
+
+
+def read_request(line):
+    # Returns the JSON object of one request line
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("A request must be a JSON object.")
+    return request
+
+
+def parse_request(request):
+    # Returns (command, args) of a request read by read_request, whose id is
+    # known before this checks the rest and is sent back with any error
+    if "line" in request:
+        line = request["line"]
+        if not isinstance(line, str):
+            raise ValueError("The command line must be a string.")
+        if not line.strip():
+            raise ValueError("The command line is empty.")
+        command, *args = parse_input(line)
+    else:
+        command = request.get("command", "")
+        args = request.get("args", [])
+        if not isinstance(command, str):
+            raise ValueError("The command must be a string.")
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            raise ValueError("The arguments must be a list of strings.")
+        command = command.strip().lower()
+    return command, args
+
+
+def run_command(book, command, args):
+    # Output produced while it is read, as by all, is read here with the lock held
+    status, output = dispatch(book, command, args)
+    return status, output_text(output)
+
+
+class ReadWriteLock:
+    # Any number of readers or a single writer. A waiting writer stops new readers
+    # from starting, so a steady stream of reads cannot hold the writes back.
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+        self.changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.writing and not self.writers_waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.readers -= 1
+                self.changed.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.changed:
+            self.writers_waiting += 1
+            try:
+                await self.changed.wait_for(lambda: not self.writing and not self.readers)
+            finally:
+                self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.writing = False
+                self.changed.notify_all()
+
+
+class Server:
+    def __init__(self, book, pipeline_depth=PIPELINE_DEPTH, read_threads=READ_THREADS):
+        self.book = book
+        self.pipeline_depth = pipeline_depth
+        self.writes = asyncio.Queue(WRITE_QUEUE_SIZE)
+        self.lock = ReadWriteLock()
+        self.readers = ThreadPoolExecutor(read_threads, thread_name_prefix="read")
+        self.connections = set()  # tasks serving the open connections
+
+    async def write_loop(self):
+        # Applies the queued writes in order and commits once per batch, until it
+        # gets None: the writes queued before it are applied first
+        while True:
+            batch = [await self.writes.get()]
+            while batch[-1] is not None and not self.writes.empty() and len(batch) < WRITE_BATCH_SIZE:
+                batch.append(self.writes.get_nowait())
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            if batch:
+                await self.apply(batch)
+            if stopping:
+                return
+
+    async def apply(self, batch):
+        async with self.lock.write():
+            results = [run_command(self.book, command, args) for command, args, _ in batch]
+            try:
+                self.book.commit()
+            except Exception as e:
+                results = [("error", f"The change could not be saved: {e}")] * len(batch)
+            self.book.sort_indexes()  # the reads only look the indexes up
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def read(self, command, args):
+        async with self.lock.read():
+            future = asyncio.get_running_loop().run_in_executor(self.readers, run_command, self.book, command, args)
+            try:
+                return await asyncio.shield(future)
+            finally:
+                if not future.done():  # the connection was closed, but the thread still reads the book
+                    await asyncio.wait([future])
+
+    async def execute(self, command, args):
+        entry = COMMANDS.get(command)
+        if entry is None or entry.name in LOCAL_COMMANDS:
+            return "error", "Invalid command."
+        if not entry.mutates:
+            return await self.read(command, args)
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((command, args, future))
+        return await future
+
+    async def read_requests(self, reader, requests):
+        # Reads ahead at most pipeline_depth requests: once the queue is full the
+        # connection is no longer read and TCP flow control slows the client down.
+        # Once cancelled nothing reads the queue, so the end is not queued.
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    await requests.put(line)
+        except (ConnectionError, ValueError):  # reset, or a line over the limit
+            pass
+        await requests.put(None)
+
+    async def handle_connection(self, reader, writer):
+        self.connections.add(asyncio.current_task())
+        requests = asyncio.Queue(self.pipeline_depth)
+        read_task = asyncio.create_task(self.read_requests(reader, requests))
+        try:
+            # Requests of one connection run in order, so a client sees its own writes
+            while (line := await requests.get()) is not None:
+                request_id = None
+                try:
+                    request = read_request(line)
+                    request_id = request.get("id")
+                    command, args = parse_request(request)
+                    status, output = await self.execute(command, args)
+                except ValueError as e:  # also raised for invalid JSON
+                    status, output = "error", f"Invalid request: {e}"
+                response = {"id": request_id, "status": status, "output": output_text(output).strip()}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()  # waits while the client is not reading its responses
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # closed by serve on shutdown; asyncio reports a cancelled connection task as an error
+        finally:
+            read_task.cancel()
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+
+async def serve(book, host, port, pipeline_depth=PIPELINE_DEPTH, read_threads=READ_THREADS):
+    book.sort_indexes()
+    server = Server(book, pipeline_depth, read_threads)
+    write_task = asyncio.create_task(server.write_loop())
+    listener = await asyncio.start_server(server.handle_connection, host, port, limit=2**20)
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal_number, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    print(f"Serving on {', '.join(str(socket.getsockname()) for socket in listener.sockets)}", flush=True)
+    async with listener:
+        await stop.wait()
+    # The open connections are closed, then the writes already queued, and the
+    # batch being applied, are done before the caller saves the book
+    for task in server.connections:
+        task.cancel()
+    await asyncio.gather(*server.connections, return_exceptions=True)
+    await server.writes.put(None)
+    await write_task
+    server.readers.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Personal Assistant address book over TCP")
+    parser.add_argument("--data", default="data.pkl", help="pickle file, columnar snapshot or SQLite database")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pipeline", type=int, default=PIPELINE_DEPTH, help="requests read ahead per connection")
+    parser.add_argument("--read-threads", type=int, default=READ_THREADS, help="reads running at the same time")
+    parser.add_argument("--events", metavar="FILE", help="append every change of the book to FILE as JSON lines")
+    parser.add_argument(
+        "--fsync",
+        choices=JOURNAL_FSYNC_POLICIES,
+        default=JOURNAL_FSYNC,
+        help="sync the journal to disk after every change, once per batch of writes or never",
+    )
+    options = parser.parse_args()
+
+    book = open_book(options.data, options.fsync)
+    if options.events:
+        attach_event_sink(book, options.events)
+    try:
+        asyncio.run(serve(book, options.host, options.port, options.pipeline, options.read_threads))
+    finally:
+        book.save()
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
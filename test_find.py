@@ -0,0 +1,227 @@
+# Tests of the searches of Final_Project spanning several fields.
+#
+# find-duplicates and find must return what a plain scan of every contact (or
+# every pair of contacts) returns, whichever index or range they read instead:
+#
+#     python -m unittest test_find
+
+import os
+import random
+import tempfile
+import unittest
+from datetime import date
+from fnmatch import fnmatchcase
+
+import Final_Project
+from Final_Project import AddressBook, Record, find_duplicates, is_glob, merge_contacts, run_query, tokenize
+
+
+NOTES = ["likes pizza", "vegan cook", "works at the bank", "plays chess on sundays", "pizza and chess"]
+
+
+def random_records(rnd, count=400):
+    # Values drawn from pools a little larger than the book, so that some are shared
+    records = []
+    for i in range(count):
+        name = "".join(rnd.choice("abcdefgh") for _ in range(rnd.randint(3, 7))) + "".join(
+            "abcdefghij"[int(digit)] for digit in str(i)
+        )
+        records.append(
+            Record.restore(
+                name,
+                f"0{rnd.randrange(600):09d}" if rnd.random() < 0.9 else None,
+                f"user{rnd.randrange(500)}@{rnd.choice(['mail.com', 'Work.org'])}" if rnd.random() < 0.6 else None,
+                f"{rnd.randrange(40)} {rnd.choice(['Main St', 'main st', 'Park Lane'])}" if rnd.random() < 0.6 else None,
+                date(rnd.randint(1980, 1983), rnd.randint(1, 2), rnd.randint(1, 28)) if rnd.random() < 0.6 else None,
+                {f"tag{n}": rnd.choice(NOTES) for n in range(rnd.randrange(3))},
+            )
+        )
+    return records
+
+
+def random_book(rnd, count=400):
+    book = AddressBook()
+    book.add_records(random_records(rnd, count))
+    return book
+
+
+def scan_duplicates(book):
+    # Every pair of contacts sharing a key, grouped into connected components
+    records = list(book.values())
+    keys = [dict(Final_Project.duplicate_keys(record)) for record in records]
+    groups = {i: {i} for i in range(len(records))}
+    reasons = {}
+    for i in range(len(records)):
+        for j in range(i + 1, len(records)):
+            shared = [kind for kind in keys[i] if keys[j].get(kind) == keys[i][kind]]
+            if shared:
+                first, second = groups[i], groups[j]
+                if first is not second:
+                    first |= second
+                    for k in second:
+                        groups[k] = first
+                reasons.setdefault(i, set()).update(shared)
+    found = {}
+    for i, group in groups.items():
+        if len(group) > 1:
+            kinds = set().union(*(reasons.get(k, set()) for k in group))
+            found[id(group)] = (sorted(records[k].name.value for k in group), sorted(kinds))
+    return sorted(found.values())
+
+
+class DuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.book = random_book(random.Random(3))
+
+    def test_groups_match_a_scan_of_every_pair(self):
+        groups = find_duplicates(self.book)
+        self.assertGreater(len(groups), 10)
+        self.assertEqual(groups, scan_duplicates(self.book))
+
+    def test_merging_every_group_leaves_no_duplicates(self):
+        # A merged contact can gather an address and a birthday from two others and
+        # so match a new contact: groups are merged again until none is left
+        book = self.book
+        for _ in range(10):
+            groups = find_duplicates(book)
+            if not groups:
+                break
+            for names, _ in groups:
+                kept, *others = names
+                expected = {field: getattr(book[kept], field) for field in Final_Project.MERGED_FIELDS}
+                for other in others:
+                    for field, value in expected.items():
+                        if not value:
+                            expected[field] = getattr(book[other], field)
+                merge_contacts(book, kept, others)
+                for other in others:
+                    self.assertNotIn(other, book)
+                for field, value in expected.items():
+                    self.assertEqual(getattr(book[kept], field), value, (kept, field))
+        self.assertEqual(find_duplicates(book), [])
+        # The indexes follow the merges
+        for record in book.values():
+            if record.phone:
+                self.assertEqual([found.name.value for found in book.find_by("phone", record.phone)], [record.name.value])
+
+    def test_merge_keeps_notes_and_reports_dropped_values(self):
+        book = AddressBook()
+        book.add_records(
+            [
+                Record.restore("anna", "0123456789", notes={"food": "likes pizza"}),
+                Record.restore("ann", "0123456789", "anna@mail.com", notes={"food": "vegan", "work": "bank"}),
+                Record.restore("annie", "0999999999", "ANNA@mail.com"),
+            ]
+        )
+        dropped = merge_contacts(book, "anna", ["ann", "annie"])
+
+        self.assertEqual(sorted(book), ["anna"])
+        self.assertEqual(book["anna"].notes, {"food": "likes pizza; vegan", "work": "bank"})
+        self.assertEqual(book["anna"].email.value, "anna@mail.com")
+        self.assertEqual(dropped, ["phone 0999999999 of Annie"])
+        self.assertEqual(book.search_notes(["vegan"]), [("anna", "food", "likes pizza; vegan")])
+
+
+def scan_matches(record, field, pattern):
+    # What a find condition means, checked on one contact without any index
+    if field == "note":
+        words = [word for part in pattern.lower().split() for word in ([part] if is_glob(part) else tokenize(part))]
+        return any(
+            all(any(fnmatchcase(token, word) if is_glob(word) else token.startswith(word) for token in tokenize(note)) for word in words)
+            for note in record.notes.values()
+        )
+    if field == "birthday":
+        if not record.birthday:
+            return False
+        parts = pattern.split(".")
+        parts = ["*"] * (3 - len(parts)) + [part if is_glob(part) else part.zfill(2) for part in parts]
+        return fnmatchcase(f"{record.birthday.value:%d.%m.%Y}", ".".join(parts))
+    value = getattr(record, field)
+    return bool(value) and fnmatchcase(value.value.lower(), pattern.lower())
+
+
+def random_conditions(rnd, record):
+    # Conditions on the values of record, of every kind an index, a range or a scan answers
+    name, phone = record.name.value, record.phone.value if record.phone else None
+    choices = [f"name:{name}", f"name:{name[:2]}*", f"name:*{name[-2:]}", f"name:{name[0]}?*"]
+    if phone:
+        choices += [f"phone:{phone}", f"phone:{phone[:4]}*", f"phone:*{phone[-3:]}", "phone:0??*"]
+    if record.email:
+        choices += [f"email:{record.email.value.upper()}", "email:*@work.org"]
+    if record.address:
+        choices += [f"address:{record.address.value}", "address:*park*"]
+    if record.birthday:
+        birthday = record.birthday.value
+        choices += [f"birthday:{birthday:%d.%m.%Y}", f"birthday:{birthday.month}.{birthday.year}", f"birthday:{birthday.year}"]
+        choices += [f"birthday:{birthday.month:02d}.*", f"birthday:{birthday.day}.*.*"]
+    for note in record.notes.values():
+        word = note.split()[0]
+        choices += [f"note:{word}", f"note:{word[:3]}", f"note:{word[:2]}*", f"note:{note}"]
+    return rnd.sample(choices, min(len(choices), rnd.randint(1, 3)))
+
+
+class QueryChecks:
+    # Mixed into one test case per kind of book, made by make_book
+
+    def make_book(self, records):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.rnd = random.Random(5)
+        self.book = self.make_book(random_records(self.rnd))
+        self.records = list(self.book.values())
+
+    def scan(self, args):
+        conditions, _ = Final_Project.parse_query(args)
+        return sorted(
+            record.name.value
+            for record in self.records
+            if all(scan_matches(record, field, pattern) for field, pattern in conditions)
+        )
+
+    def test_queries_match_a_scan(self):
+        for _ in range(300):
+            args = " ".join(random_conditions(self.rnd, self.rnd.choice(self.records))).split()
+            _, found, more = run_query(self.book, args + ["limit:1000"])
+            self.assertEqual(sorted(record.name.value for record in found), self.scan(args), args)
+            self.assertFalse(more)
+
+    def test_limit_stops_the_search(self):
+        args = ["phone:0*"]
+        expected = self.scan(args)
+        self.assertGreater(len(expected), 3)
+        _, found, more = run_query(self.book, args + ["limit:3"])
+        self.assertEqual(len(found), 3)
+        self.assertTrue(more)
+        self.assertLessEqual({record.name.value for record in found}, set(expected))
+
+    def test_plan_reads_the_narrowest_path(self):
+        record = next(record for record in self.records if record.phone and record.notes)
+        phone = record.phone.value
+        self.assertTrue(run_query(self.book, [f"phone:{phone}", "note:pizza"])[0].startswith("phone index"))
+        self.assertTrue(run_query(self.book, [f"phone:{phone[:6]}*"])[0].startswith("phone prefix"))
+        self.assertTrue(run_query(self.book, [f"phone:*{phone[-6:]}"])[0].startswith("phone suffix"))
+        self.assertTrue(run_query(self.book, ["birthday:02.*"])[0].startswith("birthday calendar"))
+        self.assertEqual(run_query(self.book, ["name:*"])[0], "scan")
+        self.assertEqual(run_query(self.book, ["email:*@work.org"])[0], "scan")
+
+
+class MemoryQueryTest(QueryChecks, unittest.TestCase):
+    def make_book(self, records):
+        book = AddressBook()
+        book.add_records(records)
+        return book
+
+
+class SQLiteQueryTest(QueryChecks, unittest.TestCase):
+    def make_book(self, records):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        book = Final_Project.SQLiteAddressBook(os.path.join(directory.name, "data.db"))
+        self.addCleanup(book.connection.close)
+        book.add_records(records)
+        return book
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+# Tests of the search indexes of Final_Project.
+#
+# Every index must answer what a scan of the whole book answers, whether it was
+# kept up to date change by change, built in bulk by add_records (and sorted on
+# its first lookup), or replaced by the queries of a SQLite book:
+#
+#     python -m unittest test_indexes
+
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import Final_Project
+from Final_Project import AddressBook, Record
+
+
+LETTERS = "abcde"  # few letters, so that names share prefixes and are close to each other
+EMAILS = ["anna@mail.com", "Anna@Mail.com", "bob@work.org", "carl@home.net", "dora@mail.com"]
+ADDRESSES = ["12 Main St", "12 main st", "5 Park Lane", "7 Hill Road", "1 Long Way"]
+BIRTHDAYS = [date(1992, 2, 29), date(1990, 2, 28), date(1985, 3, 1), date(1970, 1, 1), date(2000, 12, 31)]
+NOTES = ["likes pizza", "vegan cook", "works at the bank", "plays chess on sundays", "allergic to nuts"]
+
+
+def random_name(rnd):
+    return "".join(rnd.choice(LETTERS) for _ in range(rnd.randint(2, 6)))
+
+
+def random_phone(rnd):
+    return f"0{rnd.randrange(5)}{rnd.randrange(20):02d}{rnd.randrange(50):06d}"
+
+
+def random_birthday(rnd):
+    if rnd.random() < 0.3:
+        return rnd.choice(BIRTHDAYS)
+    return date.fromordinal(rnd.randint(date(1950, 1, 1).toordinal(), date(2010, 12, 31).toordinal()))
+
+
+def random_record(rnd, name):
+    return Record.restore(
+        name,
+        random_phone(rnd) if rnd.random() < 0.9 else None,
+        rnd.choice(EMAILS) if rnd.random() < 0.6 else None,
+        rnd.choice(ADDRESSES) if rnd.random() < 0.5 else None,
+        random_birthday(rnd) if rnd.random() < 0.7 else None,
+        {f"tag{i}": rnd.choice(NOTES) for i in range(rnd.randrange(3))},
+    )
+
+
+def random_records(rnd, count):
+    names = list(dict.fromkeys(random_name(rnd) for _ in range(count)))
+    return [random_record(rnd, name) for name in names]
+
+
+def edit_distance(first, second):
+    row = list(range(len(second) + 1))
+    for i, letter in enumerate(first, 1):
+        previous, row[0] = row[0], i
+        for j, other in enumerate(second, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (letter != other))
+    return row[-1]
+
+
+def random_edits(rnd, book, count):
+    # Single changes of every kind, and batches replacing some contacts
+    for _ in range(count):
+        names = list(book)
+        name = rnd.choice(names)
+        record = book[name]
+        kind = rnd.randrange(8)
+        if kind == 0:
+            record.add_phone(random_phone(rnd))
+        elif kind == 1:
+            record.add_email(rnd.choice(EMAILS))
+        elif kind == 2:
+            record.add_address(rnd.choice(ADDRESSES))
+        elif kind == 3:
+            record.add_birthday(f"{random_birthday(rnd):%d.%m.%Y}")
+        elif kind == 4:
+            record.add_note(f"tag{rnd.randrange(5)}", rnd.choice(NOTES))
+        elif kind == 5 and len(names) > 10:
+            book.delete_contact(name)
+        elif kind == 6:
+            new_name = random_name(rnd)
+            book[new_name] = random_record(rnd, new_name)
+        else:
+            batch = [random_name(rnd) for _ in range(3)] + rnd.sample(names, 2)
+            book.add_records([random_record(rnd, name) for name in batch])
+
+
+class IndexChecks:
+    # Mixed into one test case per kind of book, made by make_book
+
+    def make_book(self, records):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.rnd = random.Random(7)
+        self.book = self.make_book(random_records(self.rnd, 300))
+        random_edits(self.rnd, self.book, 200)
+
+    def test_field_indexes_match_a_scan(self):
+        book = self.book
+        records = list(book.values())
+        for field in AddressBook.INDEXED_FIELDS:
+            values = {AddressBook.index_key(field, getattr(record, field)): getattr(record, field) for record in records}
+            values.pop(None, None)
+            self.assertTrue(values)
+            for key, value in values.items():
+                expected = sorted(
+                    record.name.value for record in records if AddressBook.index_key(field, getattr(record, field)) == key
+                )
+                self.assertEqual(sorted(record.name.value for record in book.find_by(field, value)), expected, (field, key))
+        # Emails and addresses are found whatever their case
+        self.assertEqual(
+            sorted(record.name.value for record in book.find_by("email", Final_Project.Email("ANNA@MAIL.COM"))),
+            sorted(record.name.value for record in records if record.email and record.email.value.lower() == "anna@mail.com"),
+        )
+        self.assertEqual(book.find_by("phone", Final_Project.Phone("9999999999")), [])
+
+    def test_birthday_ranges_match_a_scan(self):
+        records = [record for record in self.book.values() if record.birthday]
+        for today in (date(2023, 2, 27), date(2024, 2, 28), date(2023, 12, 30), date(2024, 6, 1)):
+            for days in (0, 1, 7, 60, 365, 800):
+                last = date.fromordinal(today.toordinal() + days)
+                expected = {}
+                for year in range(today.year, last.year + 1):
+                    for record in records:
+                        birthday = record.birthday.value
+                        day = Final_Project.birthday_in_year(birthday.month, birthday.day, year)
+                        if today <= day <= last:
+                            expected.setdefault(day, []).append(record.name.value)
+                found = [(day, sorted(names)) for day, names in self.book.get_birthdays_in_days(days, today)]
+                self.assertEqual(found, sorted((day, sorted(names)) for day, names in expected.items()), (today, days))
+
+    def test_name_prefixes_match_a_scan(self):
+        names = sorted(self.book)
+        prefixes = [""] + list(LETTERS) + [first + second for first in LETTERS for second in LETTERS] + ["abcdef", "z"]
+        for prefix in prefixes:
+            expected = [name for name in names if name.startswith(prefix)]
+            self.assertEqual(list(self.book.names_with_prefix(prefix)), expected, prefix)
+
+    def test_fuzzy_names_match_a_scan(self):
+        names = list(self.book)
+        queries = self.rnd.sample(names, 10) + [random_name(self.rnd) for _ in range(10)] + ["a", "abcdeabcde"]
+        for query in queries:
+            for distance in (0, 1, 2):
+                expected = sorted(
+                    (edit_distance(query, name), name) for name in names if edit_distance(query, name) <= distance
+                )
+                self.assertEqual(sorted(self.book.names_within_distance(query, distance)), expected, (query, distance))
+
+    def test_phone_prefixes_and_suffixes_match_a_scan(self):
+        phones = sorted({record.phone.value for record in self.book.values() if record.phone})
+        samples = self.rnd.sample(phones, 10)
+        digits = ["", "0", "01", "9", "0123456789"] + [phone[:n] for phone in samples for n in (3, 6, 10)]
+        for prefix in digits:
+            expected = [phone for phone in phones if phone.startswith(prefix)]
+            self.assertEqual(list(self.book.phones_with_prefix(prefix)), expected, prefix)
+        digits = ["", "0", "19", "0123456789"] + [phone[-n:] for phone in samples for n in (3, 6, 10)]
+        for suffix in digits:
+            expected = sorted((phone for phone in phones if phone.endswith(suffix)), key=lambda phone: phone[::-1])
+            self.assertEqual(sorted(self.book.phones_with_suffix(suffix), key=lambda phone: phone[::-1]), expected, suffix)
+
+
+class IncrementalBookTest(IndexChecks, unittest.TestCase):
+    def make_book(self, records):
+        book = AddressBook()
+        for record in records:
+            book[record.name.value] = record
+        return book
+
+
+class BulkBookTest(IndexChecks, unittest.TestCase):
+    # The edits run before the first lookup sorts the bulk-built indexes
+    def make_book(self, records):
+        book = AddressBook()
+        book.add_records(records)
+        return book
+
+
+class SQLiteBookTest(IndexChecks, unittest.TestCase):
+    def make_book(self, records):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        book = Final_Project.SQLiteAddressBook(os.path.join(directory.name, "data.db"))
+        self.addCleanup(book.connection.close)
+        book.add_records(records)
+        return book
+
+
+@unittest.skipUnless(Final_Project.numpy_installed(), "NumPy is not installed")
+class NumpyBirthdayStatsTest(unittest.TestCase):
+    DAYS = [date(2024, 2, 29), date(2023, 2, 28), date(2023, 3, 1), date(2024, 2, 28), date(2023, 12, 31)]
+
+    def stats(self, book, today):
+        expected = Final_Project.birthday_stats(book, today, use_numpy=False)
+        self.assertEqual(Final_Project.birthday_stats(book, today, use_numpy=True), expected, today)
+        return expected
+
+    def test_counts_match_the_python_counts(self):
+        rnd = random.Random(9)
+        book = AddressBook()
+        book.add_records(random_records(rnd, 2000))
+        days = self.DAYS + [random_birthday(rnd) for _ in range(20)]
+        # Contacts born on one of the days, and with their birthday on it, are counted too
+        for n, today in enumerate(days):
+            suffix = "".join("abcdefghij"[int(digit)] for digit in str(n))
+            book.add_records(
+                [
+                    Record.restore("born" + suffix, birthday=today),
+                    Record.restore("party" + suffix, birthday=today.replace(year=1988)),
+                ]
+            )
+        for today in days:
+            self.stats(book, today)
+
+    def test_leap_day_birthdays(self):
+        book = AddressBook()
+        book.add_records([Record.restore("anna", "0123456789", birthday=date(1984, 2, 29))])
+        # Outside leap years the birthday is on 28 February, when anna is a year older
+        for today, ages in [
+            (date(2023, 2, 27), "30-39"),
+            (date(2023, 2, 28), "30-39"),
+            (date(2024, 2, 28), "30-39"),
+            (date(2024, 2, 29), "40-49"),
+            (date(2024, 3, 1), "40-49"),
+            (date(2025, 2, 28), "40-49"),
+        ]:
+            stats = self.stats(book, today)
+            self.assertEqual(stats["by_age"], {ages: 1}, today)
+            upcoming = Final_Project.upcoming_birthday(2, 29, today)
+            self.assertEqual(stats["by_weekday"][upcoming.strftime("%A")], 1, today)
+            week = (upcoming - today).days // 7
+            starts = [start for start, _, _ in stats["busiest_weeks"]]
+            self.assertEqual(starts, [today + timedelta(weeks=week)] * (week < 52), today)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+# Tests of the write-ahead journal of Final_Project.
+#
+# The journal is the one file whose damage loses contacts, so its replay is
+# checked after a clean close, a crash, a torn last write and a damaged entry,
+# and between the script and a program importing Final_Project:
+#
+#     python -m unittest test_journal
+
+import os
+import pickle
+import signal
+import string
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import Final_Project
+from Final_Project import Journal, load_from_pickle
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "Final_Project.py")
+
+
+def run_python(*args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=HERE)
+    kwargs.setdefault("check", True)
+    return subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, **kwargs)
+
+
+class JournalReplayTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "data.pkl")
+        self.journal = self.filename + ".journal"
+
+    def open(self):
+        book = load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        return book
+
+    def write_contacts(self, *names):
+        book = load_from_pickle(self.filename)
+        for number, name in enumerate(names):
+            book.add_record(name, f"{number:010d}")
+        book.commit()
+        book.close()
+
+    def test_changes_are_replayed_after_reopen(self):
+        book = load_from_pickle(self.filename)
+        book.add_record("anna", "0123456789")
+        book["anna"].add_email("anna@mail.com")
+        book["anna"].add_note("food", "likes pizza")
+        book.add_record("bob", "0987654321")
+        book.delete_contact("bob")
+        book.commit()
+        book.close()
+        self.assertFalse(os.path.exists(self.filename))
+
+        book = self.open()
+        self.assertEqual(list(book), ["anna"])
+        self.assertEqual(book["anna"].email.value, "anna@mail.com")
+        self.assertEqual(book["anna"].notes, {"food": "likes pizza"})
+        self.assertEqual([record.name.value for record in book.find_by("phone", book["anna"].phone)], ["anna"])
+
+    def test_changes_survive_a_crash(self):
+        run_python(
+            "-c",
+            "import os, Final_Project\n"
+            f"book = Final_Project.load_from_pickle({self.filename!r})\n"
+            "book.add_record('anna', '0123456789')\n"
+            "book.commit()\n"
+            "os._exit(1)\n",
+            check=False,
+        )
+        self.assertEqual(list(self.open()), ["anna"])
+
+    def test_crash_between_snapshot_and_journal_cut(self):
+        # The autosave child has swapped in a snapshot holding every entry, but the
+        # parent dies before dropping them from the journal
+        killed = run_python(
+            "-c",
+            "import os, signal, time, Final_Project\n"
+            f"book = Final_Project.load_from_pickle({self.filename!r})\n"
+            "autosave = Final_Project.Autosave(book, every=1)\n"
+            "book.add_record('anna', '0123456789')\n"
+            "book.add_records([Final_Project.Record.restore('bob', '0987654321')])\n"
+            "book['anna'].add_email('anna@mail.com')\n"
+            "book.commit()\n"
+            "Final_Project.Journal.drop_before = lambda *args: os.kill(os.getpid(), signal.SIGKILL)\n"
+            "autosave.poll()\n"
+            "for _ in range(1000):\n"
+            "    time.sleep(0.01)\n"
+            "    autosave.poll()\n",
+            check=False,
+        )
+        self.assertEqual(killed.returncode, -signal.SIGKILL)
+        self.assertGreater(os.path.getsize(self.journal), 0)
+
+        book = self.open()
+        self.assertEqual(book.seq, 3)
+        self.assertEqual(sorted(book), ["anna", "bob"])
+        self.assertEqual(book["anna"].email.value, "anna@mail.com")
+
+    def test_torn_last_entry_is_cut_off(self):
+        self.write_contacts("anna", "bob")
+        valid_size = os.path.getsize(self.journal)
+        entry = pickle.dumps(("put", "carl", Final_Project.Record("carl")), pickle.HIGHEST_PROTOCOL)
+        with open(self.journal, "ab") as f:
+            f.write(entry[: len(entry) // 2])
+
+        self.assertEqual(sorted(self.open()), ["anna", "bob"])
+        self.assertEqual(os.path.getsize(self.journal), valid_size)
+
+    def test_zeros_after_the_last_entry_are_cut_off(self):
+        self.write_contacts("anna")
+        valid_size = os.path.getsize(self.journal)
+        with open(self.journal, "ab") as f:
+            f.write(bytes(100))
+
+        self.assertEqual(list(self.open()), ["anna"])
+        self.assertEqual(os.path.getsize(self.journal), valid_size)
+
+    def test_damaged_entry_is_raised_and_kept(self):
+        self.write_contacts("anna")
+        with open(self.journal, "ab") as f:
+            f.write(b"damaged entry")
+            f.write(pickle.dumps(("put", "bob", Final_Project.Record("bob")), pickle.HIGHEST_PROTOCOL))
+        size = os.path.getsize(self.journal)
+
+        with self.assertRaises(pickle.UnpicklingError):
+            Journal.replay(self.journal, Final_Project.AddressBook())
+        self.assertEqual(os.path.getsize(self.journal), size)
+
+    def test_script_changes_are_read_by_importers(self):
+        # One-shot commands only write the journal, which server.py must read
+        run_python(SCRIPT, "--data", self.filename, "add", "anna", "0123456789")
+        size = os.path.getsize(self.journal)
+
+        self.assertEqual(list(self.open()), ["anna"])
+        self.assertEqual(os.path.getsize(self.journal), size)
+
+    def test_script_snapshot_is_read_by_importers(self):
+        run_python(SCRIPT, "--data", self.filename, "--script", "-", input="add anna 0123456789\n")
+
+        self.assertEqual(os.path.getsize(self.journal), 0)
+        self.assertEqual(list(self.open()), ["anna"])
+
+    def test_entries_saved_under_main_are_read(self):
+        # Journals written by the script before its classes were saved under Final_Project
+        record = Final_Project.Record.restore("anna", "0123456789")
+        entry = pickle.dumps(("put", "anna", record), 2).replace(b"cFinal_Project\n", b"c__main__\n")
+        self.assertIn(b"c__main__\n", entry)
+        with open(self.journal, "wb") as f:
+            f.write(entry)
+
+        self.assertEqual(self.open()["anna"].phone.value, "0123456789")
+
+    def test_added_batch_is_one_entry(self):
+        book = load_from_pickle(self.filename)
+        records = [Final_Project.Record.restore("anna", "0123456789", notes={"food": "likes pizza"})]
+        records.append(Final_Project.Record.restore("bob", "0987654321", birthday=date(1990, 6, 15)))
+        book.add_records(records)
+        book.commit()
+        book.close()
+        with open(self.journal, "rb") as f:
+            self.assertEqual(pickle.load(f)[1], "add")
+            self.assertEqual(f.read(), b"")
+
+        book = self.open()
+        self.assertEqual(sorted(book), ["anna", "bob"])
+        self.assertEqual(book["anna"].notes, {"food": "likes pizza"})
+        self.assertEqual(book["bob"].birthday.value, date(1990, 6, 15))
+        self.assertEqual([record.name.value for record in book.find_by("phone", book["bob"].phone)], ["bob"])
+
+    def test_empty_batch_is_not_journaled(self):
+        book = self.open()
+        book.add_records([])
+        book.commit()
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_seq_is_the_same_for_whole_and_one_shot_books(self):
+        self.write_contacts("anna", "bob")
+        book = load_from_pickle(self.filename)
+        book.save()
+        book.close()
+        run_python(SCRIPT, "--data", self.filename, "add-email", "anna", "anna@mail.com")
+        run_python(SCRIPT, "--data", self.filename, "add-email", "bob", "bob@mail.com")
+
+        partial = Final_Project.open_partial_book(self.filename, {"anna"})
+        self.addCleanup(partial.close)
+        self.assertEqual(self.open().seq, 4)
+        self.assertEqual(partial.seq, 4)
+
+    def test_replayed_changes_keep_their_seq(self):
+        # Numbers skipped by the writer, as for contacts a one-shot book did not hold
+        record = Final_Project.Record.restore("anna", "0123456789")
+        with open(self.journal, "wb") as f:
+            f.write(pickle.dumps((3, "put", "anna", record)))
+            f.write(pickle.dumps((7, "add", [("bob", "0987654321", None, None, 0, None)])))
+            f.write(pickle.dumps((9, "field", "anna", "email", "anna@mail.com")))
+
+        book = self.open()
+        seqs = []
+        book.subscribe(lambda event: seqs.append(event.seq))
+        book.add_record("carl", "0555555555")
+        self.assertEqual(sorted(book), ["anna", "bob", "carl"])
+        self.assertEqual(seqs, [10])
+
+    def test_compaction_waits_for_the_journal_to_outgrow_the_snapshot(self):
+        book = load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        names = [first + second for first in string.ascii_lowercase for second in string.ascii_lowercase]
+        book.add_records([Final_Project.Record.restore(name, f"{i:010d}") for i, name in enumerate(names)])
+        book.save()
+        snapshot_size = os.path.getsize(self.filename)
+        with mock.patch.object(Final_Project, "COMPACT_MIN_BYTES", 0):
+            edits = 0
+            while os.path.getsize(self.journal) + 100 < snapshot_size * Final_Project.COMPACT_RATIO:
+                book["aa"].add_phone(f"{edits:010d}")
+                book.commit()
+                edits += 1
+            self.assertEqual(os.path.getsize(self.filename), snapshot_size)
+            while os.path.getsize(self.journal):
+                book["aa"].add_phone(f"{edits:010d}")
+                book.commit()
+                edits += 1
+        self.assertGreater(edits, 10)
+        self.assertEqual(self.open()["aa"].phone.value, f"{edits - 1:010d}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# Tests of the scan engine behind the regular expression searches of Final_Project.
+#
+# Whether the rows are scanned here or by worker processes that only get the
+# changed contacts, a scan must return the rows a plain loop over the book
+# returns, in book order:
+#
+#     python -m unittest test_scan
+
+import random
+import re
+import unittest
+
+import Final_Project
+from Final_Project import AddressBook, Record, ScanEngine, contact_rows
+from test_find import NOTES, random_records
+
+
+def scan_book(book, dataset, pattern, columns):
+    regex = re.compile(pattern, re.IGNORECASE)
+    return [
+        row
+        for record in book.values()
+        for row in contact_rows(record)[dataset]
+        if any(regex.search(row[column]) for column in columns)
+    ]
+
+
+SEARCHES = [("notes", "pi.za", (2,)), ("notes", r"\bchess\b", (2,)), ("fields", "work|park", (1, 2))]
+
+
+class ScanEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(11)
+        self.book = AddressBook()
+        self.book.add_records(random_records(self.rnd, 300))
+
+    def engine(self, workers, parallel_min):
+        engine = ScanEngine(workers, parallel_min)
+        self.addCleanup(engine.close)
+        return engine
+
+    def check(self, engine, book):
+        for dataset, pattern, columns in SEARCHES:
+            self.assertEqual(
+                engine.scan(book, dataset, pattern, columns=columns), scan_book(book, dataset, pattern, columns), pattern
+            )
+
+    def edit(self, book, step):
+        names = list(book)
+        name = self.rnd.choice(names)
+        kind = self.rnd.randrange(5)
+        if kind == 0:
+            book.delete_contact(name)
+        elif kind == 1:
+            new_name = "new" + "".join("abcdefghij"[int(digit)] for digit in str(step))
+            book[new_name] = Record.restore(new_name, "0123456789", notes={"tag": self.rnd.choice(NOTES)})
+        elif kind == 2:
+            book[name].add_note(f"edit{step % 3}", self.rnd.choice(NOTES))
+        elif kind == 3:
+            book[name].add_email(f"user{step}@work.org")
+        else:
+            record = book[name]
+            del book[name]
+            book[name] = record  # moves to the end of the book
+
+    def test_process_workers_follow_the_changes(self):
+        engine = self.engine(3, 0)
+        self.check(engine, self.book)
+        self.assertEqual(len(engine.executors), 3)
+        for step in range(40):
+            self.edit(self.book, step)
+            self.check(engine, self.book)
+        self.assertEqual(len(engine.executors), 3)  # sent the changes, never rebuilt
+
+    def test_serial_scans_follow_the_changes(self):
+        engine = self.engine(1, 0)
+        for step in range(40):
+            self.edit(self.book, step)
+            self.check(engine, self.book)
+        self.assertEqual(engine.executors, [])
+
+    def test_growing_book_moves_to_the_workers(self):
+        engine = self.engine(2, len(self.book) * 3)
+        self.check(engine, self.book)
+        self.assertEqual(engine.executors, [])
+        self.book.add_records(random_records(random.Random(12), 600))
+        self.check(engine, self.book)
+        self.assertEqual(len(engine.executors), 2)
+
+    def test_another_book_is_sharded_again(self):
+        engine = self.engine(3, 0)
+        self.check(engine, self.book)
+        other = AddressBook()
+        other.add_records(random_records(random.Random(13), 100))
+        self.check(engine, other)
+        self.assertNotIn(engine._changed, self.book.subscribers)
+
+    def test_invalid_pattern_is_raised_before_the_workers(self):
+        engine = self.engine(3, 0)
+        with self.assertRaises(re.error):
+            engine.scan(self.book, "notes", "(")
+        self.check(engine, self.book)
+
+
+if __name__ == "__main__":
+    unittest.main()
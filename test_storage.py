@@ -0,0 +1,297 @@
+# Tests of the storage formats of Final_Project other than the pickle journal.
+#
+# Each format keeps the contacts and seq of the book it was saved from, and the
+# formats that save in parts must write and read back only what they need:
+#
+#     python -m unittest test_storage
+
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import Final_Project
+from Final_Project import Record, record_row
+from test_find import random_records
+
+
+def contents(book):
+    return sorted(record_row(record) for record in book.values())
+
+
+class SQLiteBookTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "data.db")
+
+    def open(self):
+        book = Final_Project.SQLiteAddressBook(self.filename)
+        self.addCleanup(book.close)
+        return book
+
+    def test_added_batch_replaces_contacts(self):
+        book = Final_Project.SQLiteAddressBook(self.filename)
+        book.add_record("anna", "0123456789")
+        anna = book["anna"]
+        events = []
+        book.subscribe(events.append)
+        book.add_records(
+            [
+                Record.restore("anna", "0111111111", notes={"food": "likes pizza"}),
+                Record.restore("bob", "0222222222", notes={"work": "engineer"}),
+                Record.restore("bob", "0333333333"),
+            ]
+        )
+        book.commit()
+
+        self.assertEqual([(event.seq, event.name) for event in events], [(2, "anna"), (3, "bob"), (4, "bob")])
+        self.assertIs(events[0].before, anna)
+        self.assertIsNone(events[1].before)
+        self.assertIs(events[2].before, events[1].after)
+        book.close()
+        book = self.open()
+        self.assertEqual(book.seq, 4)
+        self.assertEqual(sorted(book), ["anna", "bob"])
+        self.assertEqual(book["anna"].notes, {"food": "likes pizza"})
+        self.assertEqual(book["bob"].phone.value, "0333333333")
+        self.assertEqual(book["bob"].notes, {})
+
+    def test_failed_batch_changes_nothing(self):
+        book = self.open()
+        book.add_record("anna", "0123456789")
+        broken = Record.restore("carl", "0333333333")
+        broken.phone.value = object()  # cannot be written to the database
+        with self.assertRaises(Exception):
+            book.add_records([Record.restore("bob", "0222222222"), broken])
+        book.commit()
+
+        self.assertEqual(book.seq, 1)
+        self.assertEqual(list(book), ["anna"])
+        self.assertNotIn("bob", book.data.loaded)
+
+
+class ShardsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, "data.shards")
+
+    def open(self):
+        book = Final_Project.load_shards(self.directory)
+        self.addCleanup(book.close)
+        return book
+
+    def shard_files(self):
+        # inode of every shard file, which a rewrite replaces
+        return {
+            filename: os.stat(os.path.join(self.directory, filename)).st_ino
+            for filename in os.listdir(self.directory)
+            if filename != "manifest.json"
+        }
+
+    def test_save_writes_only_the_dirty_shards(self):
+        book = Final_Project.load_shards(self.directory)
+        book.add_records(random_records(random.Random(1), 300))
+        book.save()
+        before = self.shard_files()
+        self.assertGreater(len(before), 100)
+
+        names = sorted(book)
+        book[names[0]].add_email("anna@mail.com")
+        book.delete_contact(names[1])
+        book.add_record("zzzz", "0123456789")
+        changed = {Final_Project.shard_of(name, book.shard_count) for name in (names[0], names[1], "zzzz")}
+        self.assertEqual(book.dirty, changed)
+        book.save()
+        after = self.shard_files()
+        expected = {os.path.basename(Final_Project.shard_filename(self.directory, shard)) for shard in changed}
+        self.assertEqual({filename for filename in after if after[filename] != before.get(filename)}, expected)
+        self.assertEqual(book.dirty, set())
+        self.assertEqual(os.path.getsize(self.directory + ".journal"), 0)
+        saved, seq = contents(book), book.seq
+        book.close()
+
+        book = self.open()
+        self.assertEqual(contents(book), saved)
+        self.assertEqual(book.seq, seq)
+
+    def test_changes_after_the_save_are_replayed(self):
+        book = Final_Project.load_shards(self.directory)
+        book.add_records(random_records(random.Random(2), 50))
+        book.save()
+        name = next(iter(book))
+        book[name].add_note("food", "likes pizza")
+        book.commit()
+        saved, seq = contents(book), book.seq
+        book.close()
+
+        book = self.open()
+        self.assertEqual(contents(book), saved)
+        self.assertEqual(book.seq, seq)
+        # Loading the shards does not make them dirty, the replayed change does
+        self.assertEqual(book.dirty, {Final_Project.shard_of(name, book.shard_count)})
+        self.assertIn((name, "food", "likes pizza"), book.search_notes(["pizza"]))
+
+
+class OneShotTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "data.pkl")
+        book = Final_Project.load_from_pickle(self.filename)
+        book.add_records(random_records(random.Random(4), 300))
+        book.add_record("anna", "0123456789")
+        book.add_record("bob", "0987654321")
+        book.save()
+        self.saved, self.seq = contents(book), book.seq
+        book.close()
+        self.opened = []  # the partial books run_one_shot opened
+
+    def run_one_shot(self, command, *args):
+        def open_partial_book(*call):
+            book = open_partial(*call)
+            self.opened.append(book and sorted(book))
+            return book
+
+        open_partial = Final_Project.open_partial_book
+        output = io.StringIO()
+        with mock.patch.object(Final_Project, "open_partial_book", open_partial_book):
+            with contextlib.redirect_stderr(io.StringIO()):
+                status = Final_Project.run_one_shot(self.filename, command, list(args), output=output)
+        self.assertEqual(status, "ok", output.getvalue())
+        return output.getvalue()
+
+    def test_commands_read_only_their_contacts(self):
+        self.run_one_shot("add-email", "anna", "anna@mail.com")
+        self.assertEqual(self.opened, [None])  # no name index yet: read the whole book and wrote one
+        self.assertTrue(os.path.exists(self.filename + ".index"))
+        self.run_one_shot("add-address", "Bob", "5", "Park", "Lane")
+        self.run_one_shot("merge", "anna", "bob")
+        self.assertEqual(self.opened, [None, ["bob"], ["anna", "bob"]])
+        self.run_one_shot("add-note", "anna", "food", "likes", "pizza")
+        self.assertEqual(self.opened[-1], ["anna"])  # bob was merged into anna
+
+        book = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        # The snapshot was left as it is: the journal holds every change, of which the
+        # merge makes two (anna changed, bob deleted)
+        self.assertEqual(book.journal.entries, 5)
+        self.assertEqual(book.seq, self.seq + 5)
+        self.assertNotIn("bob", book)
+        self.assertEqual((book["anna"].email.value, book["anna"].address.value), ("anna@mail.com", "5 Park Lane"))
+        self.assertEqual(book.find_by("email", book["anna"].email), [book["anna"]])
+        self.assertEqual(book.search_notes(["pizza", "likes"])[-1:], [("anna", "food", "likes pizza")])
+        self.assertEqual(len(contents(book)), len(self.saved) - 1)
+
+    def test_unknown_contact_is_not_created(self):
+        output = io.StringIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            Final_Project.run_one_shot(self.filename, "add-email", ["nobody", "nobody@mail.com"], output=output)
+        book = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        self.assertEqual(contents(book), self.saved)
+        self.assertEqual(book.seq, self.seq)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "the autosave forks a child to write the snapshot")
+class AutosaveTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.filename = os.path.join(directory.name, "data.pkl")
+
+    def wait(self, autosave):
+        for _ in range(500):
+            autosave.poll()
+            if autosave.child is None:
+                return
+            time.sleep(0.01)
+        self.fail("the autosave child did not finish")
+
+    def test_child_saves_while_the_book_keeps_changing(self):
+        book = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        autosave = Final_Project.Autosave(book, interval=3600, every=5)
+        for number, name in enumerate(["carl", "dora", "emma", "fred"]):
+            book.add_record(name, f"{number:010d}")
+        autosave.poll()
+        self.assertIsNone(autosave.child)  # 4 changes, and the interval is far away
+        book.add_record("anna", "0123456789")
+        autosave.poll()
+        self.assertIsNotNone(autosave.child)
+        book.add_record("bob", "0987654321")  # made while the child writes the snapshot
+        book.commit()
+        saved = contents(book)
+        self.wait(autosave)
+
+        self.assertEqual((autosave.saves, autosave.failures), (1, 0))
+        with open(self.filename, "rb") as f:
+            snapshot = Final_Project.load_pickle(f)
+        self.assertNotIn("bob", snapshot)
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(book.journal.entries, 1)  # only the change made during the save is left
+        reopened = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(reopened.close)
+        self.assertEqual(contents(reopened), saved)
+        self.assertEqual(reopened.seq, book.seq)
+
+    def test_failed_save_keeps_the_journal(self):
+        book = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        autosave = Final_Project.Autosave(book, interval=3600, every=1)
+        book.add_record("anna", "0123456789")
+        book.commit()
+        size = os.path.getsize(self.filename + ".journal")
+        with mock.patch.object(Final_Project, "save_to_pickle", side_effect=OSError("disk full")):
+            autosave.poll()
+            self.wait(autosave)
+
+        self.assertEqual((autosave.saves, autosave.failures), (0, 1))
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(os.path.getsize(self.filename + ".journal"), size)
+        autosave.poll()
+        self.wait(autosave)  # tried again
+        self.assertEqual(autosave.saves, 1)
+        self.assertEqual(os.path.getsize(self.filename + ".journal"), 0)
+
+    def test_failed_shard_save_keeps_the_shards_dirty(self):
+        directory = os.path.join(self.directory, "data.shards")
+        book = Final_Project.load_shards(directory)
+        self.addCleanup(book.close)
+        autosave = Final_Project.Autosave(book, interval=3600, every=1)
+        book.add_record("anna", "0123456789")
+        dirty = set(book.dirty)
+        with mock.patch.object(Final_Project, "save_shards", side_effect=OSError("disk full")):
+            autosave.poll()
+            self.assertEqual(book.dirty, set())  # the child has them
+            self.wait(autosave)
+        self.assertEqual(book.dirty, dirty)
+        autosave.poll()
+        self.wait(autosave)
+        self.assertEqual(autosave.saves, 1)
+        self.assertEqual(Final_Project.read_manifest(directory)["seq"], 1)
+
+    def test_thread_saves_in_the_background(self):
+        book = Final_Project.load_from_pickle(self.filename)
+        self.addCleanup(book.close)
+        with mock.patch.object(Final_Project, "AUTOSAVE_POLL", 0.01):
+            autosave = Final_Project.Autosave(book, interval=0.05, every=1000).start()
+            book.add_record("anna", "0123456789")
+            for _ in range(500):
+                if autosave.saves:
+                    break
+                time.sleep(0.01)
+            autosave.stop()
+        self.assertEqual(autosave.saves, 1)
+        self.assertEqual(book.journal.compact_ratio, Final_Project.COMPACT_RATIO)
+        self.assertEqual(os.path.getsize(self.filename + ".journal"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()